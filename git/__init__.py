@@ -43,7 +43,7 @@ try:
     from git.diff import *                  # @NoMove @IgnorePep8
     from git.db import *                    # @NoMove @IgnorePep8
     from git.cmd import Git                 # @NoMove @IgnorePep8
-    from git.repo import Repo               # @NoMove @IgnorePep8
+    from git.repo import Repo, BlameCache   # @NoMove @IgnorePep8
     from git.remote import *                # @NoMove @IgnorePep8
     from git.index import *                 # @NoMove @IgnorePep8
     from git.util import (                  # @NoMove @IgnorePep8
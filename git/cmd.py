@@ -18,7 +18,10 @@ import subprocess
 import sys
 import threading
 from collections import OrderedDict
+from functools import partial
+from itertools import islice
 from textwrap import dedent
+from time import time
 
 from git.compat import (
     string_types,
@@ -56,7 +59,7 @@ execute_kwargs = {'istream', 'with_extended_output',
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
-__all__ = ('Git',)
+__all__ = ('Git', 'CatFilePool')
 
 
 # ==============================================================================
@@ -184,6 +187,15 @@ class Git(LazyMixin):
     # Enables debugging of GitPython's git commands
     GIT_PYTHON_TRACE = os.environ.get("GIT_PYTHON_TRACE", False)
 
+    # Maximum amount of persistent git-cat-file processes of each kind which may be used
+    # concurrently by threads sharing one instance, see CatFilePool.
+    # Override this value using `Git.CAT_FILE_POOL_SIZE = 8`
+    CAT_FILE_POOL_SIZE = 4
+
+    # Seconds after which idle persistent git-cat-file processes are terminated.
+    # If None, they are kept until clear_cache() is called.
+    CAT_FILE_POOL_IDLE_TIME = 60.0
+
     # If True, a shell will be used when executing git commands.
     # This should only be desirable on Windows, see https://github.com/gitpython-developers/GitPython/pull/126
     # and check `git/test_repo.py:TestRepo.test_untracked_files()` TC for an example where it is required.
@@ -423,21 +435,33 @@ class Git(LazyMixin):
         It behaves like a stream, but counts the data read and simulates an empty
         stream once our sized content region is empty.
         If not all data is read to the end of the objects's lifetime, we read the
-        rest to assure the underlying stream continues to work"""
+        rest to assure the underlying stream continues to work
 
-        __slots__ = ('_stream', '_nbr', '_size')
+        If a release callable is given, it will be called once all data including
+        the terminating newline was read, to hand the stream back to its owner."""
 
-        def __init__(self, size, stream):
+        __slots__ = ('_stream', '_nbr', '_size', '_release')
+
+        def __init__(self, size, stream, release=None):
             self._stream = stream
             self._size = size
             self._nbr = 0           # num bytes read
+            self._release = release
 
             # special case: if the object is empty, has null bytes, get the
             # final newline right away.
             if size == 0:
                 stream.read(1)
+                self._release_stream()
             # END handle empty streams
 
+        def _release_stream(self):
+            release = self._release
+            if release is not None:
+                self._release = None
+                release()
+            # END handle release
+
         def read(self, size=-1):
             bytes_left = self._size - self._nbr
             if bytes_left == 0:
@@ -455,6 +479,7 @@ class Git(LazyMixin):
             # check for depletion, read our final byte to make the stream usable by others
             if self._size - self._nbr == 0:
                 self._stream.read(1)    # final newline
+                self._release_stream()
             # END finish reading
             return data
 
@@ -476,6 +501,7 @@ class Git(LazyMixin):
             # handle final byte
             if self._size - self._nbr == 0:
                 self._stream.read(1)
+                self._release_stream()
             # END finish reading
 
             return data
@@ -516,6 +542,8 @@ class Git(LazyMixin):
                 # read and discard - seeking is impossible within a stream
                 # includes terminating newline
                 self._stream.read(bytes_left + 1)
+                self._nbr = self._size
+                self._release_stream()
             # END handle incomplete read
 
     def __init__(self, working_dir=None):
@@ -534,7 +562,7 @@ class Git(LazyMixin):
         # Extra environment variables to pass to git commands
         self._environment = {}
 
-        # cached command slots
+        # cached command slots, holding CatFilePool instances
         self.cat_file_header = None
         self.cat_file_all = None
 
@@ -1062,6 +1090,15 @@ class Git(LazyMixin):
         setattr(self, attr_name, cmd)
         return cmd
 
+    def _get_cat_file_pool(self, attr_name, **kwargs):
+        pool = getattr(self, attr_name)
+        if pool is not None:
+            return pool
+
+        pool = CatFilePool(self, kwargs, self.CAT_FILE_POOL_SIZE, self.CAT_FILE_POOL_IDLE_TIME)
+        setattr(self, attr_name, pool)
+        return pool
+
     def __get_object_header(self, cmd, ref):
         cmd.stdin.write(self._prepare_ref(ref))
         cmd.stdin.flush()
@@ -1072,16 +1109,136 @@ class Git(LazyMixin):
         the given ref.
 
         :note: The method will only suffer from the costs of command invocation
-            once and reuses the command in subsequent calls.
+            once and reuses the command in subsequent calls. It is threadsafe, as
+            each thread is served by its own command, see CatFilePool.
 
         :return: (hexsha, type_string, size_as_int)"""
-        cmd = self._get_persistent_cmd("cat_file_header", "cat_file", batch_check=True)
-        return self.__get_object_header(cmd, ref)
+        pool = self._get_cat_file_pool("cat_file_header", batch_check=True)
+        cmd = pool.checkout()
+        try:
+            header = self.__get_object_header(cmd, ref)
+        except ValueError:
+            # git answered with a single line, the command remains usable
+            pool.checkin(cmd)
+            raise
+        except Exception:
+            pool.discard(cmd)
+            raise
+        # END handle errors
+        pool.checkin(cmd)
+        return header
+
+    def _write_refs_ahead(self, cmd, refs, window):
+        """Write the given refs to the stdin of the given cat-file command ahead of time,
+        keeping at most window requests in flight.
+
+        :return: iterator yielding once for each response which may now be read from
+            the command's stdout, in order of the refs. It yields True for the last response,
+            once no more requests will be written."""
+        refs = iter(refs)
+        write = cmd.stdin.write
+        window = max(window, 2)     # to learn whether more refs follow while one response is pending
+        in_flight = 0
+        exhausted = False
+        while True:
+            # refill once half of the window was consumed, to keep the pipe busy
+            # while bounding the amount of buffered data on both ends. Before handing out
+            # the last pending response, we find out whether more refs follow
+            if not exhausted and (in_flight <= window // 2 or in_flight == 1):
+                free = window - in_flight
+                for ref in islice(refs, free):
+                    write(self._prepare_ref(ref))
+                    in_flight += 1
+                    free -= 1
+                # END for each ref to write
+                exhausted = free > 0
+                cmd.stdin.flush()
+            # END refill window
+            if not in_flight:
+                return
+            in_flight -= 1
+            yield exhausted and not in_flight
+        # END while there are responses
+
+    def iter_object_headers(self, refs, window=256):
+        """ As get_object_header, but requests the headers of many objects at once,
+        which saves a round-trip to the command per object.
+
+        :param refs: iterable of refs, i.e. hexshas
+        :param window: maximum amount of requests written before their responses are read.
+            It must be small enough for the requests to fit into the pipe's buffer.
+        :return: iterator yielding (hexsha, type_string, size_as_int) in order of the refs.
+            The command is handed back once the last response was read, even if the
+            iterator isn't exhausted afterwards.
+        :raise ValueError: if one of the refs could not be resolved"""
+        pool = self._get_cat_file_pool("cat_file_header", batch_check=True)
+        cmd = pool.checkout()
+        try:
+            readline = cmd.stdout.readline
+            for last in self._write_refs_ahead(cmd, refs, window):
+                header = self._parse_object_header(readline())
+                if last:
+                    pool.checkin(cmd)
+                    cmd = None
+                # END hand back command
+                yield header
+            # END for each response
+            if cmd is not None:
+                # there were no refs
+                pool.checkin(cmd)
+                cmd = None
+            # END handle no refs
+        finally:
+            # responses may still be pending if we were interrupted
+            if cmd is not None:
+                pool.discard(cmd)
+        # END handle command
+
+    def iter_object_data(self, refs, window=256):
+        """ As stream_object_data, but requests many objects at once, which saves a
+        round-trip to the command per object.
+
+        :param refs: iterable of refs, i.e. hexshas
+        :param window: see iter_object_headers
+        :return: iterator yielding (hexsha, type_string, size_as_int, stream) in order of
+            the refs. As with stream_object_data, the command is handed back once the
+            stream of the last object was read or deleted.
+        :raise ValueError: if one of the refs could not be resolved
+        :note: Each stream is only valid until the next item is retrieved from the iterator,
+            its unread data will be skipped."""
+        pool = self._get_cat_file_pool("cat_file_all", batch=True)
+        cmd = pool.checkout()
+        try:
+            readline = cmd.stdout.readline
+            stream = None
+            for last in self._write_refs_ahead(cmd, refs, window):
+                if stream is not None:
+                    stream.__del__()        # skip unread data
+                hexsha, typename, size = self._parse_object_header(readline())
+                if last:
+                    # the stream hands back the command once it is read
+                    stream = self.CatFileContentStream(size, cmd.stdout, partial(pool.checkin, cmd))
+                    cmd = None
+                else:
+                    stream = self.CatFileContentStream(size, cmd.stdout)
+                # END handle last response
+                yield (hexsha, typename, size, stream)
+            # END for each response
+            if stream is not None:
+                stream.__del__()
+            elif cmd is not None:
+                # there were no refs
+                pool.checkin(cmd)
+                cmd = None
+            # END handle no refs
+        finally:
+            if cmd is not None:
+                pool.discard(cmd)
+        # END handle command
 
     def get_object_data(self, ref):
         """ As get_object_header, but returns object data as well
-        :return: (hexsha, type_string, size_as_int,data_string)
-        :note: not threadsafe"""
+        :return: (hexsha, type_string, size_as_int,data_string)"""
         hexsha, typename, size, stream = self.stream_object_data(ref)
         data = stream.read(size)
         del(stream)
@@ -1091,10 +1248,21 @@ class Git(LazyMixin):
         """ As get_object_header, but returns the data as a stream
 
         :return: (hexsha, type_string, size_as_int, stream)
-        :note: This method is not threadsafe, you need one independent Command instance per thread to be safe !"""
-        cmd = self._get_persistent_cmd("cat_file_all", "cat_file", batch=True)
-        hexsha, typename, size = self.__get_object_header(cmd, ref)
-        return (hexsha, typename, size, self.CatFileContentStream(size, cmd.stdout))
+        :note: The command serving the stream is only handed to other requests once
+            the stream was read entirely or deleted. Threads may use this method
+            concurrently, but should not keep unread streams around."""
+        pool = self._get_cat_file_pool("cat_file_all", batch=True)
+        cmd = pool.checkout()
+        try:
+            hexsha, typename, size = self.__get_object_header(cmd, ref)
+        except ValueError:
+            pool.checkin(cmd)
+            raise
+        except Exception:
+            pool.discard(cmd)
+            raise
+        # END handle errors
+        return (hexsha, typename, size, self.CatFileContentStream(size, cmd.stdout, partial(pool.checkin, cmd)))
 
     def clear_cache(self):
         """Clear all kinds of internal caches to release resources.
@@ -1102,10 +1270,111 @@ class Git(LazyMixin):
         Currently persistent commands will be interrupted.
 
         :return: self"""
-        for cmd in (self.cat_file_all, self.cat_file_header):
-            if cmd:
-                cmd.__del__()
+        for pool in (self.cat_file_all, self.cat_file_header):
+            if pool:
+                pool.clear()
 
         self.cat_file_all = None
         self.cat_file_header = None
         return self
+
+
+class CatFilePool(object):
+
+    """A bounded pool of persistent git-cat-file processes, which allows threads sharing
+    one Git instance to read objects concurrently.
+
+    A process is checked out for the duration of a single request, and checked in once
+    its response was read entirely. Threads are handed the process they used last if it
+    is idle. Processes which have been idle for more than max_idle_time seconds are
+    terminated the next time the pool is used.
+
+    :note: If a thread holds all max_size processes itself, for instance because it keeps
+        unread streams around, additional processes are spawned instead of blocking
+        forever. These are terminated once they are checked in."""
+
+    __slots__ = ('_git', '_options', 'max_size', 'max_idle_time', '_cond', '_idle', '_busy', '_local')
+
+    def __init__(self, git, options, max_size=4, max_idle_time=None):
+        """
+        :param git: Git instance used to spawn the processes
+        :param options: dict of keyword arguments for git-cat-file, i.e. {'batch': True}
+        :param max_size: maximum amount of processes kept by the pool
+        :param max_idle_time: seconds after which idle processes are terminated,
+            or None to keep them until clear() is called"""
+        self._git = git
+        self._options = options
+        self.max_size = max_size
+        self.max_idle_time = max_idle_time
+        self._cond = threading.Condition()
+        self._idle = {}             # process -> time it was checked in
+        self._busy = {}             # process -> ident of the thread using it
+        self._local = threading.local()
+
+    def __len__(self):
+        """:return: amount of processes currently alive"""
+        return len(self._idle) + len(self._busy)
+
+    def _reap(self):
+        if self.max_idle_time is None:
+            return
+        deadline = time() - self.max_idle_time
+        for proc, last_used in list(self._idle.items()):
+            if last_used < deadline:
+                del self._idle[proc]
+                proc.__del__()
+            # END terminate idle process
+        # END for each idle process
+
+    def checkout(self):
+        """:return: process ready to receive a request. It must be returned using
+            checkin() once its response was consumed, or using discard()"""
+        ident = threading.current_thread().ident
+        with self._cond:
+            while True:
+                self._reap()
+                proc = getattr(self._local, 'proc', None)
+                if proc not in self._idle:
+                    # prefer the most recently used process, it is least likely to be reaped
+                    proc = max(self._idle, key=self._idle.get) if self._idle else None
+                # END handle thread affinity
+
+                if proc is not None:
+                    del self._idle[proc]
+                    break
+                if len(self._busy) < self.max_size or all(i == ident for i in self._busy.values()):
+                    proc = self._git._call_process('cat_file', istream=PIPE, as_process=True, **self._options)
+                    break
+                # END spawn process
+                self._cond.wait()
+            # END wait for process
+            self._busy[proc] = ident
+            self._local.proc = proc
+        return proc
+
+    def checkin(self, proc):
+        """Return the given process to the pool once its response was consumed entirely"""
+        with self._cond:
+            if self._busy.pop(proc, None) is None or len(self) >= self.max_size:
+                # it was cleared in the meanwhile, or exceeds our size
+                proc.__del__()
+            else:
+                self._idle[proc] = time()
+            # END handle process
+            self._cond.notify()
+
+    def discard(self, proc):
+        """Terminate the given checked-out process, as it cannot be used anymore"""
+        with self._cond:
+            self._busy.pop(proc, None)
+            self._cond.notify()
+        proc.__del__()
+
+    def clear(self):
+        """Terminate all processes, including the ones which are currently checked out"""
+        with self._cond:
+            for proc in list(self._idle) + list(self._busy):
+                proc.__del__()
+            self._idle.clear()
+            self._busy.clear()
+            self._cond.notify_all()
@@ -1,4 +1,16 @@
 """Module with our own gitdb implementation - it uses the git command"""
+from collections import OrderedDict
+from io import BytesIO
+import logging
+import mmap
+import os
+from struct import (
+    error as struct_error,
+    unpack_from
+)
+import threading
+import zlib
+
 from git.util import bin_to_hex, hex_to_bin
 from gitdb.base import (
     OInfo,
@@ -12,10 +24,227 @@ from .exc import (
     BadObject
 )
 
+import os.path as osp
+
+
+__all__ = ('GitCmdObjectDB', 'GitDB', 'GitHybridObjectDB', 'CachedObjectDB')
+
+log = logging.getLogger(__name__)
+
+#{ Pack Format
+
+# type ids of entries in pack files
+_pack_type_names = {1: b'commit', 2: b'tree', 3: b'blob', 4: b'tag'}
+_pack_type_ids = dict((v, k) for k, v in _pack_type_names.items())
+OFS_DELTA = 6
+REF_DELTA = 7
+
+# errors indicating data we cannot read in-process
+_read_errors = (zlib.error, struct_error, ValueError, IndexError, EnvironmentError)
+
+
+def _delta_header_size(delta, i):
+    """:return: tuple(next_index, size) of the variable length size stored at index i of the delta"""
+    size = 0
+    shift = 0
+    while True:
+        c = delta[i]
+        i += 1
+        size |= (c & 0x7f) << shift
+        shift += 7
+        if not c & 0x80:
+            return i, size
+    # END while size continues
+
+
+def apply_delta(base, delta):
+    """:return: bytes of the object created by applying the given git delta to base
+    :param base: bytes of the object the delta refers to
+    :param delta: bytes of the inflated delta, including its header
+    :raise ValueError: if the delta is invalid or does not apply to the base"""
+    i, src_size = _delta_header_size(delta, 0)
+    i, dst_size = _delta_header_size(delta, i)
+    if src_size != len(base):
+        raise ValueError("Delta expects a base of %i bytes, got %i" % (src_size, len(base)))
+
+    base = memoryview(base)
+    out = bytearray()
+    len_delta = len(delta)
+    while i < len_delta:
+        op = delta[i]
+        i += 1
+        if op & 0x80:
+            # copy from base - the bits of op tell which offset and size bytes follow
+            offset = size = 0
+            for bit, shift in ((0x01, 0), (0x02, 8), (0x04, 16), (0x08, 24)):
+                if op & bit:
+                    offset |= delta[i] << shift
+                    i += 1
+            # END for each offset byte
+            for bit, shift in ((0x10, 0), (0x20, 8), (0x40, 16)):
+                if op & bit:
+                    size |= delta[i] << shift
+                    i += 1
+            # END for each size byte
+            out += base[offset:offset + (size or 0x10000)]
+        elif op:
+            # insert the next op bytes
+            out += delta[i:i + op]
+            i += op
+        else:
+            raise ValueError("Invalid delta opcode 0")
+        # END handle opcode
+    # END for each opcode
+
+    if len(out) != dst_size:
+        raise ValueError("Delta produced %i bytes, expected %i" % (len(out), dst_size))
+    return bytes(out)
+
+
+def _map_file(path):
+    with open(path, 'rb') as fp:
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class PackIndexFile(object):
+
+    """Memory mapped pack index file (version 1 or 2) allowing to find the offset
+    of objects within its pack using the fanout table and a binary search"""
+
+    __slots__ = ('path', 'version', 'size', '_map', '_fanout', '_sha_ofs', '_offset_ofs', '_large_offset_ofs')
+
+    def __init__(self, path):
+        self.path = path
+        self._map = m = _map_file(path)
+        if m[:4] == b'\377tOc':
+            self.version = unpack_from('>L', m, 4)[0]
+            if self.version != 2:
+                raise ValueError("Unsupported pack index version %i in %s" % (self.version, path))
+            self._fanout = unpack_from('>256L', m, 8)
+            self.size = self._fanout[255]
+            self._sha_ofs = 8 + 256 * 4
+            # the crc32 table follows the shas
+            self._offset_ofs = self._sha_ofs + self.size * (20 + 4)
+            self._large_offset_ofs = self._offset_ofs + self.size * 4
+        else:
+            self.version = 1
+            self._fanout = unpack_from('>256L', m, 0)
+            self.size = self._fanout[255]
+            # entries are 4 byte offsets followed by their 20 byte sha
+            self._sha_ofs = 256 * 4 + 4
+            self._offset_ofs = self._large_offset_ofs = None
+        # END handle version
+
+    def offset(self, binsha):
+        """:return: offset of the object with the given binary sha in the pack, or None"""
+        first = binsha[0]
+        lo = first and self._fanout[first - 1] or 0
+        hi = self._fanout[first]
+        m = self._map
+        base = self._sha_ofs
+        stride = self.version == 2 and 20 or 24
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = base + mid * stride
+            sha = m[pos:pos + 20]
+            if sha < binsha:
+                lo = mid + 1
+            elif sha > binsha:
+                hi = mid
+            elif self.version == 1:
+                return unpack_from('>L', m, pos - 4)[0]
+            else:
+                offset = unpack_from('>L', m, self._offset_ofs + mid * 4)[0]
+                if offset & 0x80000000:
+                    offset = unpack_from('>Q', m, self._large_offset_ofs + (offset & 0x7fffffff) * 8)[0]
+                return offset
+            # END compare shas
+        # END binary search
+        return None
+
+    def close(self):
+        self._map.close()
+
+
+class PackFile(object):
 
-__all__ = ('GitCmdObjectDB', 'GitDB')
+    """Memory mapped pack file providing access to the raw entries at given offsets"""
 
-# class GitCmdObjectDB(CompoundDB, ObjectDBW):
+    __slots__ = ('path', 'index', '_map')
+
+    def __init__(self, index):
+        """:param index: PackIndexFile of this pack"""
+        self.index = index
+        self.path = index.path[:-len('.idx')] + '.pack'
+        self._map = m = _map_file(self.path)
+        if m[:4] != b'PACK' or unpack_from('>L', m, 4)[0] not in (2, 3):
+            raise ValueError("Invalid pack file header in %s" % self.path)
+
+    def entry_header(self, offset):
+        """:return: tuple(type_id, size, data_offset, base) of the entry at offset, where base
+            is the offset of the delta base for OFS_DELTA entries, its binary sha for REF_DELTA
+            entries and None otherwise"""
+        m = self._map
+        c = m[offset]
+        type_id = (c >> 4) & 7
+        size = c & 15
+        shift = 4
+        i = offset + 1
+        while c & 0x80:
+            c = m[i]
+            i += 1
+            size |= (c & 0x7f) << shift
+            shift += 7
+        # END read size
+
+        base = None
+        if type_id == OFS_DELTA:
+            c = m[i]
+            i += 1
+            delta_offset = c & 0x7f
+            while c & 0x80:
+                c = m[i]
+                i += 1
+                delta_offset = ((delta_offset + 1) << 7) | (c & 0x7f)
+            # END read negative offset
+            base = offset - delta_offset
+        elif type_id == REF_DELTA:
+            base = m[i:i + 20]
+            i += 20
+        elif type_id not in _pack_type_names:
+            raise ValueError("Invalid type %i of pack entry at offset %i in %s" % (type_id, offset, self.path))
+        # END handle type
+        return type_id, size, i, base
+
+    def inflate(self, data_offset, size, max_size=None):
+        """:return: the inflated data of size bytes starting at data_offset
+        :param max_size: if set, inflate no more than the given amount of bytes"""
+        d = zlib.decompressobj()
+        limit = max_size is None and size or min(size, max_size)
+        # compressed data usually is smaller than the inflated data, but has a little overhead
+        # if it is incompressible - read more if this was not enough
+        chunk_size = size + size // 1000 + 64
+        out = []
+        remaining = limit
+        while remaining and not d.eof:
+            chunk = d.unconsumed_tail or self._map[data_offset:data_offset + chunk_size]
+            if not chunk:
+                raise ValueError("Unexpected end of pack file %s" % self.path)
+            if not d.unconsumed_tail:
+                data_offset += len(chunk)
+            data = d.decompress(chunk, remaining)
+            out.append(data)
+            remaining -= len(data)
+        # END while there is data to inflate
+        data = b''.join(out)
+        if max_size is None and len(data) != size:
+            raise ValueError("Pack entry inflated to %i bytes, expected %i" % (len(data), size))
+        return data
+
+    def close(self):
+        self._map.close()
+
+#} END pack format
 
 
 class GitCmdObjectDB(LooseObjectDB):
@@ -26,6 +255,8 @@ class GitCmdObjectDB(LooseObjectDB):
     It will create objects only in the loose object database.
     :note: for now, we use the git command to do all the lookup, just until he
         have packs and the other implementations
+    :note: reading objects is threadsafe, as concurrent requests are served by a pool of
+        persistent git-cat-file processes, see ``git.cmd.CatFilePool``.
     """
 
     def __init__(self, root_path, git):
@@ -38,10 +269,28 @@ class GitCmdObjectDB(LooseObjectDB):
         return OInfo(hex_to_bin(hexsha), typename, size)
 
     def stream(self, sha):
-        """For now, all lookup is done by git itself"""
+        """For now, all lookup is done by git itself
+        :note: the stream should be read entirely, as its process is only handed to
+            other requests afterwards"""
         hexsha, typename, size, stream = self._git.stream_object_data(bin_to_hex(sha))
         return OStream(hex_to_bin(hexsha), typename, size, stream)
 
+    def info_many(self, shas, window=256):
+        """:return: iterator yielding OInfo instances for the given binary shas, in order.
+            Requests are written ahead of reading their responses, which is considerably
+            faster than calling info() for each sha.
+        :param window: maximum amount of requests in flight, see Git.iter_object_headers
+        :raise ValueError: if one of the objects does not exist"""
+        for hexsha, typename, size in self._git.iter_object_headers((bin_to_hex(sha) for sha in shas), window):
+            yield OInfo(hex_to_bin(hexsha), typename, size)
+
+    def stream_many(self, shas, window=256):
+        """:return: iterator yielding OStream instances for the given binary shas, in order,
+            see ``info_many``.
+        :note: each stream is only valid until the next one is retrieved"""
+        for hexsha, typename, size, stream in self._git.iter_object_data((bin_to_hex(sha) for sha in shas), window):
+            yield OStream(hex_to_bin(hexsha), typename, size, stream)
+
     # { Interface
 
     def partial_to_complete_sha_hex(self, partial_hexsha):
@@ -58,3 +307,380 @@ class GitCmdObjectDB(LooseObjectDB):
         # END handle exceptions
 
     #} END interface
+
+
+class GitHybridObjectDB(GitCmdObjectDB):
+
+    """A database reading loose objects and pack files of the repository and its alternates
+    in-process, which avoids a round-trip to a git-cat-file process per object.
+
+    Pack indices and packs are memory mapped. Objects are looked up using the fanout table
+    and a binary search in the index, and deltas are resolved in-process. Objects we cannot
+    find or read, like objects of promisor remotes which git fetches on demand, are retrieved
+    using the git command, as done by the GitCmdObjectDB.
+
+    Use it like ``Repo(path, odbt=GitHybridObjectDB)``.
+
+    :note: object data is inflated into memory entirely, streams are in-memory streams"""
+
+    # Maximum amount of bytes of resolved delta bases to keep, to speed up reading
+    # objects with long delta chains
+    delta_base_cache_limit = 16 * 1024 * 1024
+
+    def __init__(self, root_path, git):
+        super(GitHybridObjectDB, self).__init__(root_path, git)
+        self._packs = None                  # list of PackFiles, lazily initialized
+        self._object_dirs = None            # our root path and the ones of our alternates
+        self._lock = threading.Lock()
+        self._base_cache = OrderedDict()    # (pack, offset) -> (type_id, data)
+        self._base_cache_size = 0
+
+    #{ Utilities
+
+    def _iter_object_dirs(self, path, seen):
+        path = osp.normpath(path)
+        if path in seen:
+            return
+        seen.add(path)
+        yield path
+        try:
+            with open(osp.join(path, 'info', 'alternates'), 'rb') as fp:
+                alternates = fp.read().decode('utf-8').splitlines()
+        except EnvironmentError:
+            return
+        for alt in alternates:
+            alt = alt.strip()
+            if alt and not alt.startswith('#'):
+                for alt_path in self._iter_object_dirs(osp.join(path, alt), seen):
+                    yield alt_path
+        # END for each alternate
+
+    def _update_packs(self):
+        """Update our list of packs from the pack directories
+        :return: True if the list of packs changed"""
+        if self._object_dirs is None:
+            self._object_dirs = list(self._iter_object_dirs(self.root_path(), set()))
+        # END init object dirs
+
+        known = dict((pack.index.path, pack) for pack in self._packs or ())
+        packs = []
+        for object_dir in self._object_dirs:
+            pack_dir = osp.join(object_dir, 'pack')
+            try:
+                names = os.listdir(pack_dir)
+            except EnvironmentError:
+                continue
+            for name in names:
+                if not name.endswith('.idx'):
+                    continue
+                path = osp.join(pack_dir, name)
+                pack = known.get(path)
+                if pack is None:
+                    try:
+                        pack = PackFile(PackIndexFile(path))
+                    except _read_errors as err:
+                        log.debug("Ignoring pack %s as it cannot be read: %r", path, err)
+                        continue
+                    # END handle unreadable packs
+                # END map new pack
+                packs.append(pack)
+            # END for each pack index
+        # END for each object directory
+
+        # larger packs are more likely to contain the objects we look for
+        packs.sort(key=lambda pack: pack.index.size, reverse=True)
+        changed = self._packs is None or set(packs) != set(self._packs)
+        self._packs = packs
+        return changed
+
+    def _find(self, binsha):
+        """:return: tuple(pack, offset) of the packed object with the given sha, or None"""
+        if self._packs is None:
+            self._update_packs()
+        for pack in self._packs:
+            offset = pack.index.offset(binsha)
+            if offset is not None:
+                return pack, offset
+        # END for each pack
+        return None
+
+    def _read_loose(self, binsha, header_only=False):
+        """:return: tuple(type_name, size, data) of the loose object with the given sha,
+            or None if there is no such loose object. data is None if header_only is True"""
+        hexsha = bin_to_hex(binsha).decode('ascii')
+        for object_dir in self._object_dirs:
+            try:
+                with open(osp.join(object_dir, hexsha[:2], hexsha[2:]), 'rb') as fp:
+                    raw = header_only and fp.read(512) or fp.read()
+            except EnvironmentError:
+                continue
+            # END skip missing objects
+
+            if header_only:
+                data = zlib.decompressobj().decompress(raw, 64)
+            else:
+                data = zlib.decompress(raw)
+            # END inflate object
+            end = data.index(b'\0')
+            type_name, size = data[:end].split(b' ')
+            size = int(size)
+            if header_only:
+                return type_name, size, None
+            data = data[end + 1:]
+            if len(data) != size:
+                raise ValueError("Loose object %s has %i bytes, expected %i" % (hexsha, len(data), size))
+            return type_name, size, data
+        # END for each object directory
+        return None
+
+    def _packed_info(self, pack, offset):
+        """:return: tuple(type_name, size) of the packed object at the given offset"""
+        type_id, size, data_offset, base = pack.entry_header(offset)
+        if base is None:
+            return _pack_type_names[type_id], size
+
+        # the size is stored in the header of the delta, the type is the one of its base
+        delta_header = pack.inflate(data_offset, size, max_size=20)
+        size = _delta_header_size(delta_header, _delta_header_size(delta_header, 0)[0])[1]
+        while base is not None:
+            if type_id == REF_DELTA:
+                location = self._find(base)
+                if location is None:
+                    return self._read_base(base, header_only=True)[0], size
+                pack, base = location
+            # END resolve base sha
+            type_id, _base_size, _data_offset, base = pack.entry_header(base)
+        # END while base is a delta
+        return _pack_type_names[type_id], size
+
+    def _cache_base(self, key, type_id, data):
+        if len(data) > self.delta_base_cache_limit // 4:
+            return
+        with self._lock:
+            if key in self._base_cache:
+                return
+            self._base_cache[key] = (type_id, data)
+            self._base_cache_size += len(data)
+            while self._base_cache_size > self.delta_base_cache_limit:
+                _key, (_type_id, old_data) = self._base_cache.popitem(last=False)
+                self._base_cache_size -= len(old_data)
+            # END evict least recently used bases
+        # END with lock
+
+    def _cached_base(self, key):
+        with self._lock:
+            item = self._base_cache.get(key)
+            if item is not None:
+                self._base_cache.move_to_end(key)
+            return item
+        # END with lock
+
+    def _packed_data(self, pack, offset):
+        """:return: tuple(type_name, data) of the packed object at the given offset"""
+        deltas = []
+        while True:
+            item = deltas and self._cached_base((pack, offset))
+            if item:
+                type_id, data = item
+                break
+            # END use cached base
+
+            type_id, size, data_offset, base = pack.entry_header(offset)
+            if base is None:
+                data = pack.inflate(data_offset, size)
+                if deltas:
+                    self._cache_base((pack, offset), type_id, data)
+                break
+            # END handle non-delta
+
+            deltas.append((pack, offset, data_offset, size))
+            if type_id == REF_DELTA:
+                location = self._find(base)
+                if location is None:
+                    # the base may be stored elsewhere, i.e. in thin packs
+                    type_name, data = self._read_base(base)[::2]
+                    type_id = _pack_type_ids[type_name]
+                    break
+                pack, base = location
+            # END resolve base sha
+            offset = base
+        # END while there are deltas to follow
+
+        # apply deltas in reverse order, each result is the base of the next delta
+        for i, (pack, offset, data_offset, size) in enumerate(reversed(deltas)):
+            data = apply_delta(data, pack.inflate(data_offset, size))
+            if i < len(deltas) - 1:
+                self._cache_base((pack, offset), type_id, data)
+        # END for each delta
+        return _pack_type_names[type_id], data
+
+    def _read(self, binsha, header_only=False):
+        """:return: tuple(type_name, size, data) of the object, or None if it was not found.
+            data is None if header_only is True"""
+        for attempt in range(2):
+            location = self._find(binsha)
+            if location is not None:
+                if header_only:
+                    return self._packed_info(*location) + (None,)
+                type_name, data = self._packed_data(*location)
+                return type_name, len(data), data
+            # END handle packed object
+
+            item = self._read_loose(binsha, header_only)
+            if item is not None:
+                return item
+
+            # new packs may have been written in the meanwhile, i.e. by git-gc or git-fetch
+            if attempt or not self._update_packs():
+                break
+        # END for each attempt
+        return None
+
+    def _read_base(self, binsha, header_only=False):
+        """As _read, but for the base of a delta, which must exist
+        :raise ValueError: if the base could not be found"""
+        item = self._read(binsha, header_only)
+        if item is None:
+            raise ValueError("Delta base %s not found" % bin_to_hex(binsha).decode('ascii'))
+        return item
+
+    def _read_in_process(self, binsha, header_only):
+        try:
+            return self._read(binsha, header_only)
+        except _read_errors as err:
+            log.debug("Failed to read object %s in-process: %r", bin_to_hex(binsha), err)
+            return None
+        # END handle unreadable data
+
+    #} END utilities
+
+    def info(self, sha):
+        item = self._read_in_process(sha, header_only=True)
+        if item is None:
+            return super(GitHybridObjectDB, self).info(sha)
+        return OInfo(sha, item[0], item[1])
+
+    def stream(self, sha):
+        item = self._read_in_process(sha, header_only=False)
+        if item is None:
+            return super(GitHybridObjectDB, self).stream(sha)
+        return OStream(sha, item[0], item[1], BytesIO(item[2]))
+
+    def info_many(self, shas, window=256):
+        for sha in shas:
+            yield self.info(sha)
+
+    def stream_many(self, shas, window=256):
+        for sha in shas:
+            yield self.stream(sha)
+
+
+class CachedObjectDB(object):
+
+    """Wraps any object database, like the GitCmdObjectDB or the GitDB, to keep the data of
+    recently read objects in memory. As objects are immutable, repeated reads of the same
+    object, i.e. of trees shared by many commits, are served without querying the wrapped
+    database again.
+
+    The cache is bounded by the amount of bytes of object data it holds, and evicts the least
+    recently used objects first. All other methods are forwarded to the wrapped database.
+
+    Use it like ``repo.odb = CachedObjectDB(repo.odb)``.
+
+    :note: the cache is threadsafe"""
+
+    __slots__ = ('odb', 'max_bytes', 'max_object_size', 'hits', 'misses',
+                 '_cache', '_size', '_lock')
+
+    # amount of bytes we account for each cached entry, in addition to the object data
+    entry_overhead = 64
+
+    def __init__(self, odb, max_bytes=32 * 1024 * 1024, max_object_size=None):
+        """Initialize this instance
+
+        :param odb: object database to read objects from
+        :param max_bytes: maximum amount of bytes to keep in the cache
+        :param max_object_size: objects larger than this are never cached, and are streamed from the
+            wrapped database directly. Defaults to an eighth of max_bytes"""
+        self.odb = odb
+        self.max_bytes = max_bytes
+        self.max_object_size = max_bytes // 8 if max_object_size is None else max_object_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()     # binsha -> (type, size, data or None)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        if attr == 'odb':
+            raise AttributeError(attr)
+        return getattr(self.odb, attr)
+
+    #{ Utilities
+
+    def _get(self, binsha, need_data):
+        with self._lock:
+            item = self._cache.get(binsha)
+            if item is None or (need_data and item[2] is None):
+                self.misses += 1
+                return None
+            self._cache.move_to_end(binsha)
+            self.hits += 1
+            return item
+        # END with lock
+
+    def _set(self, binsha, type, size, data):
+        cost = self.entry_overhead + (data is not None and len(data) or 0)
+        with self._lock:
+            old = self._cache.pop(binsha, None)
+            if old is not None:
+                self._size -= self.entry_overhead + (old[2] is not None and len(old[2]) or 0)
+            self._cache[binsha] = (type, size, data)
+            self._size += cost
+            while self._size > self.max_bytes and self._cache:
+                _binsha, (_type, _size, old_data) = self._cache.popitem(last=False)
+                self._size -= self.entry_overhead + (old_data is not None and len(old_data) or 0)
+            # END evict least recently used objects
+        # END with lock
+
+    #} END utilities
+
+    #{ Interface
+
+    @property
+    def size(self):
+        """:return: amount of bytes currently accounted for by the cache"""
+        return self._size
+
+    def __len__(self):
+        """:return: amount of cached objects"""
+        return len(self._cache)
+
+    def clear_cache(self):
+        """Remove all objects from the cache and reset the hit and miss counters"""
+        with self._lock:
+            self._cache.clear()
+            self._size = 0
+            self.hits = self.misses = 0
+        # END with lock
+
+    def info(self, sha):
+        item = self._get(sha, need_data=False)
+        if item is not None:
+            return OInfo(sha, item[0], item[1])
+        info = self.odb.info(sha)
+        self._set(sha, info.type, info.size, None)
+        return info
+
+    def stream(self, sha):
+        item = self._get(sha, need_data=True)
+        if item is not None:
+            return OStream(sha, item[0], item[1], BytesIO(item[2]))
+        ostream = self.odb.stream(sha)
+        if ostream.size > self.max_object_size:
+            return ostream
+        data = ostream.read()
+        self._set(sha, ostream.type, ostream.size, data)
+        return OStream(sha, ostream.type, ostream.size, BytesIO(data))
+
+    #} END interface
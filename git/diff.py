@@ -3,21 +3,27 @@
 #
 # This module is part of GitPython and is released under
 # the BSD License: http://www.opensource.org/licenses/bsd-license.php
+from io import BytesIO
+import mmap
 import re
+import tempfile
+import threading
 
 from git.cmd import handle_process_output
 from git.compat import (
     defenc,
-    PY3
+    PY3,
+    string_types
 )
-from git.util import finalize_process, hex_to_bin
+from git.util import bin_to_hex, finalize_process, hex_to_bin
 
 from .compat import binary_type
 from .objects.blob import Blob
+from .objects.fun import diff_trees, diff_tree_to_entries, find_renames, MAX_SCORE
 from .objects.util import mode_str_to_int
 
 
-__all__ = ('Diffable', 'DiffIndex', 'Diff', 'NULL_TREE')
+__all__ = ('Diffable', 'DiffIndex', 'Diff', 'Hunk', 'PatchBuffer', 'NULL_TREE')
 
 # Special object to compare against the empty tree in diffs
 NULL_TREE = object()
@@ -54,6 +60,39 @@ def decode_path(path, has_ab_prefix=True):
     return path
 
 
+# keyword arguments of git-diff which configure the detection of renames and copies
+_rename_option_names = ('M', 'find_renames', 'C', 'find_copies')
+
+
+def _rename_options(kwargs):
+    """:return: list of (name, value) tuples of the options in kwargs which git would use to detect renames
+        and copies, in the order they are passed to git"""
+    return [(name, value) for name, value in kwargs.items()
+            if name in _rename_option_names and value is not False and value is not None]
+
+
+def _rename_score(value):
+    """:return: minimum similarity of renames as fraction of MAX_SCORE, for the value of a rename or copy
+        option, which is interpreted like git does. True yields git's default of 50%"""
+    if value is True:
+        return MAX_SCORE // 2
+    num, scale, dot = 0, 1, False
+    for c in str(value):
+        if c == '.' and not dot:
+            scale, dot = 1, True
+        elif c == '%':
+            scale = scale * 100 if dot else 100
+            break
+        elif c.isdigit():
+            if scale < 100000:
+                scale *= 10
+                num = num * 10 + int(c)
+        else:
+            break
+    # END for each character
+    return MAX_SCORE if num >= scale else MAX_SCORE * num // scale
+
+
 class Diffable(object):
 
     """Common interface for all object that can be diffed against another object of compatible type.
@@ -100,21 +139,150 @@ class Diffable(object):
         :param kwargs:
             Additional arguments passed to git-diff, such as
             R=True to swap both sides of the diff.
+            If numstat=True, the insertions and deletions of each Diff are set as well. They are
+            obtained in the same git call, or counted in the patch if create_patch is True.
+            If in_process=True, two trees or commits, or a tree and the index, are compared
+            without running git, see
+            ``_diff_in_process()``.
 
         :return: git.DiffIndex
 
         :note:
             On a bare repository, 'other' needs to be provided as Index or as
             as Tree/Commit, or a git command error will occur"""
+        if kwargs.pop('in_process', False):
+            return self._diff_in_process(other, paths, create_patch, kwargs)
+        numstat = kwargs.pop('numstat', False)
+        proc = self._diff_process(other, paths, create_patch, kwargs, numstat)
+
+        if create_patch:
+            diff_method = Diff._index_from_patch_format
+        elif numstat:
+            diff_method = Diff._index_from_raw_numstat_format
+        else:
+            diff_method = Diff._index_from_raw_format
+        index = diff_method(self.repo, proc)
+
+        proc.wait()
+        if numstat and create_patch:
+            for diff in index:
+                diff._set_numstat_from_patch()
+        # END count lines in patches
+        return index
+
+    def iter_diff(self, other=Index, paths=None, create_patch=False, **kwargs):
+        """As ``diff()``, but returns an iterator yielding each Diff as soon as git wrote it,
+        instead of reading git's entire output first.
+
+        Patches are parsed line by line, hence the memory used is bounded by the size of the
+        largest patch of a single file rather than the size of the whole diff.
+
+        :return: iterator yielding git.Diff instances
+        :note: see ``diff()`` for a description of all parameters. git prints the line counts
+            of all files after all raw diffs, hence diffs without patch are only yielded once git
+            is done if numstat=True"""
+        if kwargs.get('in_process') or (kwargs.get('numstat') and not create_patch):
+            return iter(self.diff(other, paths, create_patch, **kwargs))
+        numstat = kwargs.pop('numstat', False)
+        proc = self._diff_process(other, paths, create_patch, kwargs)
+        if create_patch:
+            return Diff._iter_from_patch_format(self.repo, proc, numstat)
+        return Diff._iter_from_raw_format(self.repo, proc)
+
+    def _diff_tree_binsha(self, item):
+        """:return: binary sha of the tree of the given Tree, Commit, Tag or revision"""
+        if isinstance(item, string_types):
+            item = self.repo.rev_parse(item)
+        while getattr(item, 'type', None) == 'tag':
+            item = item.object
+        # END dereference tags
+        if getattr(item, 'type', None) == 'commit':
+            item = item.tree
+        if getattr(item, 'type', None) != 'tree':
+            raise ValueError("Cannot compare the tree of %r in-process" % (item,))
+        return item.binsha
+
+    def _diff_in_process(self, other, paths, create_patch, kwargs):
+        """Compare the trees of self and other by reading them from the object database, skipping subtrees
+        which are the same on both sides. Renames and copies are detected like git does, see
+        ``git.objects.fun.find_renames``.
+
+        :param other: Tree, Commit, Tag, revision string, Index to compare our tree against the index of
+            the repository, or NULL_TREE, which compares the empty tree against our tree like
+            git-diff-tree --root does.
+        :param paths: list of paths or a single path, without wildcards
+        :param kwargs: R=True to swap both sides, find_renames=<score> to set the minimum similarity
+            of renames and C=True or find_copies=<score> to detect copies as well. Scores are given
+            like git expects them, i.e. find_renames='60%' or find_renames=6
+        :return: git.DiffIndex with Diffs in raw format"""
+        swap = kwargs.pop('R', False)
+        min_score = MAX_SCORE // 2
+        copies = False
+        for name, value in _rename_options(kwargs):
+            copies = name in ('C', 'find_copies')
+            min_score = _rename_score(value)
+        # END for each rename option, the last one wins
+        for name in _rename_option_names:
+            kwargs.pop(name, None)
+        if create_patch or kwargs:
+            raise ValueError("In-process diffs don't support patches or any of %s" % (sorted(kwargs),))
+        if other is None:
+            raise ValueError("In-process diffs compare trees or a tree and the index, not the working tree")
+
+        if paths is not None:
+            if not isinstance(paths, (tuple, list)):
+                paths = [paths]
+            paths = [p.rstrip('/') for p in paths]
+            if any(c in p for p in paths for c in '*?['):
+                raise ValueError("In-process diffs don't support wildcards in paths: %r" % (paths,))
+            if '' in paths or '.' in paths:
+                paths = None
+            paths = paths or None
+        # END handle paths
+
+        a_sha = self._diff_tree_binsha(self)
+        if other is self.Index:
+            entries = []
+            for (path, stage), entry in self.repo.index.entries.items():
+                if stage:
+                    raise ValueError("In-process diffs don't support unmerged paths like %r" % path)
+                entries.append((entry.binsha, entry.mode, path))
+            # END for each index entry
+            changes = diff_tree_to_entries(self.repo.odb, a_sha, entries, paths)
+            if swap:
+                changes = [(b, a) for a, b in changes]
+        else:
+            if other is NULL_TREE:
+                a_sha, b_sha = None, a_sha
+            else:
+                b_sha = self._diff_tree_binsha(other)
+            if swap:
+                a_sha, b_sha = b_sha, a_sha
+            changes = diff_trees(self.repo.odb, a_sha, b_sha, '', paths)
+        # END handle other side
+
+        index = DiffIndex()
+        for a, b, change_type in find_renames(self.repo.odb, changes, min_score, bool(copies)):
+            index.append(Diff._from_tree_change(self.repo, a, b, change_type))
+        # END for each change
+        return index
+
+    def _diff_process(self, other, paths, create_patch, kwargs, numstat=False):
+        """:return: git-diff process writing the diff of self and other, see ``diff()``"""
         args = []
         args.append("--abbrev=40")        # we need full shas
         args.append("--full-index")       # get full index paths, not only filenames
 
-        args.append("-M")                 # check for renames, in both formats
+        if not _rename_options(kwargs):
+            args.append("-M")             # check for renames, in both formats
         if create_patch:
             args.append("-p")
         else:
             args.append("--raw")
+            if numstat:
+                # paths are printed as they are, instead of being quoted
+                args.extend(("--numstat", "-z"))
+        # END handle format
 
         # in any way, assure we don't see colored output,
         # fixes https://github.com/gitpython-developers/GitPython/issues/172
@@ -144,15 +312,18 @@ class Diffable(object):
         # END paths handling
 
         kwargs['as_process'] = True
-        proc = diff_cmd(*self._process_diff_args(args), **kwargs)
+        return diff_cmd(*self._process_diff_args(args), **kwargs)
 
-        diff_method = (Diff._index_from_patch_format
-                       if create_patch
-                       else Diff._index_from_raw_format)
-        index = diff_method(self.repo, proc)
 
-        proc.wait()
-        return index
+def _drops_lookups(method):
+    """:return: wrapper of the given list method, which drops the lookup tables of the DiffIndex
+        before altering it"""
+    def wrapper(self, *args, **kwargs):
+        self._lookups = None
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
 
 
 class DiffIndex(list):
@@ -160,7 +331,8 @@ class DiffIndex(list):
     """Implements an Index for diffs, allowing a list of Diffs to be queried by
     the diff properties.
 
-    The class improves the diff handling convenience"""
+    The class improves the diff handling convenience. Lookups by path and change type
+    use tables which are built on first use, and dropped once the list is altered."""
     # change type invariant identifying possible ways a blob can have changed
     # A = Added
     # D = Deleted
@@ -169,6 +341,74 @@ class DiffIndex(list):
     # T = Changed in the type
     change_type = ("A", "D", "R", "M", "T")
 
+    # tuple(diffs_by_path, diffs_by_change_type), or None if not built yet
+    _lookups = None
+
+    append = _drops_lookups(list.append)
+    extend = _drops_lookups(list.extend)
+    insert = _drops_lookups(list.insert)
+    remove = _drops_lookups(list.remove)
+    pop = _drops_lookups(list.pop)
+    clear = _drops_lookups(list.clear)
+    sort = _drops_lookups(list.sort)
+    reverse = _drops_lookups(list.reverse)
+    __setitem__ = _drops_lookups(list.__setitem__)
+    __delitem__ = _drops_lookups(list.__delitem__)
+    __iadd__ = _drops_lookups(list.__iadd__)
+    __imul__ = _drops_lookups(list.__imul__)
+
+    @classmethod
+    def _change_types_of(cls, diff):
+        """:return: list of change types the given diff matches, see ``iter_change_type``"""
+        change_types = []
+        for change_type in cls.change_type:
+            if diff.change_type == change_type:
+                change_types.append(change_type)
+            elif change_type == "A" and diff.new_file:
+                change_types.append(change_type)
+            elif change_type == "D" and diff.deleted_file:
+                change_types.append(change_type)
+            elif change_type == "R" and diff.renamed:
+                change_types.append(change_type)
+            elif change_type == "M" and diff.a_blob and diff.b_blob and diff.a_blob != diff.b_blob:
+                change_types.append(change_type)
+        # END for each change type
+        return change_types
+
+    def _get_lookups(self):
+        lookups = self._lookups
+        if lookups is None:
+            by_path = {}
+            by_change_type = dict((change_type, []) for change_type in self.change_type)
+            for diff in self:
+                a_path, b_path = diff.a_path, diff.b_path
+                for path in (a_path, b_path != a_path and b_path or None):
+                    if path is not None:
+                        by_path.setdefault(path, []).append(diff)
+                # END for each path
+                for change_type in self._change_types_of(diff):
+                    by_change_type[change_type].append(diff)
+            # END for each diff
+            lookups = self._lookups = (dict((path, tuple(diffs)) for path, diffs in by_path.items()),
+                                       dict((ct, tuple(diffs)) for ct, diffs in by_change_type.items()))
+        # END build lookups
+        return lookups
+
+    def by_path(self, path):
+        """
+        :return: tuple of Diff instances whose a_path or b_path is the given path, in the order
+            they are listed in. It's empty if no diff touches the path
+        :param path: path relative to the repository root"""
+        return self._get_lookups()[0].get(path, ())
+
+    def changes(self, change_type):
+        """
+        :return: tuple of Diff instances that match the given change_type, see ``iter_change_type``
+        :raise ValueError: if the change type is invalid"""
+        if change_type not in self.change_type:
+            raise ValueError("Invalid change type: %s" % change_type)
+        return self._get_lookups()[1][change_type]
+
     def iter_change_type(self, change_type):
         """
         :return:
@@ -183,20 +423,8 @@ class DiffIndex(list):
             * 'M' for paths with modified data
             * 'T' for changed in the type paths
          """
-        if change_type not in self.change_type:
-            raise ValueError("Invalid change type: %s" % change_type)
-
-        for diff in self:
-            if diff.change_type == change_type:
-                yield diff
-            elif change_type == "A" and diff.new_file:
-                yield diff
-            elif change_type == "D" and diff.deleted_file:
-                yield diff
-            elif change_type == "R" and diff.renamed:
-                yield diff
-            elif change_type == "M" and diff.a_blob and diff.b_blob and diff.a_blob != diff.b_blob:
-                yield diff
+        for diff in self.changes(change_type):
+            yield diff
         # END for each diff
 
 
@@ -230,7 +458,12 @@ class Diff(object):
         as a corresponding object does not yet exist. The mode will be null as well.
         But the path will be available though.
         If it is listed in a diff the working tree version of the file must
-        be different to the version in the index or tree, and hence has been modified."""
+        be different to the version in the index or tree, and hence has been modified.
+
+    ``Line Counts``
+
+        insertions and deletions are None unless the diff was created with numstat=True.
+        They are 0 for binary files."""
 
     # precompiled regex
     re_header = re.compile(br"""
@@ -254,11 +487,11 @@ class Diff(object):
 
     __slots__ = ("a_blob", "b_blob", "a_mode", "b_mode", "a_rawpath", "b_rawpath",
                  "new_file", "deleted_file", "raw_rename_from", "raw_rename_to",
-                 "diff", "change_type", "score")
+                 "_diff", "change_type", "score", "insertions", "deletions")
 
     def __init__(self, repo, a_rawpath, b_rawpath, a_blob_id, b_blob_id, a_mode,
                  b_mode, new_file, deleted_file, raw_rename_from,
-                 raw_rename_to, diff, change_type, score):
+                 raw_rename_to, diff, change_type, score, insertions=None, deletions=None):
 
         self.a_mode = a_mode
         self.b_mode = b_mode
@@ -295,10 +528,13 @@ class Diff(object):
         self.diff = diff
         self.change_type = change_type
         self.score = score
+        self.insertions = insertions
+        self.deletions = deletions
 
     def __eq__(self, other):
+        # compare the patch text, not its location
         for name in self.__slots__:
-            if getattr(self, name) != getattr(other, name):
+            if getattr(self, name.lstrip('_')) != getattr(other, name.lstrip('_')):
                 return False
         # END for each name
         return True
@@ -307,7 +543,18 @@ class Diff(object):
         return not (self == other)
 
     def __hash__(self):
-        return hash(tuple(getattr(self, n) for n in self.__slots__))
+        return hash(tuple(getattr(self, n.lstrip('_')) for n in self.__slots__))
+
+    def __getstate__(self):
+        # patches are copied out of their PatchBuffer, which cannot be pickled
+        state = dict((name, getattr(self, name)) for name in self.__slots__)
+        state['_diff'] = self.diff
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        # END for each attribute
 
     def __str__(self):
         h = "%s"
@@ -358,6 +605,31 @@ class Diff(object):
         # end
         return res
 
+    @property
+    def diff(self):
+        """:return: patch text of this diff as bytes. Patches of a DiffIndex are kept in a PatchBuffer
+            shared by all its diffs and are read from it on each access"""
+        diff = self._diff
+        if type(diff) is tuple:
+            buf, offset, length = diff
+            return buf.read(offset, length)
+        return diff
+
+    @diff.setter
+    def diff(self, diff):
+        self._diff = diff
+
+    def diff_view(self):
+        """:return: memoryview of the patch text, which refers to the shared PatchBuffer's data without
+            copying it if possible"""
+        diff = self._diff
+        if type(diff) is tuple:
+            buf, offset, length = diff
+            return buf.view(offset, length)
+        if isinstance(diff, binary_type):
+            return memoryview(diff)
+        return memoryview((diff or '').encode(defenc))
+
     @property
     def a_path(self):
         return self.a_rawpath.decode(defenc, 'replace') if self.a_rawpath else None
@@ -387,6 +659,37 @@ class Diff(object):
         """
         return self.rename_from != self.rename_to
 
+    @property
+    def hunks(self):
+        """:return: list of Hunks of our patch, which is empty if there is no patch or it's binary.
+            The patch is parsed on each access, the lines of the hunks are read once iterated"""
+        view = self.diff_view()
+        hunks = []
+        for header in Hunk.re_header.finditer(view):
+            if hunks:
+                hunks[-1].length = header.start() - hunks[-1].offset
+            old_start, old_lines, new_start, new_lines, section = header.groups()
+            offset = min(header.end() + 1, len(view))
+            # the amount of lines is omitted if it's 1
+            hunks.append(Hunk(self, int(old_start), 1 if old_lines is None else int(old_lines),
+                              int(new_start), 1 if new_lines is None else int(new_lines), section,
+                              offset, len(view) - offset))
+        # END for each hunk header
+        return hunks
+
+    def _set_numstat_from_patch(self):
+        insertions = deletions = 0
+        for hunk in self.hunks:
+            for line in hunk:
+                if line.startswith(b'+'):
+                    insertions += 1
+                elif line.startswith(b'-'):
+                    deletions += 1
+            # END for each line
+        # END for each hunk
+        self.insertions = insertions
+        self.deletions = deletions
+
     @classmethod
     def _pick_best_path(cls, path_match, rename_match, path_fallback_match):
         if path_match:
@@ -400,117 +703,402 @@ class Diff(object):
 
         return None
 
+    @classmethod
+    def _from_patch_header(cls, repo, header):
+        """:return: new Diff without patch text from the given re_header match"""
+        a_path_fallback, b_path_fallback, \
+            old_mode, new_mode, \
+            rename_from, rename_to, \
+            new_file_mode, deleted_file_mode, \
+            a_blob_id, b_blob_id, b_mode, \
+            a_path, b_path = header.groups()
+
+        new_file, deleted_file = bool(new_file_mode), bool(deleted_file_mode)
+
+        a_path = cls._pick_best_path(a_path, rename_from, a_path_fallback)
+        b_path = cls._pick_best_path(b_path, rename_to, b_path_fallback)
+
+        # Make sure the mode is set if the path is set. Otherwise the resulting blob is invalid
+        # We just use the one mode we should have parsed
+        a_mode = old_mode or deleted_file_mode or (a_path and (b_mode or new_mode or new_file_mode))
+        b_mode = b_mode or new_mode or new_file_mode or (b_path and a_mode)
+        return Diff(repo,
+                    a_path,
+                    b_path,
+                    a_blob_id and a_blob_id.decode(defenc),
+                    b_blob_id and b_blob_id.decode(defenc),
+                    a_mode and a_mode.decode(defenc),
+                    b_mode and b_mode.decode(defenc),
+                    new_file, deleted_file,
+                    rename_from,
+                    rename_to,
+                    None, None, None)
+
     @classmethod
     def _index_from_patch_format(cls, repo, proc):
         """Create a new DiffIndex from the given text which must be in patch format
         :param repo: is the repository we are operating on - it is required
         :param stream: result of 'git diff' as a stream (supporting file protocol)
         :return: git.DiffIndex """
-
-        ## FIXME: Here SLURPING raw, need to re-phrase header-regexes linewise.
-        text = []
-        handle_process_output(proc, text.append, None, finalize_process, decode_streams=False)
-
-        # for now, we have to bake the stream
-        text = b''.join(text)
         index = DiffIndex()
-        previous_header = None
-        for header in cls.re_header.finditer(text):
-            a_path_fallback, b_path_fallback, \
-                old_mode, new_mode, \
-                rename_from, rename_to, \
-                new_file_mode, deleted_file_mode, \
-                a_blob_id, b_blob_id, b_mode, \
-                a_path, b_path = header.groups()
-
-            new_file, deleted_file = bool(new_file_mode), bool(deleted_file_mode)
-
-            a_path = cls._pick_best_path(a_path, rename_from, a_path_fallback)
-            b_path = cls._pick_best_path(b_path, rename_to, b_path_fallback)
-
-            # Our only means to find the actual text is to see what has not been matched by our regex,
-            # and then retro-actively assign it to our index
-            if previous_header is not None:
-                index[-1].diff = text[previous_header.end():header.start()]
-            # end assign actual diff
-
-            # Make sure the mode is set if the path is set. Otherwise the resulting blob is invalid
-            # We just use the one mode we should have parsed
-            a_mode = old_mode or deleted_file_mode or (a_path and (b_mode or new_mode or new_file_mode))
-            b_mode = b_mode or new_mode or new_file_mode or (b_path and a_mode)
-            index.append(Diff(repo,
-                              a_path,
-                              b_path,
-                              a_blob_id and a_blob_id.decode(defenc),
-                              b_blob_id and b_blob_id.decode(defenc),
-                              a_mode and a_mode.decode(defenc),
-                              b_mode and b_mode.decode(defenc),
-                              new_file, deleted_file,
-                              rename_from,
-                              rename_to,
-                              None, None, None))
-
-            previous_header = header
-        # end for each header we parse
-        if index:
-            index[-1].diff = text[header.end():]
-        # end assign last diff
+        parser = _PatchParser(repo, PatchBuffer())
 
+        def handle_diff_line(line):
+            diff = parser.feed(line)
+            if diff is not None:
+                index.append(diff)
+        # end handle line
+
+        handle_process_output(proc, handle_diff_line, None, finalize_process, decode_streams=False)
+        index.extend(parser.close())
         return index
 
     @classmethod
-    def _index_from_raw_format(cls, repo, proc):
-        """Create a new DiffIndex from the given stream which must be in raw format.
-        :return: git.DiffIndex"""
+    def _iter_from_patch_format(cls, repo, proc_or_stream, numstat=False):
+        """:return: iterator yielding the Diffs of the given git-diff process or stream in patch format,
+            each one as soon as its patch is complete
+        :param numstat: if True, the insertions and deletions of the diffs are counted in their patch"""
+        stream = proc_or_stream
+        if not hasattr(stream, 'readline'):
+            stream = proc_or_stream.stdout
+
+        parser = _PatchParser(repo)
+        for line in stream:
+            diff = parser.feed(line)
+            if diff is not None:
+                if numstat:
+                    diff._set_numstat_from_patch()
+                yield diff
+        # END for each line
+        for diff in parser.close():
+            if numstat:
+                diff._set_numstat_from_patch()
+            yield diff
+        # END for each remaining diff
+        if hasattr(proc_or_stream, 'wait'):
+            finalize_process(proc_or_stream)
+
+    @classmethod
+    def _from_raw_line(cls, repo, line):
+        """:return: Diff parsed from the given line of git-diff output in raw format, or None
+            if it is no diff line"""
         # handles
         # :100644 100644 687099101... 37c5e30c8... M    .gitignore
+        line = line.decode(defenc)
+        if not line.startswith(":"):
+            return None
+
+        meta, _, path = line[1:].partition('\t')
+        path = path.strip()
+        a_path = b_path = path
+        if meta.split(None, 4)[4][0] in 'RC':
+            a_path, b_path = path.split('\t', 1)
+        # END handle rename or copy
+        return cls._from_raw_entry(repo, meta, a_path.encode(defenc), b_path.encode(defenc))
 
+    @classmethod
+    def _from_raw_entry(cls, repo, meta, a_path, b_path):
+        """:return: Diff of a raw diff entry
+        :param meta: modes, blob ids and change type of the entry, without the leading colon
+        :param a_path: path of the a side as bytes, or the only path of the entry
+        :param b_path: path of the b side as bytes, or the only path of the entry"""
+        old_mode, new_mode, a_blob_id, b_blob_id, _change_type = meta.split(None, 4)
+        # Change type can be R100
+        # R: status letter
+        # 100: score (in case of copy and rename)
+        change_type = _change_type[0]
+        score_str = ''.join(_change_type[1:])
+        score = int(score_str) if score_str.isdigit() else None
+        deleted_file = False
+        new_file = False
+        rename_from = None
+        rename_to = None
+
+        # NOTE: We cannot conclude from the existence of a blob to change type
+        # as diffs with the working do not have blobs yet
+        if change_type == 'D':
+            b_blob_id = None
+            deleted_file = True
+        elif change_type == 'A':
+            a_blob_id = None
+            new_file = True
+        elif change_type == 'R':
+            rename_from, rename_to = a_path, b_path
+        elif change_type == 'T':
+            # Nothing to do
+            pass
+        # END add/remove handling
+
+        return Diff(repo, a_path, b_path, a_blob_id, b_blob_id, old_mode, new_mode,
+                    new_file, deleted_file, rename_from, rename_to, '',
+                    change_type, score)
+
+    @classmethod
+    def _from_tree_change(cls, repo, a, b, change_type=None):
+        """:return: Diff in raw format of a change as returned by ``git.objects.fun.diff_trees``
+        :param change_type: change type including the score of renames and copies, i.e. 'C075',
+            or None to derive it from the change"""
+        if change_type is None:
+            if a is None:
+                change_type = 'A'
+            elif b is None:
+                change_type = 'D'
+            elif a[2] != b[2]:
+                change_type = 'R100'
+            elif a[1] >> 12 != b[1] >> 12:
+                change_type = 'T'
+            else:
+                change_type = 'M'
+        # END handle change type
+        meta = '%06o %06o %s %s %s' % (a and a[1] or 0, b and b[1] or 0,
+                                       a and bin_to_hex(a[0]).decode('ascii') or cls.NULL_HEX_SHA,
+                                       b and bin_to_hex(b[0]).decode('ascii') or cls.NULL_HEX_SHA,
+                                       change_type)
+        return cls._from_raw_entry(repo, meta, (a or b)[2].encode(defenc, 'surrogateescape'),
+                                   (b or a)[2].encode(defenc, 'surrogateescape'))
+
+    @classmethod
+    def _index_from_raw_format(cls, repo, proc):
+        """Create a new DiffIndex from the given stream which must be in raw format.
+        :return: git.DiffIndex"""
         index = DiffIndex()
 
         def handle_diff_line(line):
-            line = line.decode(defenc)
-            if not line.startswith(":"):
-                return
-
-            meta, _, path = line[1:].partition('\t')
-            old_mode, new_mode, a_blob_id, b_blob_id, _change_type = meta.split(None, 4)
-            # Change type can be R100
-            # R: status letter
-            # 100: score (in case of copy and rename)
-            change_type = _change_type[0]
-            score_str = ''.join(_change_type[1:])
-            score = int(score_str) if score_str.isdigit() else None
-            path = path.strip()
-            a_path = path.encode(defenc)
-            b_path = path.encode(defenc)
-            deleted_file = False
-            new_file = False
-            rename_from = None
-            rename_to = None
-
-            # NOTE: We cannot conclude from the existence of a blob to change type
-            # as diffs with the working do not have blobs yet
-            if change_type == 'D':
-                b_blob_id = None
-                deleted_file = True
-            elif change_type == 'A':
-                a_blob_id = None
-                new_file = True
-            elif change_type == 'R':
-                a_path, b_path = path.split('\t', 1)
-                a_path = a_path.encode(defenc)
-                b_path = b_path.encode(defenc)
-                rename_from, rename_to = a_path, b_path
-            elif change_type == 'T':
-                # Nothing to do
-                pass
-            # END add/remove handling
-
-            diff = Diff(repo, a_path, b_path, a_blob_id, b_blob_id, old_mode, new_mode,
-                        new_file, deleted_file, rename_from, rename_to, '',
-                        change_type, score)
-            index.append(diff)
+            diff = cls._from_raw_line(repo, line)
+            if diff is not None:
+                index.append(diff)
 
         handle_process_output(proc, handle_diff_line, None, finalize_process, decode_streams=False)
 
         return index
+
+    @classmethod
+    def _index_from_raw_numstat_format(cls, repo, proc):
+        """Create a new DiffIndex from the output of git-diff with ``--raw --numstat -z``, which prints
+        the line counts of all files in the order of the raw diffs, once all of them were printed.
+        :return: git.DiffIndex"""
+        output = []
+        handle_process_output(proc, output.append, None, finalize_process, decode_streams=False)
+
+        index = DiffIndex()
+        counts = []
+        tokens = iter(b''.join(output).split(b'\0'))
+        for token in tokens:
+            if token.startswith(b':'):
+                meta = token[1:].decode(defenc)
+                a_path = b_path = next(tokens)
+                # renames and copies list the source and the destination path
+                if meta.split(None, 4)[4][0] in 'RC':
+                    b_path = next(tokens)
+                index.append(cls._from_raw_entry(repo, meta, a_path, b_path))
+            elif token:
+                insertions, deletions, path = token.split(b'\t', 2)
+                if not path:
+                    next(tokens)
+                    next(tokens)
+                # END skip paths of renames and copies
+                counts.append((insertions, deletions))
+            # END handle token
+        # END for each token
+
+        for diff, (insertions, deletions) in zip(index, counts):
+            diff.insertions = insertions != b'-' and int(insertions) or 0
+            diff.deletions = deletions != b'-' and int(deletions) or 0
+        # END for each diff
+        return index
+
+    @classmethod
+    def _iter_from_raw_format(cls, repo, proc_or_stream):
+        """:return: iterator yielding the Diffs of the given git-diff process or stream in raw format"""
+        stream = proc_or_stream
+        if not hasattr(stream, 'readline'):
+            stream = proc_or_stream.stdout
+
+        for line in stream:
+            diff = cls._from_raw_line(repo, line)
+            if diff is not None:
+                yield diff
+        # END for each line
+        if hasattr(proc_or_stream, 'wait'):
+            finalize_process(proc_or_stream)
+
+
+class Hunk(object):
+
+    """A hunk of the patch of a Diff, starting with a line like ``@@ -1,3 +1,4 @@ section``.
+
+    Hunks only keep the position of their lines within the patch text, the lines are read once
+    the hunk is iterated:
+
+    * old_start, old_lines: first line and amount of lines in the a side of the diff
+    * new_start, new_lines: first line and amount of lines in the b side of the diff
+    * section: bytes following the range information, usually the enclosing function
+    * offset, length: position of the hunk's lines within the patch text of the diff"""
+
+    __slots__ = ('diff', 'old_start', 'old_lines', 'new_start', 'new_lines', 'section', 'offset', 'length')
+
+    re_header = re.compile(br'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@ ?(.*)$', re.MULTILINE)
+
+    def __init__(self, diff, old_start, old_lines, new_start, new_lines, section, offset, length):
+        self.diff = diff
+        self.old_start = old_start
+        self.old_lines = old_lines
+        self.new_start = new_start
+        self.new_lines = new_lines
+        self.section = section
+        self.offset = offset
+        self.length = length
+
+    def __repr__(self):
+        return '<git.Hunk -%i,%i +%i,%i>' % (self.old_start, self.old_lines, self.new_start, self.new_lines)
+
+    def __iter__(self):
+        """:return: iterator yielding the lines of this hunk as bytes, including their leading ' ', '+', '-'
+            or '\\' character but without line separator"""
+        data = self.diff.diff_view()[self.offset:self.offset + self.length].tobytes()
+        start = 0
+        while start < len(data):
+            end = data.find(b'\n', start)
+            if end < 0:
+                end = len(data)
+            yield data[start:end]
+            start = end + 1
+        # END for each line
+
+
+class PatchBuffer(object):
+
+    """Append-only buffer for the patch text of many Diffs, which only keep the offset and length of
+    their patch within it. The first max_memory bytes are kept in memory, the buffer moves to a
+    temporary file once it grows larger.
+
+    :note: Once a view of the data was obtained, no more data may be appended"""
+
+    __slots__ = ('max_memory', 'size', '_file', '_map', '_lock')
+
+    def __init__(self, max_memory=32 * 1024 * 1024):
+        self.max_memory = max_memory
+        self.size = 0
+        self._file = BytesIO()
+        self._map = None
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        """Append the given bytes to the end of the buffer"""
+        with self._lock:
+            if self.size + len(data) > self.max_memory and isinstance(self._file, BytesIO):
+                fp = tempfile.TemporaryFile()
+                fp.write(self._file.getbuffer())
+                self._file = fp
+            # END spill to disk
+            self._file.seek(self.size)
+            self._file.write(data)
+            self.size += len(data)
+
+    def read(self, offset, length):
+        """:return: length bytes at the given offset"""
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(length)
+
+    def view(self, offset, length):
+        """:return: memoryview of length bytes at the given offset, without copying them"""
+        with self._lock:
+            if isinstance(self._file, BytesIO):
+                return self._file.getbuffer()[offset:offset + length]
+            if self._map is None:
+                self._file.flush()
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            # END map file
+            return memoryview(self._map)[offset:offset + length]
+
+
+class _PatchParser(object):
+
+    """Parses git-diff output in patch format line by line, keeping only the lines of the current
+    patch in memory. If a PatchBuffer is given, patches are written to it instead.
+
+    Diff headers are matched with ``Diff.re_header``, everything in between two headers is the patch
+    text of the first one."""
+
+    __slots__ = ('repo', 'buffer', '_header', '_diff', '_patch', '_offset')
+
+    # beginnings of the extended header lines matched by Diff.re_header
+    header_line_prefixes = (b'old mode ', b'new mode ', b'similarity index ', b'rename from ', b'rename to ',
+                            b'new file mode ', b'deleted file mode ', b'index ', b'--- ', b'+++ ')
+
+    def __init__(self, repo, buffer=None):
+        self.repo = repo
+        self.buffer = buffer
+        self._header = None     # lines of the header being read, or None
+        self._diff = None       # Diff whose patch is being read, or None
+        self._patch = []        # lines of the patch of _diff, unless it's written to the buffer
+        self._offset = 0        # offset of the patch of _diff in the buffer
+
+    def _end_header(self):
+        """Parse the header read so far
+        :return: the previous Diff if the header started a new one, None otherwise"""
+        lines = self._header
+        self._header = None
+        text = b''.join(lines)
+        header = Diff.re_header.match(text)
+        if header is None:
+            # it's part of the current patch, if there is one
+            if self._diff is not None:
+                self._append(text)
+            return None
+        # END handle invalid header
+
+        previous = self._end_diff()
+        self._diff = Diff._from_patch_header(self.repo, header)
+        if header.end() < len(text):
+            self._append(text[header.end():])
+        return previous
+
+    def _append(self, data):
+        if self.buffer is None:
+            self._patch.append(data)
+        else:
+            self.buffer.write(data)
+
+    def _end_diff(self):
+        """:return: the current Diff with its patch assigned, or None"""
+        diff = self._diff
+        if diff is None:
+            return None
+        if self.buffer is None:
+            diff.diff = b''.join(self._patch)
+            self._patch = []
+        else:
+            length = self.buffer.size - self._offset
+            diff.diff = length and (self.buffer, self._offset, length) or b''
+            self._offset = self.buffer.size
+        # END assign patch
+        self._diff = None
+        return diff
+
+    def feed(self, line):
+        """Parse the next line of output, including its line separator
+        :return: Diff whose patch ended with the previous line, or None"""
+        done = None
+        if self._header is not None:
+            if line.startswith(self.header_line_prefixes):
+                self._header.append(line)
+                return None
+            done = self._end_header()
+        # END handle header
+
+        if line.startswith(b'diff --git '):
+            self._header = [line]
+        elif self._diff is not None:
+            self._append(line)
+        # END handle line
+        return done
+
+    def close(self):
+        """:return: list of Diffs which are complete once the end of the output was reached"""
+        diffs = []
+        if self._header is not None:
+            diffs.append(self._end_header())
+        diffs.append(self._end_diff())
+        return [diff for diff in diffs if diff is not None]
@@ -3,7 +3,11 @@
 #
 # This module is part of GitPython and is released under
 # the BSD License: http://www.opensource.org/licenses/bsd-license.php
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import errno
 import glob
+import hashlib
 from io import BytesIO
 import os
 from stat import S_ISLNK
@@ -36,12 +40,17 @@ from git.util import (
     LockedFD,
     join_path_native,
     file_contents_ro,
+    hex_to_bin,
     to_native_path_linux,
     unbare_repo,
     to_bin_sha
 )
 from gitdb.base import IStream
-from gitdb.db import MemoryDB
+from gitdb.db import LooseObjectDB, MemoryDB
+from gitdb.exc import BadObject
+from gitdb.fun import write_object
+from gitdb.stream import FDCompressedSha1Writer
+from gitdb.typ import str_tree_type
 
 import git.diff as diff
 import os.path as osp
@@ -50,15 +59,21 @@ from .fun import (
     entry_key,
     write_cache,
     read_cache,
+    read_cache_tree,
+    write_cache_tree,
     aggressive_tree_merge,
     write_tree_from_cache,
     stat_mode_to_index_mode,
+    stat_to_index_data,
+    entry_matches_stat,
+    entry_is_racy,
     S_IFGITLINK,
     run_commit_hook
 )
 from .typ import (
     BaseIndexEntry,
     IndexEntry,
+    IndexEntries,
 )
 from .util import (
     TemporaryFileSwap,
@@ -92,9 +107,16 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
         index.entries[index.entry_key(index_entry_instance)] = index_entry_instance
 
     Make sure you use index.write() once you are done manipulating the index directly
-    before operating on it using the git command"""
-    __slots__ = ("repo", "version", "entries", "_extension_data", "_file_path")
-    _VERSION = 2            # latest version we support
+    before operating on it using the git command
+
+    ``Statistics``
+
+    Files added by path whose stat data didn't change since their entry was written are
+    not hashed again. The ``hashed`` and ``skipped`` attributes count the files which were
+    hashed and skipped by this instance"""
+    __slots__ = ("repo", "version", "entries", "_extension_data", "_file_path", "_timestamp", "_uptodate",
+                 "hashed", "skipped")
+    _VERSION = 2            # version of new indices, and the oldest version we write
     S_IFGITLINK = S_IFGITLINK  # a submodule
 
     def __init__(self, repo, file_path=None):
@@ -107,6 +129,10 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
         self.version = self._VERSION
         self._extension_data = b''
         self._file_path = file_path or self._index_path()
+        self._timestamp = None      # packed modification time of the index file, once read
+        self._uptodate = set()      # paths whose entries were created from their files by this instance
+        self.hashed = 0
+        self.skipped = 0
 
     def _set_cache_(self, attr):
         if attr == "entries":
@@ -119,20 +145,24 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
                 ok = True
             except OSError:
                 # in new repositories, there may be no index, which means we are empty
-                self.entries = {}
+                self.entries = IndexEntries()
                 return
             finally:
                 if not ok:
                     lfd.rollback()
             # END exception handling
 
+            # entries changed since the index was written can't be told by their stat data
+            self._timestamp = stat_to_index_data(os.fstat(fd))[1]
+            self._uptodate = set()
             stream = file_contents_ro(fd, stream=True, allow_mmap=True)
 
             try:
                 self._deserialize(stream)
             finally:
+                # entries don't refer to the map, it can be closed right away
+                stream.close()
                 lfd.rollback()
-                # The handles will be closed on destruction
             # END read from default index on demand
         else:
             super(IndexFile, self)._set_cache_(attr)
@@ -158,24 +188,27 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
 
     def _deserialize(self, stream):
         """Initialize this instance with index values read from the given stream"""
-        self.version, self.entries, self._extension_data, _conten_sha = read_cache(stream)
+        self.version, entries, extension_data, _conten_sha = read_cache(stream)
+        cache_tree, self._extension_data = read_cache_tree(extension_data)
+        self.entries = IndexEntries(entries, cache_tree)
         return self
 
     def _entries_sorted(self):
         """:return: list of entries, in a sorted fashion, first by path, then by stage"""
         return sorted(self.entries.values(), key=lambda e: (e.path, e.stage))
 
-    def _serialize(self, stream, ignore_extension_data=False):
+    def _serialize(self, stream, ignore_extension_data=False, version=None):
         entries = self._entries_sorted()
-        extension_data = self._extension_data
+        extension_data = write_cache_tree(getattr(self.entries, 'cache_tree', None)) + self._extension_data
         if ignore_extension_data:
             extension_data = None
-        write_cache(entries, stream, extension_data)
+        self.version = write_cache(entries, stream, extension_data,
+                                   version=version or max(self.version, self._VERSION))
         return self
 
     #} END serializable interface
 
-    def write(self, file_path=None, ignore_extension_data=False):
+    def write(self, file_path=None, ignore_extension_data=False, version=None):
         """Write the current state to our file path or to the given one
 
         :param file_path:
@@ -193,25 +226,38 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
             If this data is present in the written index, git-write-tree
             will instead write the stored/cached tree.
             Alternatively, use IndexFile.write_tree() to handle this case
-            automatically
+            automatically.
+            The TREE extension is kept up to date while entries are changed
+            through the entries dict the index was read with, see ``IndexEntries``.
+            If entries were replaced by another dict, it is not written at all
+
+        :param version:
+            Index format version to write, 2, 3 or 4. Version 4 compresses paths,
+            which makes the index of big repositories considerably smaller.
+            If None, the version the index was read with is kept, or version 2
+            is written for new indices. Version 3 is used instead of 2 and the
+            other way around as entries require it, as git does. Our version
+            is set to the one that was written.
 
         :return: self"""
         # make sure we have our entries read before getting a write lock
         # else it would be done when streaming. This can happen
         # if one doesn't change the index, but writes it right away
         self.entries
+        self._smudge_racy_entries()
         lfd = LockedFD(file_path or self._file_path)
         stream = lfd.open(write=True, stream=True)
 
         ok = False
         try:
-            self._serialize(stream, ignore_extension_data)
+            self._serialize(stream, ignore_extension_data, version)
             ok = True
         finally:
             if not ok:
                 lfd.rollback()
 
         lfd.commit()
+        self._timestamp = stat_to_index_data(os.stat(file_path or self._file_path))[1]
 
         # make sure we represent what we have written
         if file_path is not None:
@@ -275,7 +321,7 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
         entries = dict(izip(((e.path, e.stage) for e in base_entries),
                             (IndexEntry.from_base(e) for e in base_entries)))
 
-        inst.entries = entries
+        inst.entries = IndexEntries(entries)
         return inst
 
     @classmethod
@@ -533,9 +579,17 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
         :raise UnmergedEntriesError: """
         # we obtain no lock as we just flush our contents to disk as tree
         # If we are a new index, the entries access will load our data accordingly
+        # Trees of directories whose entries didn't change since they were cached are reused
+        cache_tree = getattr(self.entries, 'cache_tree', None)
+        binsha, entry_count = cache_tree and cache_tree.get('', (None, -1)) or (None, -1)
+        if binsha is not None and entry_count == len(self.entries) and self._has_tree(binsha):
+            return Tree(self.repo, binsha, path='')
+        # END use cached root tree
+
         mdb = MemoryDB()
         entries = self._entries_sorted()
-        binsha, tree_items = write_tree_from_cache(entries, mdb, slice(0, len(entries)))
+        binsha, tree_items = write_tree_from_cache(entries, mdb, slice(0, len(entries)),
+                                                   cache_tree=cache_tree, has_tree=self._has_tree)
 
         # copy changed trees only
         mdb.stream_copy(mdb.sha_iter(), self.repo.odb)
@@ -546,6 +600,14 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
         root_tree._cache = tree_items
         return root_tree
 
+    def _has_tree(self, binsha):
+        """:return: True if the tree with the given binary sha exists in our repository"""
+        try:
+            return self.repo.odb.info(binsha).type == str_tree_type
+        except (BadObject, ValueError):
+            return False
+        # END handle missing objects
+
     def _process_diff_args(self, args):
         try:
             args.pop(args.index(self))
@@ -585,25 +647,163 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
         # END for each item
         return paths, entries
 
-    def _store_path(self, filepath, fprogress):
-        """Store file at filepath in the database and return the base index entry
-        Needs the git_working_dir decorator active ! This must be assured in the calling code"""
-        st = os.lstat(filepath)     # handles non-symlinks as well
+    def _open_path(self, filepath, st):
+        """:return: stream of the contents of the file or symlink at filepath, with the given stat result"""
         if S_ISLNK(st.st_mode):
             # in PY3, readlink is string, but we need bytes. In PY2, it's just OS encoded bytes, we assume UTF-8
-            open_stream = lambda: BytesIO(force_bytes(os.readlink(filepath), encoding=defenc))
+            return BytesIO(force_bytes(os.readlink(filepath), encoding=defenc))
+        return open(filepath, 'rb')
+
+    def _store_loose(self, ldb, stream, size):
+        """Store the blob in the given stream in the given LooseObjectDB like its store method does, but
+        tolerate the directory of the object being created by another thread at the same time.
+
+        :return: binary sha of the blob"""
+        fd, tmp_path = tempfile.mkstemp(prefix='obj', dir=ldb.root_path())
+        writer = FDCompressedSha1Writer(fd)
+        try:
+            try:
+                write_object(Blob.type, size, stream.read, writer.write, chunk_size=ldb.stream_chunk_size)
+            finally:
+                writer.close()
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        # END assure tmpfile removal on error
+
+        hexsha = writer.sha(as_hex=True)
+        obj_path = ldb.db_path(ldb.object_path(hexsha))
+        try:
+            os.mkdir(osp.dirname(obj_path))
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                os.remove(tmp_path)
+                raise
+        # END handle existing directory
+        if osp.isfile(obj_path):
+            os.remove(tmp_path)
         else:
-            open_stream = lambda: open(filepath, 'rb')
-        with open_stream() as stream:
-            fprogress(filepath, False, filepath)
-            istream = self.repo.odb.store(IStream(Blob.type, st.st_size, stream))
-            fprogress(filepath, True, filepath)
-        return BaseIndexEntry((stat_mode_to_index_mode(st.st_mode),
-                               istream.binsha, 0, to_native_path_linux(filepath)))
+            os.rename(tmp_path, obj_path)
+        # END rename only if needed
+        os.chmod(obj_path, ldb.new_objects_mode)
+        return hex_to_bin(hexsha)
+
+    def _hash_path(self, filepath, ldb=None):
+        """Store file at filepath in the database unless the stat data of the file matches the one of
+        its existing entry, which isn't racy.
+        Safe to be called by multiple threads at once, as long as the entries don't change meanwhile.
+        If objects are stored in a LooseObjectDB, it must then be passed as ldb, see _store_loose.
+        Needs the git_working_dir decorator active ! This must be assured in the calling code
+
+        :return: tuple(entry, hashed) of the index entry, including the stat data of the file,
+            and whether the file was hashed and stored"""
+        st = os.lstat(filepath)     # handles non-symlinks as well
+        path = to_native_path_linux(filepath)
+        mode = stat_mode_to_index_mode(st.st_mode)
+        stat_data = stat_to_index_data(st)
+        entry = self.entries.get((path, 0))
+        if (entry is not None and entry_matches_stat(entry, mode, stat_data) and
+                not entry_is_racy(entry, self._timestamp)):
+            return entry, False
+        # END skip unchanged files
+
+        with self._open_path(filepath, st) as stream:
+            if ldb is not None:
+                binsha = self._store_loose(ldb, stream, st.st_size)
+            else:
+                binsha = self.repo.odb.store(IStream(Blob.type, st.st_size, stream)).binsha
+            # END handle loose database
+        return IndexEntry((mode, binsha, 0, path) + stat_data), True
+
+    def _count_path(self, entry, hashed):
+        """Account for the entry returned by _hash_path, and return it"""
+        if hashed:
+            self.hashed += 1
+            self._uptodate.add(entry.path)
+        else:
+            self.skipped += 1
+        return entry
+
+    def _store_path(self, filepath, fprogress):
+        """Store file at filepath in the database and return the index entry, including the stat data
+        of the file. If the stat data of the file matches the one of its existing entry, which isn't racy,
+        the existing entry is returned without storing the file again.
+        Needs the git_working_dir decorator active ! This must be assured in the calling code"""
+        fprogress(filepath, False, filepath)
+        entry, hashed = self._hash_path(filepath)
+        fprogress(filepath, True, filepath)
+        return self._count_path(entry, hashed)
+
+    def _store_paths(self, filepaths, fprogress, workers):
+        """Like _store_path, but for each of the given filepaths, which are hashed and stored by a pool of
+        worker threads. fprogress is called by the calling thread, and entries are returned in the order
+        of the filepaths.
+        Needs the git_working_dir decorator active ! This must be assured in the calling code
+
+        :return: list of index entries"""
+        # loose objects may be stored directly or through a wrapping database, like the CachedObjectDB
+        ldb = getattr(self.repo.odb, 'odb', self.repo.odb)
+        if not isinstance(ldb, LooseObjectDB):
+            ldb = None
+        # END handle loose database
+
+        self.entries     # read the index once, before the workers access its entries
+        filepaths = iter(filepaths)
+        max_pending = workers * 2
+        entries_added = []
+        executor = ThreadPoolExecutor(workers)
+        pending = deque()
+        try:
+            while True:
+                for filepath in filepaths:
+                    fprogress(filepath, False, filepath)
+                    pending.append((executor.submit(self._hash_path, filepath, ldb), filepath))
+                    if len(pending) >= max_pending:
+                        break
+                # END for each filepath to submit
+
+                if not pending:
+                    break
+                future, filepath = pending.popleft()
+                entry, hashed = future.result()
+                fprogress(filepath, True, filepath)
+                entries_added.append(self._count_path(entry, hashed))
+            # END while there are results
+        finally:
+            for future, filepath in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+        # END assure workers are stopped
+        return entries_added
+
+    def _smudge_racy_entries(self):
+        """Clear the size of entries whose files changed after their stat data was taken, within the same
+        time their index was written, like git does when writing an index. Their stat data doesn't tell
+        they changed, but the cleared size does once the index is read again. Entries we took the stat
+        data of ourselves are up to date."""
+        if self._timestamp is None or self.repo.bare:
+            return
+        racy_entries = [entry for (path, stage), entry in self.entries.items()
+                        if not stage and entry_is_racy(entry, self._timestamp) and path not in self._uptodate]
+        for entry in racy_entries:
+            filepath = osp.join(self.repo.working_tree_dir, entry.path)
+            try:
+                st = os.lstat(filepath)
+            except OSError:
+                continue
+            # entries whose stat data differs are noticed anyway
+            if not entry_matches_stat(entry, entry.mode, stat_to_index_data(st)):
+                continue
+            with self._open_path(filepath, st) as stream:
+                sha = hashlib.sha1(('blob %i\0' % st.st_size).encode('ascii'))
+                sha.update(stream.read())
+            if sha.digest() != entry.binsha:
+                self.entries[(entry.path, 0)] = IndexEntry(entry[:10] + (0, ))
+        # END for each racy entry
 
     @unbare_repo
     @git_working_dir
-    def _entries_for_paths(self, paths, path_rewriter, fprogress, entries):
+    def _entries_for_paths(self, paths, path_rewriter, fprogress, entries, workers=1):
         entries_added = []
         if path_rewriter:
             for path in paths:
@@ -626,6 +826,9 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
 
         # HANDLE PATHS
         assert len(entries_added) == 0
+        workers = workers or os.cpu_count() or 1
+        if workers > 1:
+            return self._store_paths(self._iter_expand_paths(paths), fprogress, workers)
         for filepath in self._iter_expand_paths(paths):
             entries_added.append(self._store_path(filepath, fprogress))
         # END for each filepath
@@ -633,10 +836,14 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
         return entries_added
 
     def add(self, items, force=True, fprogress=lambda *args: None, path_rewriter=None,
-            write=True, write_extension_data=False):
+            write=True, write_extension_data=False, workers=1):
         """Add files from the working tree, specific blobs or BaseIndexEntries
         to the index.
 
+        Files whose stat data matches the one of their entry aren't hashed and stored again,
+        unless they may have changed right when the index was written. See the ``hashed`` and
+        ``skipped`` attributes for how many files were hashed and skipped.
+
         :param items:
             Multiple types of items are supported, types can be mixed within one call.
             Different types imply a different handling. File paths may generally be
@@ -714,16 +921,22 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
             the changes only exist in memory and are not available to git commands.
 
         :param write_extension_data:
-            If True, extension data will be written back to the index. This can lead to issues in case
-            it is containing the 'TREE' extension, which will cause the `git commit` command to write an
-            old tree, instead of a new one representing the now changed index.
-            This doesn't matter if you use `IndexFile.commit()`, which ignores the `TREE` extension altogether.
+            If True, extension data will be written back to the index. The 'TREE' extension is invalidated
+            for all directories containing added entries, so that the `git commit` command writes a new tree
+            representing the now changed index, see ``IndexEntries``. Other extensions are written unchanged.
+            `IndexFile.commit()` reuses the valid trees of the 'TREE' extension in either case.
             You should set it to True if you intend to use `IndexFile.commit()` exclusively while maintaining
             support for third-party extensions. Besides that, you can usually safely ignore the built-in
             extensions when using GitPython on repositories that are not handled manually at all.
             All current built-in extensions are listed here:
             http://opensource.apple.com/source/Git/Git-26/src/git-htmldocs/technical/index-format.txt
 
+        :param workers:
+            Amount of worker threads hashing, compressing and storing the files of the given paths
+            concurrently, or None to use one per CPU. By default, files are handled one after another.
+            Entries are added in the same order either way, and fprogress is called by the calling
+            thread, once before a file is handed to a worker and once after it was stored.
+
         :return:
             List(BaseIndexEntries) representing the entries just actually added.
 
@@ -741,7 +954,8 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
         # That way, we are OK on a bare repository as well.
         # If there are no paths, the rewriter has nothing to do either
         if paths:
-            entries_added.extend(self._entries_for_paths(paths, path_rewriter, fprogress, entries))
+            entries_added.extend(self._entries_for_paths(paths, path_rewriter, fprogress, entries, workers))
+        num_path_entries = len(entries_added)
 
         # HANDLE ENTRIES
         if entries:
@@ -790,9 +1004,12 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
         # END if there are base entries
 
         # FINALIZE
-        # add the new entries to this instance
-        for entry in entries_added:
-            self.entries[(entry.path, 0)] = IndexEntry.from_base(entry)
+        # add the new entries to this instance, entries of paths keep the stat data of their files
+        for i, entry in enumerate(entries_added):
+            if i >= num_path_entries:
+                entry = IndexEntry.from_base(entry)
+            self.entries[(entry.path, 0)] = entry
+        # END for each entry
 
         if write:
             self.write(ignore_extension_data=not write_extension_data)
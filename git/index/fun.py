@@ -2,6 +2,7 @@
 # more versatile
 # NOTE: Autodoc hates it if this is a docstring
 from io import BytesIO
+from mmap import mmap
 import os
 from stat import (
     S_IFDIR,
@@ -11,6 +12,7 @@ from stat import (
     S_IFMT,
     S_IFREG,
 )
+from struct import Struct
 import subprocess
 
 from git.cmd import PROC_CREATIONFLAGS, handle_process_output
@@ -42,7 +44,11 @@ from .typ import (
     BaseIndexEntry,
     IndexEntry,
     CE_NAMEMASK,
-    CE_STAGESHIFT
+    CE_STAGEMASK,
+    CE_STAGESHIFT,
+    CE_EXTENDED,
+    CE_EXTENDED_FLAGS,
+    CE_EXTENDED_SHIFT
 )
 from .util import (
     pack,
@@ -53,8 +59,14 @@ from .util import (
 S_IFGITLINK = S_IFLNK | S_IFDIR     # a submodule
 CE_NAMEMASK_INV = ~CE_NAMEMASK
 
-__all__ = ('write_cache', 'read_cache', 'write_tree_from_cache', 'entry_key',
-           'stat_mode_to_index_mode', 'S_IFGITLINK', 'run_commit_hook', 'hook_path')
+# ctime, mtime, dev, ino, mode, uid, gid, size, sha and flags of an entry, followed by its path
+_index_entry_struct = Struct(">8s8sLLLLLL20sH")
+# extended flags following the flags of entries in index version 3 and later, if CE_EXTENDED is set
+_extended_flags_struct = Struct(">H")
+
+__all__ = ('write_cache', 'read_cache', 'read_cache_tree', 'write_cache_tree', 'write_tree_from_cache', 'entry_key',
+           'stat_mode_to_index_mode', 'stat_to_index_data', 'entry_matches_stat', 'entry_is_racy',
+           'S_IFGITLINK', 'run_commit_hook', 'hook_path')
 
 
 def hook_path(name, git_dir):
@@ -108,7 +120,58 @@ def stat_mode_to_index_mode(mode):
     return S_IFREG | 0o644 | (mode & 0o111)       # blobs with or without executable bit
 
 
-def write_cache(entries, stream, extension_data=None, ShaStreamCls=IndexFileSHA1Writer):
+def stat_to_index_data(st):
+    """:return: tuple(ctime, mtime, dev, ino, uid, gid, size) of the given stat result, in the order and format
+        of index entries. Times are packed seconds and nanoseconds, all values are truncated to 32 bits
+        like git truncates them"""
+    return (pack(">LL", (st.st_ctime_ns // 1000000000) & 0xffffffff, st.st_ctime_ns % 1000000000),
+            pack(">LL", (st.st_mtime_ns // 1000000000) & 0xffffffff, st.st_mtime_ns % 1000000000),
+            st.st_dev & 0xffffffff, st.st_ino & 0xffffffff, st.st_uid & 0xffffffff, st.st_gid & 0xffffffff,
+            st.st_size & 0xffffffff)
+
+
+def entry_matches_stat(entry, mode, stat_data):
+    """:return: True if the file with the given index mode and stat data, see ``stat_to_index_data``, didn't
+        change since the stat data of the given index entry was taken, as far as its stat data can tell.
+        The device is not compared, like git doesn't by default"""
+    return entry[0] == mode and entry[4:6] == stat_data[:2] and entry[7:] == stat_data[3:]
+
+
+def entry_is_racy(entry, timestamp):
+    """:return: True if the file of the given entry may have changed within the same time as the index it was
+        read from was written, which its stat data can't tell. See racy-git in the git documentation
+    :param timestamp: packed modification time of the index file, see ``stat_to_index_data``,
+        or None if it is unknown"""
+    # packed big-endian times compare like the times do
+    return timestamp is None or entry[5] >= timestamp
+
+
+def _encode_varint(value):
+    """:return: bytes of the given number, encoded as varint like git encodes path prefix lengths"""
+    out = [value & 0x7f]
+    value >>= 7
+    while value:
+        value -= 1
+        out.append(0x80 | (value & 0x7f))
+        value >>= 7
+    # END while there are bits left
+    return bytes(bytearray(reversed(out)))
+
+
+def _decode_varint(data, offset):
+    """:return: tuple(value, offset) of the varint at offset in data, and the offset after it"""
+    c = data[offset]
+    offset += 1
+    value = c & 0x7f
+    while c & 0x80:
+        c = data[offset]
+        offset += 1
+        value = ((value + 1) << 7) | (c & 0x7f)
+    # END while there are more bytes
+    return value, offset
+
+
+def write_cache(entries, stream, extension_data=None, ShaStreamCls=IndexFileSHA1Writer, version=2):
     """Write the cache represented by entries to a stream
 
     :param entries: **sorted** list of entries
@@ -119,33 +182,58 @@ def write_cache(entries, stream, extension_data=None, ShaStreamCls=IndexFileSHA1
         while writing to it, before the data is passed on to the wrapped stream
 
     :param extension_data: any kind of data to write as a trailer, it must begin
-        a 4 byte identifier, followed by its size ( 4 bytes )"""
+        a 4 byte identifier, followed by its size ( 4 bytes )
+
+    :param version: index format version, 2, 3 or 4. Version 4 stores each path as the
+        amount of bytes to remove from the end of the previous path and the bytes to append.
+        Versions 2 and 3 are written as version 3 if an entry has extended flags, as git does,
+        and as version 2 otherwise
+    :return: the index format version that was written
+    :raise ValueError: if the version is not supported"""
+    if version not in (2, 3, 4):
+        raise ValueError("Cannot write index version %r, only versions 2, 3 and 4 are supported" % version)
+    if version < 4:
+        version = any(entry[2] & CE_EXTENDED_FLAGS for entry in entries) and 3 or 2
+    # END choose version
+
     # wrap the stream into a compatible writer
     stream = ShaStreamCls(stream)
-
-    tell = stream.tell
     write = stream.write
 
     # header
-    version = 2
     write(b"DIRC")
     write(pack(">LL", version, len(entries)))
 
     # body
+    pack_entry = _index_entry_struct.pack
+    entry_size = _index_entry_struct.size
+    previous_path = b''
     for entry in entries:
-        beginoffset = tell()
-        write(entry[4])         # ctime
-        write(entry[5])         # mtime
-        path = entry[3]
-        path = force_bytes(path, encoding=defenc)
-        plen = len(path) & CE_NAMEMASK      # path length
-        assert plen == len(path), "Path %s too long to fit into index" % entry[3]
-        flags = plen | (entry[2] & CE_NAMEMASK_INV)     # clear possible previous values
-        write(pack(">LLLLLL20sH", entry[6], entry[7], entry[0],
-                   entry[8], entry[9], entry[10], entry[1], flags))
-        write(path)
-        real_size = ((tell() - beginoffset + 8) & ~7)
-        write(b"\0" * ((beginoffset + real_size) - tell()))
+        path = force_bytes(entry[3], encoding=defenc)
+        # longer paths end at their NULL byte
+        flags = min(len(path), CE_NAMEMASK) | (entry[2] & CE_NAMEMASK_INV & 0xffff & ~CE_EXTENDED)
+        extended_flags = (entry[2] & CE_EXTENDED_FLAGS) >> CE_EXTENDED_SHIFT
+        if extended_flags:
+            flags |= CE_EXTENDED
+        write(pack_entry(entry[4], entry[5], entry[6], entry[7], entry[0],
+                         entry[8], entry[9], entry[10], entry[1], flags))
+        size = entry_size
+        if extended_flags:
+            write(_extended_flags_struct.pack(extended_flags))
+            size += _extended_flags_struct.size
+        # END handle extended flags
+
+        if version == 4:
+            common = len(osp.commonprefix((previous_path, path)))
+            write(_encode_varint(len(previous_path) - common))
+            write(path[common:])
+            write(b"\0")
+            previous_path = path
+        else:
+            write(path)
+            size += len(path)
+            write(b"\0" * (((size + 8) & ~7) - size))
+        # END handle path compression
     # END for each entry
 
     # write previously cached extensions data
@@ -154,6 +242,7 @@ def write_cache(entries, stream, extension_data=None, ShaStreamCls=IndexFileSHA1
 
     # write the sha over the content
     stream.write_sha()
+    return version
 
 
 def read_header(stream):
@@ -163,8 +252,7 @@ def read_header(stream):
         raise AssertionError("Invalid index file header: %r" % type_id)
     version, num_entries = unpack(">LL", stream.read(4 * 2))
 
-    # TODO: handle version 3: extended data, see read-cache.c
-    assert version in (1, 2)
+    assert version in (1, 2, 3, 4), "Unsupported index version: %i" % version
     return version, num_entries
 
 
@@ -183,28 +271,47 @@ def read_cache(stream):
     * version is the integer version number
     * entries dict is a dictionary which maps IndexEntry instances to a path at a stage
     * extension_data is '' or 4 bytes of type + 4 bytes of size + size bytes
-    * content_sha is a 20 byte sha on all cache file contents"""
+    * content_sha is a 20 byte sha on all cache file contents
+    :note: memory maps are read in place, all other streams are read into memory at once"""
     version, num_entries = read_header(stream)
-    count = 0
-    entries = {}
+    offset = stream.tell()
+    if isinstance(stream, mmap):
+        data = stream
+    else:
+        data = stream.read()
+        offset = 0
+    # END get buffer
 
-    read = stream.read
-    tell = stream.tell
-    while count < num_entries:
-        beginoffset = tell()
-        ctime = unpack(">8s", read(8))[0]
-        mtime = unpack(">8s", read(8))[0]
-        (dev, ino, mode, uid, gid, size, sha, flags) = \
-            unpack(">LLLLLL20sH", read(20 + 4 * 6 + 2))
-        path_size = flags & CE_NAMEMASK
-        path = read(path_size).decode(defenc)
-
-        real_size = ((tell() - beginoffset + 8) & ~7)
-        read((beginoffset + real_size) - tell())
-        entry = IndexEntry((mode, sha, flags, path, ctime, mtime, dev, ino, uid, gid, size))
+    unpack_from = _index_entry_struct.unpack_from
+    entry_size = _index_entry_struct.size
+    entries = {}
+    previous_path = b''
+    for _ in range(num_entries):
+        (ctime, mtime, dev, ino, mode, uid, gid, size, sha, flags) = unpack_from(data, offset)
+        path_start = offset + entry_size
+        if flags & CE_EXTENDED:
+            flags |= _extended_flags_struct.unpack_from(data, path_start)[0] << CE_EXTENDED_SHIFT
+            path_start += _extended_flags_struct.size
+        # END handle extended flags
+
+        if version == 4:
+            # the path replaces the given amount of bytes at the end of the previous one, without padding
+            strip, path_start = _decode_varint(data, path_start)
+            path_end = data.find(b'\0', path_start)
+            previous_path = previous_path[:len(previous_path) - strip] + data[path_start:path_end]
+            path = previous_path.decode(defenc)
+            offset = path_end + 1
+        else:
+            path_size = flags & CE_NAMEMASK
+            if path_size == CE_NAMEMASK:
+                # the path is too long for the flags, it ends at the first NULL byte
+                path_size = data.find(b'\0', path_start) - path_start
+            path = data[path_start:path_start + path_size].decode(defenc)
+            offset += (path_start - offset + path_size + 8) & ~7
+        # END handle path compression
         # entry_key would be the method to use, but we safe the effort
-        entries[(path, entry.stage)] = entry
-        count += 1
+        entries[(path, (flags & CE_STAGEMASK) >> CE_STAGESHIFT)] = \
+            IndexEntry((mode, sha, flags, path, ctime, mtime, dev, ino, uid, gid, size))
     # END for each entry
 
     # the footer contains extension data and a sha on the content so far
@@ -213,7 +320,9 @@ def read_cache(stream):
     # 4 bytes ID
     # 4 bytes length of chunk
     # repeated 0 - N times
-    extension_data = stream.read(~0)
+    extension_data = data[offset:]
+    if data is stream:
+        stream.seek(len(data))
     assert len(extension_data) > 19, "Index Footer was not at least a sha on content as it was only %i bytes in size"\
                                      % len(extension_data)
 
@@ -225,7 +334,91 @@ def read_cache(stream):
     return (version, entries, extension_data, content_sha)
 
 
-def write_tree_from_cache(entries, odb, sl, si=0):
+def read_cache_tree(extension_data):
+    """Read the cache tree from the TREE extension in the given extension data, as returned by ``read_cache``
+
+    :return: tuple(cache_tree, extension_data)
+    * cache_tree is a dict mapping the paths of directories, '' being the root, to tuple(binsha, entry_count)
+      of their trees, entry_count being the amount of index entries in the directory. Directories whose
+      tree is invalid, as entries changed since it was written, map to (None, -1)
+    * extension_data is the given extension data without the TREE extension"""
+    cache_tree = {}
+    other_extensions = []
+    offset = 0
+    while offset + 8 <= len(extension_data):
+        signature = extension_data[offset:offset + 4]
+        size = unpack(">L", extension_data[offset + 4:offset + 8])[0]
+        if signature != b"TREE":
+            other_extensions.append(extension_data[offset:offset + 8 + size])
+            offset += 8 + size
+            continue
+        # END keep other extensions
+
+        # directories are listed depth first, each followed by its subdirectories
+        end = offset + 8 + size
+        offset += 8
+        parents = []
+        while offset < end:
+            name_end = extension_data.index(b"\0", offset)
+            line_end = extension_data.index(b"\n", name_end)
+            name = extension_data[offset:name_end].decode(defenc)
+            entry_count, subtree_count = (int(i) for i in extension_data[name_end + 1:line_end].split(b" "))
+            offset = line_end + 1
+            binsha = None
+            if entry_count >= 0:
+                binsha = extension_data[offset:offset + 20]
+                offset += 20
+            # END read sha of valid trees
+
+            while parents and not parents[-1][1]:
+                parents.pop()
+            if parents:
+                parents[-1][1] -= 1
+                path = parents[-1][0] and "%s/%s" % (parents[-1][0], name) or name
+            else:
+                path = name
+            # END get path
+            cache_tree[path] = (binsha, binsha is not None and entry_count or -1)
+            parents.append([path, subtree_count])
+        # END for each directory
+    # END for each extension
+    return cache_tree, b"".join(other_extensions)
+
+
+def write_cache_tree(cache_tree):
+    """:return: TREE extension data of the given cache tree, see ``read_cache_tree``, or b'' if it is empty"""
+    if not cache_tree:
+        return b""
+    # directories of cached trees are listed below their parents, even if these aren't cached
+    subdirs = {}
+    for path in cache_tree:
+        while path:
+            parent = path.rpartition("/")[0]
+            if path in subdirs.setdefault(parent, {}):
+                break
+            subdirs[parent][path] = path.rpartition("/")[2].encode(defenc)
+            path = parent
+        # END for each parent directory
+    # END for each cached directory
+
+    out = []
+    stack = [("", b"")]
+    while stack:
+        path, name = stack.pop()
+        binsha, entry_count = cache_tree.get(path, (None, -1))
+        children = sorted(subdirs.get(path, {}).items(), key=lambda item: (len(item[1]), item[1]))
+        entry_count = binsha is not None and entry_count or -1
+        out.append(name + b"\0" + ("%i %i\n" % (entry_count, len(children))).encode("ascii"))
+        if binsha is not None:
+            out.append(binsha)
+        # git orders subdirectories by the length of their name first
+        stack.extend(reversed(children))
+    # END for each directory
+    data = b"".join(out)
+    return b"TREE" + pack(">L", len(data)) + data
+
+
+def write_tree_from_cache(entries, odb, sl, si=0, cache_tree=None, has_tree=None):
     """Create a tree from the given sorted list of entries and put the respective
     trees into the given object database
 
@@ -233,6 +426,11 @@ def write_tree_from_cache(entries, odb, sl, si=0):
     :param odb: object database to store the trees in
     :param si: start index at which we should start creating subtrees
     :param sl: slice indicating the range we should process on the entries list
+    :param cache_tree: if not None, dict of cached trees of directories as returned by
+        ``read_cache_tree``. The cached tree of a directory is used instead of writing it again if it
+        covers the entries of the directory, and the trees of all written directories are added to it
+    :param has_tree: if not None, function returning True if the tree with the given binary sha exists.
+        Cached trees are only used if it does
     :return: tuple(binsha, list(tree_entry, ...)) a tuple of a sha and a list of
         tree entries being a tuple of hexsha, mode, name"""
     tree_items = []
@@ -252,6 +450,21 @@ def write_tree_from_cache(entries, odb, sl, si=0):
         else:
             # find common base range
             base = entry.path[si:rbound]
+            if cache_tree:
+                # skip the entries of the directory if its tree is cached and they are as many as before
+                binsha, entry_count = cache_tree.get(entry.path[:rbound], (None, -1))
+                xi = ci - 1 + entry_count
+                prefix = entry.path[:rbound + 1]
+                if (binsha is not None and 0 < entry_count and xi <= end and
+                        entries[xi - 1].path.startswith(prefix) and
+                        (xi == end or not entries[xi].path.startswith(prefix)) and
+                        (has_tree is None or has_tree(binsha))):
+                    tree_items_append((binsha, S_IFDIR, base))
+                    ci = xi
+                    continue
+                # END use cached tree
+            # END handle cache tree
+
             xi = ci
             while xi < end:
                 oentry = entries[xi]
@@ -264,8 +477,11 @@ def write_tree_from_cache(entries, odb, sl, si=0):
 
             # enter recursion
             # ci - 1 as we want to count our current item as well
-            sha, _tree_entry_list = write_tree_from_cache(entries, odb, slice(ci - 1, xi), rbound + 1)
+            sha, _tree_entry_list = write_tree_from_cache(entries, odb, slice(ci - 1, xi), rbound + 1,
+                                                          cache_tree, has_tree)
             tree_items_append((sha, S_IFDIR, base))
+            if cache_tree is not None:
+                cache_tree[entry.path[:rbound]] = (sha, xi - ci + 1)
 
             # skip ahead
             ci = xi
@@ -278,6 +494,8 @@ def write_tree_from_cache(entries, odb, sl, si=0):
     sio.seek(0)
 
     istream = odb.store(IStream(str_tree_type, len(sio.getvalue()), sio))
+    if cache_tree is not None and si == 0:
+        cache_tree[''] = (istream.binsha, end - sl.start)
     return (istream.binsha, tree_items)
 
 
@@ -9,7 +9,7 @@ from .util import (
 from git.objects import Blob
 
 
-__all__ = ('BlobFilter', 'BaseIndexEntry', 'IndexEntry')
+__all__ = ('BlobFilter', 'BaseIndexEntry', 'IndexEntry', 'IndexEntries')
 
 #{ Invariants
 CE_NAMEMASK = 0x0fff
@@ -18,6 +18,12 @@ CE_EXTENDED = 0x4000
 CE_VALID = 0x8000
 CE_STAGESHIFT = 12
 
+# extended flags of index version 3 and later, stored above the 16 bits of the flags like git does
+CE_INTENT_TO_ADD = 0x20000000
+CE_SKIP_WORKTREE = 0x40000000
+CE_EXTENDED_FLAGS = CE_INTENT_TO_ADD | CE_SKIP_WORKTREE
+CE_EXTENDED_SHIFT = 16
+
 #} END invariants
 
 
@@ -174,3 +180,70 @@ class IndexEntry(BaseIndexEntry):
         time = pack(">LL", 0, 0)
         return IndexEntry((blob.mode, blob.binsha, stage << CE_STAGESHIFT, blob.path,
                            time, time, 0, 0, 0, 0, blob.size))
+
+
+class IndexEntries(dict):
+
+    """Dictionary mapping (path, stage) keys to the IndexEntries of an index, which keeps the
+    cached trees of the index up to date.
+
+    The cache_tree maps paths of directories to tuple(binsha, entry_count) of their trees, see
+    ``git.index.fun.read_cache_tree``. Adding, changing or removing an entry invalidates the
+    cached trees of all directories containing it, others stay valid and are reused when writing
+    a tree of the index. Setting an entry with the same mode and sha keeps them valid."""
+    __slots__ = 'cache_tree'
+
+    def __init__(self, entries=(), cache_tree=None):
+        super(IndexEntries, self).__init__(entries)
+        self.cache_tree = {} if cache_tree is None else cache_tree
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self), self.cache_tree))
+
+    def invalidate(self, path):
+        """Invalidate the cached trees of all directories containing the given path"""
+        cache_tree = self.cache_tree
+        if not cache_tree:
+            return
+        # parents of invalid trees are invalid as well, like git keeps them
+        names = path.split('/')
+        for i in range(len(names)):
+            directory = '/'.join(names[:i])
+            if directory not in cache_tree:
+                break
+            cache_tree[directory] = (None, -1)
+        # END for each parent directory
+
+    def __setitem__(self, key, entry):
+        old_entry = self.get(key)
+        if old_entry is None or old_entry[0] != entry[0] or old_entry[1] != entry[1]:
+            self.invalidate(key[0])
+        super(IndexEntries, self).__setitem__(key, entry)
+
+    def __delitem__(self, key):
+        super(IndexEntries, self).__delitem__(key)
+        self.invalidate(key[0])
+
+    def pop(self, key, *default):
+        if key in self:
+            self.invalidate(key[0])
+        return super(IndexEntries, self).pop(key, *default)
+
+    def popitem(self):
+        key, entry = super(IndexEntries, self).popitem()
+        self.invalidate(key[0])
+        return key, entry
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, entry in dict(*args, **kwargs).items():
+            self[key] = entry
+        # END for each entry
+
+    def clear(self):
+        super(IndexEntries, self).clear()
+        self.cache_tree.clear()
@@ -9,6 +9,7 @@ import inspect
 from .base import *
 from .blob import *
 from .commit import *
+from .commitgraph import *
 from .submodule import util as smutil
 from .submodule.base import *
 from .submodule.root import *
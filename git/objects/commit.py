@@ -6,11 +6,14 @@
 
 from gitdb import IStream
 from git.util import (
+    bin_to_hex,
     hex_to_bin,
     Actor,
     Iterable,
     Stats,
-    finalize_process
+    finalize_process,
+    pprint_rename,
+    quote_path
 )
 from git.diff import Diffable
 
@@ -33,6 +36,7 @@ from time import (
     timezone,
     localtime
 )
+from hashlib import sha1
 import os
 from io import BytesIO
 import logging
@@ -43,6 +47,11 @@ log.addHandler(logging.NullHandler())
 __all__ = ('Commit', )
 
 
+def _commit_sha(data):
+    """:return: binary sha of the commit object with the given data"""
+    return sha1(('commit %i\0' % len(data)).encode('ascii') + data).digest()
+
+
 class Commit(base.Object, Iterable, Diffable, Traversable, Serializable):
 
     """Wraps a git Commit object.
@@ -66,7 +75,7 @@ class Commit(base.Object, Iterable, Diffable, Traversable, Serializable):
     __slots__ = ("tree",
                  "author", "authored_date", "author_tz_offset",
                  "committer", "committed_date", "committer_tz_offset",
-                 "message", "parents", "encoding", "gpgsig")
+                 "message", "parents", "encoding", "gpgsig", "_stats")
     _id_attribute_ = "hexsha"
 
     def __init__(self, repo, binsha, tree=None, author=None, authored_date=None, author_tz_offset=None,
@@ -138,6 +147,21 @@ class Commit(base.Object, Iterable, Diffable, Traversable, Serializable):
         return commit.parents
 
     def _set_cache_(self, attr):
+        if attr == '_stats':
+            self._stats = self._get_stats()
+            return
+        # END handle stats
+        if attr in ('tree', 'parents', 'committed_date'):
+            # the commit-graph provides these without inflating the commit
+            graph = getattr(self.repo, 'commit_graph', None)
+            entry = graph and graph.entry(self.binsha)
+            if entry:
+                self.tree = Tree(self.repo, entry.tree_binsha, Tree.tree_id << 12, '')
+                self.parents = tuple(type(self)(self.repo, binsha) for binsha in entry.parent_binshas)
+                self.committed_date = entry.committed_date
+                return
+            # END use commit-graph entry
+        # END handle graph attrs
         if attr in Commit.__slots__:
             # read the data in a chunk, its faster - then provide a file wrapper
             _binsha, _typename, self.size, stream = self.repo.odb.stream(self.binsha)
@@ -185,7 +209,7 @@ class Commit(base.Object, Iterable, Diffable, Traversable, Serializable):
         return self.repo.git.name_rev(self)
 
     @classmethod
-    def iter_items(cls, repo, rev, paths='', **kwargs):
+    def iter_items(cls, repo, rev, paths='', preload=False, with_stats=False, **kwargs):
         """Find all commits matching the given criteria.
 
         :param repo: is the Repo
@@ -193,13 +217,21 @@ class Commit(base.Object, Iterable, Diffable, Traversable, Serializable):
         :param paths:
             is an optional path or list of paths, if set only Commits that include the path
             or paths will be considered
+        :param preload:
+            if True, the commits are read from the output of a single git-log process and are returned
+            fully initialized. Otherwise each commit is read from the object database once one of
+            its attributes is accessed. Preloading is much faster if most commits are used.
+        :param with_stats:
+            if True, the stats of all commits but merge commits are computed by the same git-log
+            process, instead of running one git-diff per commit. Implies preload.
         :param kwargs:
             optional keyword arguments to git rev-list where
             ``max_count`` is the maximum number of commits to fetch
             ``skip`` is the number of commits to skip
             ``since`` all commits since i.e. '1970-01-01'
         :return: iterator yielding Commit items"""
-        if 'pretty' in kwargs:
+        preload = preload or with_stats
+        if 'pretty' in kwargs or (preload and 'format' in kwargs):
             raise ValueError("--pretty cannot be used as parsing expects single sha's only")
         # END handle pretty
 
@@ -210,6 +242,13 @@ class Commit(base.Object, Iterable, Diffable, Traversable, Serializable):
             args.extend((paths, ))
         # END if paths
 
+        if preload:
+            if with_stats:
+                # show the changes of all files even if limited to paths, like Commit.stats
+                kwargs.update(numstat=True, full_diff=True)
+            # END handle stats
+            proc = repo.git.log(rev, args, format='raw', encoding='none', z=True, as_process=True, **kwargs)
+            return cls._iter_from_log(repo, proc, with_stats)
         proc = repo.git.rev_list(rev, args, as_process=True, **kwargs)
         return cls._iter_from_process_or_stream(repo, proc)
 
@@ -234,7 +273,11 @@ class Commit(base.Object, Iterable, Diffable, Traversable, Serializable):
         """Create a git stat from changes between this commit and its first parent
         or from all changes done if this is the very first commit.
 
-        :return: git.Stats"""
+        :return: git.Stats
+        :note: stats are computed once, or when iterating commits using ``with_stats=True``"""
+        return self._stats
+
+    def _get_stats(self):
         if not self.parents:
             text = self.repo.git.diff_tree(self.hexsha, '--', numstat=True, root=True)
             text2 = ""
@@ -277,6 +320,120 @@ class Commit(base.Object, Iterable, Diffable, Traversable, Serializable):
         if hasattr(proc_or_stream, 'wait'):
             finalize_process(proc_or_stream)
 
+    @classmethod
+    def _iter_from_log(cls, repo, proc_or_stream, with_stats=False, chunk_size=65536):
+        """Parse fully initialized Commit objects from the output of ``git log --format=raw --encoding=none -z``
+
+        :param proc_or_stream: git-log process instance or stream
+        :param with_stats: if True, the output contains the --numstat of each commit, which is parsed
+            into the stats of the returned Commit objects
+        :return: iterator returning Commit objects"""
+        stream = proc_or_stream
+        if not hasattr(stream, 'read'):
+            stream = proc_or_stream.stdout
+
+        commit = None
+        entries = None      # numstat entries of the current commit, or None if it has no stats
+        rename = None       # numstat entry of a rename, awaiting its source and destination paths
+        # quote paths like git-diff does without -z, to obtain the same stats as Commit.stats
+        quote_non_ascii = with_stats and repo.config_reader().get_value('core', 'quotepath', True)
+        for token in cls._iter_log_tokens(stream, chunk_size):
+            if rename is not None:
+                rename.append(token)
+                if len(rename) == 4:
+                    entries.append((rename[0], rename[1], pprint_rename(rename[2], rename[3], quote_non_ascii)))
+                    rename = None
+                # END handle complete rename
+                continue
+            # END handle rename paths
+
+            if token.startswith(b'commit '):
+                if commit is not None:
+                    if entries is not None:
+                        commit._stats = Stats._from_numstat(entries)
+                    yield commit
+                # END handle previous commit
+                commit, parent_count, token = cls._from_log_record(repo, token)
+                # git-log doesn't show diffs of merge commits, their stats are computed on demand
+                entries = [] if with_stats and parent_count < 2 else None
+            # END handle commit record
+
+            if token and entries is not None:
+                insertions, deletions, path = token.split(b'\t', 2)
+                insertions, deletions = insertions.decode('ascii'), deletions.decode('ascii')
+                if path:
+                    entries.append((insertions, deletions, quote_path(path, quote_non_ascii)))
+                else:
+                    rename = [insertions, deletions]
+            # END handle numstat entry
+        # END for each token
+
+        if commit is not None:
+            if entries is not None:
+                commit._stats = Stats._from_numstat(entries)
+            yield commit
+        # END handle last commit
+        if hasattr(proc_or_stream, 'wait'):
+            finalize_process(proc_or_stream)
+
+    @classmethod
+    def _iter_log_tokens(cls, stream, chunk_size):
+        """:return: iterator yielding the NUL separated tokens of the given stream"""
+        buf = b''
+        while True:
+            chunk = stream.read(chunk_size)
+            tokens = (buf + chunk).split(b'\0')
+            buf = chunk and tokens.pop() or b''
+            for token in tokens:
+                yield token
+            if not chunk:
+                break
+        # END while there is output
+
+    @classmethod
+    def _from_log_record(cls, repo, record):
+        """Parse a commit from a record of ``git log --format=raw``.
+        git-log indents the message and strips whitespace from empty lines, hence we verify the
+        reconstructed object against its sha and leave commits we cannot reconstruct to be read lazily
+
+        :return: tuple(commit, parent_count, remainder), with the remainder being the output following the
+            commit message, like the first --numstat entry"""
+        header_start = record.index(b'\n') + 1
+        binsha = hex_to_bin(record[len(b'commit '):len(b'commit ') + 40])
+        header_end = record.find(b'\n\n', header_start - 1) + 1
+        remainder = b''
+        if header_end:
+            lines = record[header_end + 1:].split(b'\n')
+            num_message_lines = 0
+            for line in lines:
+                if not line.startswith(b'    '):
+                    break
+                num_message_lines += 1
+            # END for each message line
+            message = b''.join(line[4:] + b'\n' for line in lines[:num_message_lines])
+            remainder = b'\n'.join(lines[num_message_lines + 1:])
+        else:
+            # empty messages are not separated from the headers
+            header_end = len(record)
+            message = b''
+        # END handle empty message
+        headers = record[header_start:header_end]
+        parent_count = headers.count(b'\nparent ')
+        data = headers + b'\n' + message
+
+        if _commit_sha(data) != binsha:
+            # git-log terminates messages with a newline, which commits created by us don't have
+            data = data[:-1]
+            if not message.endswith(b'\n') or _commit_sha(data) != binsha:
+                log.debug("Could not reconstruct commit %s from git-log output", bin_to_hex(binsha))
+                return cls(repo, binsha), parent_count, remainder
+        # END verify object
+
+        commit = cls(repo, binsha)
+        commit.size = len(data)
+        commit._deserialize(BytesIO(data))
+        return commit, parent_count, remainder
+
     @classmethod
     def create_from_tree(cls, repo, tree, message, parent_commits=None, head=False, author=None, committer=None,
                          author_date=None, commit_date=None):
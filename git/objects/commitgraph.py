@@ -0,0 +1,260 @@
+# commitgraph.py
+# Copyright (C) 2008, 2009 Michael Trier (mtrier@gmail.com) and contributors
+#
+# This module is part of GitPython and is released under
+# the BSD License: http://www.opensource.org/licenses/bsd-license.php
+"""Module to read git's commit-graph files, which store the parents, root trees,
+commit dates and generation numbers of commits in a compact, searchable format"""
+from collections import namedtuple
+import mmap
+from struct import unpack_from
+
+from git.util import bin_to_hex
+
+import os.path as osp
+
+__all__ = ('CommitGraph', 'CommitGraphEntry', 'GENERATION_NUMBER_INFINITY')
+
+# generation number of commits which are not part of the commit-graph
+GENERATION_NUMBER_INFINITY = 0xffffffff
+
+# value of the parent fields if there is no such parent
+_PARENT_NONE = 0x70000000
+_PARENT_EXTRA_EDGES = 0x80000000
+_LAST_EDGE = 0x80000000
+
+CommitGraphEntry = namedtuple('CommitGraphEntry', ('tree_binsha', 'parent_binshas', 'generation', 'committed_date'))
+CommitGraphEntry.__doc__ = """Information about a commit as stored in the commit-graph.
+
+    * generation is the topological level of the commit, which is 1 for root commits and one more than
+      the maximum generation of its parents otherwise. If a commit is an ancestor of another commit,
+      its generation is smaller.
+    * committed_date is the commit time in seconds since epoch, without time zone information"""
+
+
+class CommitGraphFile(object):
+
+    """A single memory mapped commit-graph file, possibly one layer of a split commit-graph chain"""
+
+    __slots__ = ('path', 'num_commits', 'base_shas', '_map', '_fanout', '_oid_ofs', '_data_ofs', '_edges_ofs')
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fp:
+            self._map = m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if m[:4] != b'CGPH':
+            raise ValueError("Invalid commit-graph signature in %s" % path)
+        version, hash_version, num_chunks, num_bases = unpack_from('>4B', m, 4)
+        if version != 1 or hash_version != 1:
+            raise ValueError("Unsupported commit-graph version %i with hash version %i in %s"
+                             % (version, hash_version, path))
+        # END check header
+
+        chunks = {}
+        for i in range(num_chunks):
+            chunk_id, offset = unpack_from('>4sQ', m, 8 + i * 12)
+            chunks[chunk_id] = offset
+        # END for each chunk
+        for chunk_id in (b'OIDF', b'OIDL', b'CDAT'):
+            if chunk_id not in chunks:
+                raise ValueError("Commit-graph %s is missing the required %s chunk" % (path, chunk_id.decode()))
+        # END check required chunks
+
+        self._fanout = unpack_from('>256L', m, chunks[b'OIDF'])
+        self.num_commits = self._fanout[255]
+        self._oid_ofs = chunks[b'OIDL']
+        self._data_ofs = chunks[b'CDAT']
+        self._edges_ofs = chunks.get(b'EDGE')
+        base_ofs = chunks.get(b'BASE')
+        self.base_shas = tuple(m[base_ofs + i * 20:base_ofs + (i + 1) * 20] for i in range(num_bases))
+
+    def position(self, binsha):
+        """:return: position of the commit with the given binary sha within this file, or None"""
+        first = binsha[0]
+        lo = first and self._fanout[first - 1] or 0
+        hi = self._fanout[first]
+        m = self._map
+        base = self._oid_ofs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            sha = m[base + mid * 20:base + mid * 20 + 20]
+            if sha < binsha:
+                lo = mid + 1
+            elif sha > binsha:
+                hi = mid
+            else:
+                return mid
+        # END binary search
+        return None
+
+    def binsha(self, pos):
+        ofs = self._oid_ofs + pos * 20
+        return self._map[ofs:ofs + 20]
+
+    def data(self, pos):
+        """:return: tuple(tree_binsha, parent1, parent2, generation, committed_date) of the commit
+            at the given position, with parents being global positions or _PARENT_NONE"""
+        ofs = self._data_ofs + pos * 36
+        parent1, parent2, gen_hi, date_lo = unpack_from('>4L', self._map, ofs + 20)
+        return (self._map[ofs:ofs + 20], parent1, parent2, gen_hi >> 2, ((gen_hi & 3) << 32) | date_lo)
+
+    def extra_edges(self, index):
+        """:return: list of global positions of parents stored in the extra edges list at the given index"""
+        edges = []
+        while True:
+            edge = unpack_from('>L', self._map, self._edges_ofs + index * 4)[0]
+            edges.append(edge & ~_LAST_EDGE)
+            if edge & _LAST_EDGE:
+                return edges
+            index += 1
+        # END while there are more edges
+
+    def close(self):
+        self._map.close()
+
+
+class CommitGraph(object):
+
+    """Reader for the commit-graph of a repository, either stored in a single
+    ``objects/info/commit-graph`` file, or as chain of files in ``objects/info/commit-graphs``.
+
+    Commits are identified by their global position in the commit-graph, which allows to follow
+    parents and compare generation numbers without looking up binary shas::
+
+        graph = CommitGraph.from_objects_dir(osp.join(repo.common_dir, 'objects'))
+        pos = graph.position(commit.binsha)
+        parents = graph.parent_positions(pos)
+
+    :note: the commit-graph may not contain all commits of the repository, as commits created after
+        it was written are not part of it"""
+
+    __slots__ = ('_layers', '_offsets')
+
+    def __init__(self, paths):
+        """Initialize this instance from the given commit-graph files, the base layer first
+
+        :raise ValueError: if one of the files is invalid or the chain is inconsistent"""
+        self._layers = []
+        self._offsets = []
+        num_commits = 0
+        try:
+            for path in paths:
+                layer = CommitGraphFile(path)
+                self._layers.append(layer)
+                self._check_bases(layer)
+                self._offsets.append(num_commits)
+                num_commits += layer.num_commits
+            # END for each path
+        except Exception:
+            self.close()
+            raise
+        # END close partially opened layers
+
+    def _check_bases(self, layer):
+        # each layer lists the checksums of all layers below it, which are part of their file names
+        expected = tuple(osp.basename(base.path)[len('graph-'):-len('.graph')] for base in self._layers[:-1])
+        actual = tuple(bin_to_hex(sha).decode('ascii') for sha in layer.base_shas)
+        if actual != expected:
+            raise ValueError("Commit-graph chain is inconsistent at %s" % layer.path)
+
+    @classmethod
+    def from_objects_dir(cls, objects_dir):
+        """:return: CommitGraph of the object directory, or None if there is no commit-graph
+        :raise ValueError: if the commit-graph is invalid"""
+        info_dir = osp.join(objects_dir, 'info')
+        chain_path = osp.join(info_dir, 'commit-graphs', 'commit-graph-chain')
+        if osp.isfile(chain_path):
+            with open(chain_path, 'rb') as fp:
+                names = fp.read().decode('ascii').split()
+            # END read chain
+            if names:
+                return cls([osp.join(info_dir, 'commit-graphs', 'graph-%s.graph' % name) for name in names])
+        # END handle split commit-graph
+
+        path = osp.join(info_dir, 'commit-graph')
+        if osp.isfile(path):
+            return cls([path])
+        return None
+
+    #{ Utilities
+
+    def _layer(self, pos):
+        for layer, offset in zip(reversed(self._layers), reversed(self._offsets)):
+            if pos >= offset:
+                return layer, pos - offset
+        # END for each layer
+        raise IndexError("Invalid commit-graph position: %i" % pos)
+
+    #} END utilities
+
+    #{ Interface
+
+    def __len__(self):
+        return sum(layer.num_commits for layer in self._layers)
+
+    def __contains__(self, binsha):
+        return self.position(binsha) is not None
+
+    def position(self, binsha):
+        """:return: global position of the commit with the given binary sha, or None if it is not
+            part of the commit-graph"""
+        for layer, offset in zip(self._layers, self._offsets):
+            pos = layer.position(binsha)
+            if pos is not None:
+                return offset + pos
+        # END for each layer
+        return None
+
+    def binsha(self, pos):
+        """:return: binary sha of the commit at the given position"""
+        layer, pos = self._layer(pos)
+        return layer.binsha(pos)
+
+    def tree_binsha(self, pos):
+        """:return: binary sha of the root tree of the commit at the given position"""
+        layer, pos = self._layer(pos)
+        return layer.data(pos)[0]
+
+    def parent_positions(self, pos):
+        """:return: list of positions of the parents of the commit at the given position"""
+        layer, pos = self._layer(pos)
+        _tree, parent1, parent2 = layer.data(pos)[:3]
+        if parent1 == _PARENT_NONE:
+            return []
+        if parent2 == _PARENT_NONE:
+            return [parent1]
+        if parent2 & _PARENT_EXTRA_EDGES:
+            return [parent1] + layer.extra_edges(parent2 & ~_PARENT_EXTRA_EDGES)
+        return [parent1, parent2]
+
+    def generation(self, pos):
+        """:return: generation number of the commit at the given position, see CommitGraphEntry"""
+        layer, pos = self._layer(pos)
+        return layer.data(pos)[3]
+
+    def committed_date(self, pos):
+        """:return: commit time of the commit at the given position, in seconds since epoch"""
+        layer, pos = self._layer(pos)
+        return layer.data(pos)[4]
+
+    def entry(self, binsha):
+        """:return: CommitGraphEntry of the commit with the given binary sha, or None if it is
+            not part of the commit-graph"""
+        pos = self.position(binsha)
+        if pos is None:
+            return None
+        layer, layer_pos = self._layer(pos)
+        tree_binsha, _parent1, _parent2, generation, committed_date = layer.data(layer_pos)
+        parents = tuple(self.binsha(p) for p in self.parent_positions(pos))
+        return CommitGraphEntry(tree_binsha, parents, generation, committed_date)
+
+    def close(self):
+        """Release the memory maps of all commit-graph files"""
+        for layer in self._layers:
+            layer.close()
+        # END for each layer
+        del self._layers[:]
+        del self._offsets[:]
+
+    #} END interface
@@ -1,8 +1,11 @@
 """Module with functions which are supposed to be as fast as possible"""
-from stat import S_ISDIR
+from collections import Counter
+from functools import cmp_to_key
+import re
+from stat import S_ISDIR, S_ISREG
+import posixpath
 from git.compat import (
     byte_ord,
-    safe_decode,
     defenc,
     xrange,
     text_type,
@@ -10,7 +13,11 @@ from git.compat import (
 )
 
 __all__ = ('tree_to_stream', 'tree_entries_from_data', 'traverse_trees_recursive',
-           'traverse_tree_recursive')
+           'traverse_tree_recursive', 'diff_trees', 'diff_tree_to_entries', 'find_exact_renames',
+           'find_renames', 'similarity_signature', 'MAX_SCORE')
+
+# mode, name and binary sha of a single tree entry. The sha may be truncated in broken data.
+_tree_entry_regex = re.compile(b'([0-7]+) ([^\\0]*)\\0(.{0,20})', re.DOTALL)
 
 
 def tree_to_stream(entries, write):
@@ -46,46 +53,20 @@ def tree_entries_from_data(data):
     """Reads the binary representation of a tree and returns tuples of Tree items
     :param data: data block with tree data (as bytes)
     :return: list(tuple(binsha, mode, tree_relative_path), ...)"""
-    ord_zero = ord('0')
-    space_ord = ord(' ')
-    len_data = len(data)
-    i = 0
-    out = []
-    while i < len_data:
-        mode = 0
-
-        # read mode
-        # Some git versions truncate the leading 0, some don't
-        # The type will be extracted from the mode later
-        while byte_ord(data[i]) != space_ord:
-            # move existing mode integer up one level being 3 bits
-            # and add the actual ordinal value of the character
-            mode = (mode << 3) + (byte_ord(data[i]) - ord_zero)
-            i += 1
-        # END while reading mode
-
-        # byte is space now, skip it
-        i += 1
-
-        # parse name, it is NULL separated
-
-        ns = i
-        while byte_ord(data[i]) != 0:
-            i += 1
-        # END while not reached NULL
-
-        # default encoding for strings in git is utf8
-        # Only use the respective unicode object if the byte stream was encoded
-        name = data[ns:i]
-        name = safe_decode(name)
-
-        # byte is NULL, get next 20
-        i += 1
-        sha = data[i:i + 20]
-        i = i + 20
-        out.append((sha, mode, name))
-    # END for each byte in data stream
-    return out
+    # Split all entries in one pass of the regex engine instead of walking the data byte by byte.
+    # Some git versions truncate the leading 0 of the mode, some don't
+    # The type will be extracted from the mode later
+    entries = _tree_entry_regex.findall(data)
+    if not entries:
+        return []
+
+    # default encoding for strings in git is utf8, undecodable bytes are escaped.
+    # Names can't contain NULL bytes, which allows to decode all of them at once and split them
+    # afterwards - utf8 sequences don't span the separator, hence the result is the same as
+    # decoding each name on its own.
+    names = b'\0'.join([name for _mode, name, _sha in entries])
+    names = names.decode(defenc, 'surrogateescape').split('\0')
+    return [(sha, int(mode, 8), name) for (mode, _name, sha), name in zip(entries, names)]
 
 
 def _find_by_name(tree_data, name, is_dir, start_at):
@@ -205,3 +186,370 @@ def traverse_tree_recursive(odb, tree_sha, path_prefix):
     # END for each item
 
     return entries
+
+
+def _git_sort_key(key):
+    """:return: sort key of a (name, is_dir) tuple which sorts like git sorts tree entries"""
+    name, is_dir = key
+    name = name.encode(defenc, 'surrogateescape')
+    return is_dir and name + b'/' or name
+
+
+def _match_paths(path, paths):
+    """:return: 2 if the given path is one of the given paths or below one of them, 1 if one of
+        the paths is below it, 0 otherwise"""
+    for p in paths:
+        if path == p or path.startswith(p + '/'):
+            return 2
+    # END for each path
+    for p in paths:
+        if p.startswith(path + '/'):
+            return 1
+    # END for each path
+    return 0
+
+
+def diff_trees(odb, a_sha, b_sha, path_prefix='', paths=None):
+    """
+    :return: list of changes between the trees with the given binary shas, as list of tuples
+        (a_entry, b_entry) of changed blobs and submodules, sorted like git-diff-tree sorts them.
+        Entries are (binsha, mode, path) tuples, or None if the path doesn't exist on that side.
+        Subtrees with the same sha on both sides are skipped without reading them.
+    :param a_sha: binary sha of the tree of the a side, or None for an empty tree
+    :param b_sha: binary sha of the tree of the b side, or None for an empty tree
+    :param path_prefix: a prefix to be added to the returned paths, set it '' for the root tree
+    :param paths: if not None, list of paths without trailing slash limiting the returned changes
+        to the ones at or below at least one of them"""
+    entries = {}
+    for side, tree_sha in ((0, a_sha), (1, b_sha)):
+        if tree_sha is None:
+            continue
+        for sha, mode, name in tree_entries_from_data(odb.stream(tree_sha).read()):
+            entries.setdefault((name, S_ISDIR(mode)), [None, None])[side] = (sha, mode)
+        # END for each entry
+    # END for each side
+
+    changes = []
+    for key in sorted(entries, key=_git_sort_key):
+        a, b = entries[key]
+        if a == b:
+            continue
+        # END skip identical entries
+        name, is_dir = key
+        path = path_prefix + name
+        sub_paths = paths
+        if paths is not None:
+            match = _match_paths(path, paths)
+            if match == 0 or (match == 1 and not is_dir):
+                continue
+            if match == 2:
+                sub_paths = None
+        # END handle paths
+
+        if is_dir:
+            changes.extend(diff_trees(odb, a and a[0], b and b[0], path + '/', sub_paths))
+        else:
+            changes.append((a and (a[0], a[1], path), b and (b[0], b[1], path)))
+        # END handle entry type
+    # END for each entry
+    return changes
+
+
+def diff_tree_to_entries(odb, tree_sha, entries, paths=None):
+    """
+    :return: list of changes between the tree with the given binary sha and the given entries, i.e. the
+        entries of an index, as list of (a_entry, b_entry) tuples sorted like git-diff sorts them. See
+        ``diff_trees`` for the format of the changes.
+    :param tree_sha: binary sha of the tree of the a side, or None for an empty tree
+    :param entries: iterable of (binsha, mode, path) entries of blobs and submodules of the b side
+    :param paths: see ``diff_trees``"""
+    sides = ({}, {})
+    if tree_sha is not None:
+        for entry in traverse_tree_recursive(odb, tree_sha, ''):
+            sides[0][entry[2]] = entry
+    # END read tree
+    for entry in entries:
+        sides[1][entry[2]] = tuple(entry)
+    # END for each entry
+
+    changes = []
+    for path in sorted(set(sides[0]) | set(sides[1]), key=lambda p: p.encode(defenc, 'surrogateescape')):
+        a, b = sides[0].get(path), sides[1].get(path)
+        if a == b or (paths is not None and _match_paths(path, paths) != 2):
+            continue
+        changes.append((a, b))
+    # END for each path
+    return changes
+
+
+#{ Rename detection
+
+# Similarity scores are fractions of MAX_SCORE, like in git
+MAX_SCORE = 60000
+
+# modulus of the hashes of spans, and the amount of bytes checked to determine whether data is binary
+_SPAN_HASH_BASE = 107927
+_BINARY_CHECK_SIZE = 8000
+
+# spans of data end after a newline, or after 64 bytes
+_span_regex = re.compile(b'[^\\n]{0,63}\\n|[^\\n]{1,64}')
+
+
+def _span_hash(span):
+    """:return: hash of a single span, as git computes it"""
+    accum1 = accum2 = 0
+    for c in bytearray(span):
+        accum1, accum2 = (((accum1 << 7) ^ (accum2 >> 25)) & 0xffffffff,
+                          ((accum2 << 7) ^ (accum1 >> 25)) & 0xffffffff)
+        accum1 = (accum1 + c) & 0xffffffff
+    # END for each byte
+    return ((accum1 + accum2 * 0x61) & 0xffffffff) % _SPAN_HASH_BASE
+
+
+def similarity_signature(data):
+    """
+    :return: dict mapping the hashes of the spans of the given blob data to the amount of bytes in spans
+        with that hash. Spans end after each newline or after 64 bytes, as git splits blobs to estimate
+        their similarity. If the data is text, carriage returns followed by a newline are ignored.
+    :param data: bytes of a blob"""
+    if b'\0' not in data[:_BINARY_CHECK_SIZE]:
+        data = data.replace(b'\r\n', b'\n')
+    signature = {}
+    for span, count in Counter(_span_regex.findall(data)).items():
+        hashval = _span_hash(span)
+        signature[hashval] = signature.get(hashval, 0) + len(span) * count
+    # END for each distinct span
+    return signature
+
+
+def _sizes_differ(a_size, b_size, min_score):
+    """:return: True if blobs of the given sizes are too different to reach min_score"""
+    max_size = max(a_size, b_size)
+    return max_size * (MAX_SCORE - min_score) < (max_size - min(a_size, b_size)) * MAX_SCORE
+
+
+def _compare_candidates(a, b):
+    """Compare (score, name_score, src_index, dst_index) candidates, or None, like git orders them:
+    best scores first, same file names first on equal scores, unset candidates last."""
+    if a is None:
+        return int(b is not None)
+    if b is None:
+        return -1
+    if a[0] == b[0]:
+        return b[1] - a[1]
+    return b[0] - a[0]
+
+
+def _find_exact_renames(changes, sources, dests, used, renames, copies):
+    """Pair destinations in dests with sources of the same sha, storing them in renames as
+    {dst_index: (src_index, MAX_SCORE)} and counting the uses of each source in used"""
+    by_sha = {}
+    for index in sources:
+        by_sha.setdefault(changes[index][0][0], []).append(index)
+    # END for each source
+
+    for index in dests:
+        b = changes[index][1]
+        best = None
+        best_score = -1
+        for source_index in by_sha.get(b[0], ()):
+            source = changes[source_index][0]
+            if source[1] != b[1] and not (S_ISREG(source[1]) and S_ISREG(b[1])):
+                continue
+            if used[source_index] and not copies:
+                continue
+            score = (not used[source_index]) + (posixpath.basename(source[2]) == posixpath.basename(b[2]))
+            if score > best_score:
+                best, best_score = source_index, score
+                if score == 2:
+                    break
+        # END for each source candidate
+        if best is not None:
+            used[best] += 1
+            renames[index] = (best, MAX_SCORE)
+    # END for each destination
+
+
+def _apply_renames(changes, used, renames):
+    """:return: list of (a_entry, b_entry, change_type) tuples of the changes with the given renames applied.
+        change_type is 'R' or 'C' followed by the similarity in percent for renames and copies, None otherwise"""
+    used = list(used)
+    out = []
+    for index, (a, b) in enumerate(changes):
+        if index in renames:
+            out.append([changes[renames[index][0]][0], b, renames[index]])
+        elif b is not None or not used[index]:
+            out.append((a, b, None))
+        # END drop renamed deletions
+    # END for each change
+
+    for change in out:
+        if change[2] is None:
+            continue
+        source_index, score = change[2]
+        used[source_index] -= 1
+        change[2] = '%s%03d' % (used[source_index] and 'C' or 'R', score * 100 // MAX_SCORE)
+    # END for each rename
+    return [tuple(change) for change in out]
+
+
+def find_exact_renames(changes):
+    """Pair deleted and added blobs with the same sha into renames, as git-diff -M does.
+
+    :param changes: list of (a_entry, b_entry) tuples as returned by ``diff_trees``
+    :return: list of changes, with each rename being a (a_entry, b_entry) tuple with differing paths in
+        place of the addition, and without the deletion. Each deleted blob is renamed at most once,
+        preferring destinations with the same file name. Regular files may change their executable bit,
+        symlinks and submodules are only renamed if their mode stays the same"""
+    sources = [index for index, (a, b) in enumerate(changes) if b is None]
+    if not sources:
+        return changes
+    used = [0] * len(changes)
+    renames = {}
+    _find_exact_renames(changes, sources, [index for index, (a, b) in enumerate(changes) if a is None],
+                        used, renames, False)
+    return [change[:2] for change in _apply_renames(changes, used, renames)]
+
+
+def find_renames(odb, changes, min_score=MAX_SCORE // 2, copies=False, rename_limit=1000):
+    """Detect renames and copies in the given changes, like git-diff -M or -C does.
+
+    Exact renames are found first, see ``find_exact_renames``. The remaining added regular files are
+    compared to the remaining deleted ones, or to all deleted and modified ones if copies are detected.
+    The similarity is the amount of bytes of the destination found in the source, relative to the size
+    of the bigger blob, see ``similarity_signature``. Pairs whose sizes differ too much are skipped
+    without reading them, all other blobs are read at once using the stream_many method of the object
+    database, if it has one.
+
+    :param odb: object database to read blobs from
+    :param changes: list of (a_entry, b_entry) tuples as returned by ``diff_trees``
+    :param min_score: minimum similarity of renames and copies, as fraction of MAX_SCORE
+    :param copies: if True, detect copies as well
+    :param rename_limit: if more than rename_limit squared pairs of sources and destinations are left
+        once exact renames were found, similar blobs are not searched. If None, there is no limit
+    :return: list of (a_entry, b_entry, change_type) tuples. Renames and copies replace the addition, with
+        change_type being 'R' or 'C' followed by the similarity in percent, i.e. 'R087'. Deletions of renamed
+        blobs are removed. For all other changes change_type is None"""
+    sources = []
+    dests = []
+    used = [0] * len(changes)
+    for index, (a, b) in enumerate(changes):
+        if a is None:
+            dests.append(index)
+        elif b is None:
+            sources.append(index)
+        elif copies:
+            # modified sources stay, hence they count as used already
+            used[index] = 1
+            sources.append(index)
+        # END handle change type
+    # END for each change
+    renames = {}
+    if not sources or not dests:
+        return _apply_renames(changes, used, renames)
+
+    _find_exact_renames(changes, sources, dests, used, renames, copies)
+    dests = [index for index in dests if index not in renames]
+    if not copies:
+        sources = [index for index in sources if not used[index]]
+    if (not sources or not dests or
+            rename_limit is not None and len(sources) * len(dests) > rename_limit * rename_limit):
+        return _apply_renames(changes, used, renames)
+
+    # read the sizes of all blobs, and the signatures of blobs in pairs which don't differ too much in size
+    shas = set(changes[index][0][0] for index in sources if S_ISREG(changes[index][0][1]))
+    shas.update(changes[index][1][0] for index in dests if S_ISREG(changes[index][1][1]))
+    shas = list(shas)
+    info_many = getattr(odb, 'info_many', None) or (lambda shas: (odb.info(sha) for sha in shas))
+    sizes = dict((info.binsha, info.size) for info in info_many(shas))
+
+    source_shas = set(changes[index][0][0] for index in sources if changes[index][0][0] in sizes)
+    dest_shas = set(changes[index][1][0] for index in dests if changes[index][1][0] in sizes)
+    shas = set()
+    for source_sha in source_shas:
+        for dest_sha in dest_shas:
+            if not _sizes_differ(sizes[source_sha], sizes[dest_sha], min_score):
+                shas.add(source_sha)
+                shas.add(dest_sha)
+        # END for each destination
+    # END for each source
+    shas = list(shas)
+    stream_many = getattr(odb, 'stream_many', None) or (lambda shas: (odb.stream(sha) for sha in shas))
+    signatures = dict((stream.binsha, similarity_signature(stream.read())) for stream in stream_many(shas))
+
+    def similarity(source_index, dest_index, min_score):
+        a_sha, a_mode = changes[source_index][0][:2]
+        b_sha, b_mode = changes[dest_index][1][:2]
+        if not (S_ISREG(a_mode) and S_ISREG(b_mode)) or _sizes_differ(sizes[a_sha], sizes[b_sha], min_score):
+            return 0
+        max_size = max(sizes[a_sha], sizes[b_sha])
+        if not max_size:
+            return 0
+        a_signature, b_signature = signatures[a_sha], signatures[b_sha]
+        if len(a_signature) > len(b_signature):
+            a_signature, b_signature = b_signature, a_signature
+        copied = sum(min(count, b_signature.get(hashval, 0)) for hashval, count in a_signature.items())
+        return copied * MAX_SCORE // max_size
+    # END utility
+
+    def basename(index, side):
+        return posixpath.basename(changes[index][side][2])
+    # END utility
+
+    if not copies:
+        # pair blobs with file names unique on both sides first, if they are quite similar
+        min_basename_score = min_score + (MAX_SCORE - min_score) // 2
+        source_names = {}
+        for index in sources:
+            source_names[basename(index, 0)] = None if basename(index, 0) in source_names else index
+        dest_names = {}
+        for index in dests:
+            dest_names[basename(index, 1)] = None if basename(index, 1) in dest_names else index
+        # END for each destination
+
+        for source_index in sources:
+            dest_index = dest_names.get(basename(source_index, 0))
+            if source_names[basename(source_index, 0)] is None or dest_index is None:
+                continue
+            score = similarity(source_index, dest_index, min_basename_score)
+            if score >= min_basename_score:
+                used[source_index] += 1
+                renames[dest_index] = (source_index, score)
+        # END for each source
+        sources = [index for index in sources if not used[index]]
+        dests = [index for index in dests if index not in renames]
+    # END handle file names
+
+    # keep the best candidates of each destination, and pair them in order of their score
+    candidates = []
+    for dest_index in dests:
+        best = [None] * 4
+        for source_index in sources:
+            candidate = (similarity(source_index, dest_index, min_score),
+                         int(basename(source_index, 0) == basename(dest_index, 1)), source_index, dest_index)
+            worst = 0
+            for i in range(1, len(best)):
+                if _compare_candidates(best[i], best[worst]) > 0:
+                    worst = i
+            # END for each kept candidate
+            if _compare_candidates(best[worst], candidate) > 0:
+                best[worst] = candidate
+        # END for each source
+        candidates.extend(best)
+    # END for each destination
+    candidates.sort(key=cmp_to_key(_compare_candidates))
+
+    for allow_used in ((False, True) if copies else (False,)):
+        for candidate in candidates:
+            if candidate is None or candidate[0] < min_score:
+                break
+            score, _, source_index, dest_index = candidate
+            if dest_index in renames or (used[source_index] and not allow_used):
+                continue
+            used[source_index] += 1
+            renames[dest_index] = (source_index, score)
+        # END for each candidate
+    # END for each pass
+    return _apply_renames(changes, used, renames)
+
+#} END rename detection
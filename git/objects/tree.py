@@ -3,6 +3,9 @@
 #
 # This module is part of GitPython and is released under
 # the BSD License: http://www.opensource.org/licenses/bsd-license.php
+from collections import OrderedDict
+import threading
+
 from git.util import join_path
 import git.diff as diff
 from git.util import to_bin_sha
@@ -23,7 +26,7 @@ from git.compat import PY3
 if PY3:
     cmp = lambda a, b: (a > b) - (a < b)
 
-__all__ = ("TreeModifier", "Tree")
+__all__ = ("TreeModifier", "Tree", "TreePathCache")
 
 
 def git_cmp(t1, t2):
@@ -153,6 +156,53 @@ class TreeModifier(object):
     #} END mutators
 
 
+class TreePathCache(object):
+
+    """A size-bounded memo mapping (tree binsha, path) to the (binsha, mode) of the entry
+    at the path within the tree, or None if there is no such entry.
+
+    As trees are immutable, entries never become invalid. Resolving the same path in many
+    commits reuses all results obtained for unchanged subtrees. The least recently used
+    entries are dropped once max_entries is reached."""
+
+    __slots__ = ('max_entries', '_cache', '_lock')
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # cached entries are not pickled
+        return {'max_entries': self.max_entries}
+
+    def __setstate__(self, d):
+        self.__init__(d['max_entries'])
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __getitem__(self, key):
+        """:return: (binsha, mode) or None for the given (tree binsha, path) key
+        :raise KeyError: if the key is not cached"""
+        with self._lock:
+            value = self._cache[key]
+            self._cache.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+            # END drop least recently used entries
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
 class Tree(IndexObject, diff.Diffable, util.Traversable, util.Serializable):
 
     """Tree objects represent an ordered list of Blobs and other Trees.
@@ -167,7 +217,7 @@ class Tree(IndexObject, diff.Diffable, util.Traversable, util.Serializable):
     """
 
     type = "tree"
-    __slots__ = "_cache"
+    __slots__ = ("_cache", "_name_index")
 
     # actual integer ids for comparison
     commit_id = 0o16     # equals stat.S_IFDIR | stat.S_IFLNK - a directory link
@@ -196,6 +246,9 @@ class Tree(IndexObject, diff.Diffable, util.Traversable, util.Serializable):
             # Set the data when we need it
             ostream = self.repo.odb.stream(self.binsha)
             self._cache = tree_entries_from_data(ostream.read())
+        elif attr == "_name_index":
+            # the first entry wins if a name exists more than once, as it would in a linear search
+            self._name_index = {info[2]: info for info in reversed(self._cache)}
         else:
             super(Tree, self)._set_cache_(attr)
         # END handle attribute
@@ -211,38 +264,57 @@ class Tree(IndexObject, diff.Diffable, util.Traversable, util.Serializable):
                 raise TypeError("Unknown mode %o found in tree data for path '%s'" % (mode, path))
         # END for each item
 
+    def _entry_by_name(self, name):
+        """:return: (binsha, mode, name) tuple of the entry with the given name, or None"""
+        index = self._name_index
+        if index is not None:
+            return index.get(name)
+        for info in self._cache:
+            if info[2] == name:
+                return info
+        # END for each entry
+        return None
+
+    def _entry_by_path(self, path):
+        """:return: (binsha, mode) of the entry at the given path relative to this tree, or None.
+        Results are memoized in the tree path cache of the repository, unless our entries
+        were altered and may not match our binsha anymore"""
+        memo = None
+        if self._name_index is not None and self.binsha != self.NULL_BIN_SHA:
+            memo = getattr(self.repo, 'tree_path_cache', None)
+        if memo is not None:
+            try:
+                return memo[(self.binsha, path)]
+            except KeyError:
+                pass
+        # END check memo
+
+        name, sep, rest = path.partition('/')
+        info = self._entry_by_name(name)
+        if info is None:
+            entry = None
+        elif not sep:
+            entry = (info[0], info[1])
+        elif info[1] >> 12 == self.tree_id:
+            entry = Tree(self.repo, info[0], info[1], join_path(self.path, name))._entry_by_path(rest)
+        else:
+            # blobs and submodules are at the end of the path
+            entry = None
+        # END handle entry
+
+        if memo is not None:
+            memo[(self.binsha, path)] = entry
+        return entry
+
     def join(self, file):
         """Find the named object in this tree's contents
         :return: ``git.Blob`` or ``git.Tree`` or ``git.Submodule``
 
         :raise KeyError: if given file or tree does not exist in tree"""
-        msg = "Blob or Tree named %r not found"
-        if '/' in file:
-            tree = self
-            item = self
-            tokens = file.split('/')
-            for i, token in enumerate(tokens):
-                item = tree[token]
-                if item.type == 'tree':
-                    tree = item
-                else:
-                    # safety assertion - blobs are at the end of the path
-                    if i != len(tokens) - 1:
-                        raise KeyError(msg % file)
-                    return item
-                # END handle item type
-            # END for each token of split path
-            if item == self:
-                raise KeyError(msg % file)
-            return item
-        else:
-            for info in self._cache:
-                if info[2] == file:     # [2] == name
-                    return self._map_id_to_type[info[1] >> 12](self.repo, info[0], info[1],
-                                                               join_path(self.path, info[2]))
-            # END for each obj
-            raise KeyError(msg % file)
-        # END handle long paths
+        entry = self._entry_by_path(file)
+        if entry is None:
+            raise KeyError("Blob or Tree named %r not found" % file)
+        return self._map_id_to_type[entry[1] >> 12](self.repo, entry[0], entry[1], join_path(self.path, file))
 
     def __div__(self, file):
         """For PY2 only"""
@@ -269,6 +341,8 @@ class Tree(IndexObject, diff.Diffable, util.Traversable, util.Serializable):
             to change the tree's contents. When done, make sure you call ``set_done``
             on the tree modifier, or serialization behaviour will be incorrect.
             See the ``TreeModifier`` for more information on how to alter the cache"""
+        # lookups fall back to searching the altered entries, which don't match our binsha anymore
+        self._name_index = None
         return TreeModifier(self._cache)
 
     def traverse(self, predicate=lambda i, d: True,
@@ -331,6 +405,8 @@ class Tree(IndexObject, diff.Diffable, util.Traversable, util.Serializable):
 
     def _deserialize(self, stream):
         self._cache = tree_entries_from_data(stream.read())
+        # the data isn't necessarily the one of our binsha
+        self._name_index = None
         return self
 
 
@@ -2,3 +2,4 @@
 # flake8: noqa
 from __future__ import absolute_import
 from .base import *
+from .blame import *
@@ -5,7 +5,8 @@
 # the BSD License: http://www.opensource.org/licenses/bsd-license.php
 
 from builtins import str
-from collections import namedtuple
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import logging
 import os
 import re
@@ -24,16 +25,27 @@ from git.compat import (
     is_win,
 )
 from git.config import GitConfigParser
-from git.db import GitCmdObjectDB
-from git.exc import InvalidGitRepositoryError, NoSuchPathError, GitCommandError
+from git.db import GitCmdObjectDB, CachedObjectDB
+from git.diff import Diffable, Hunk
+from git.exc import InvalidGitRepositoryError, NoSuchPathError, GitCommandError, ODBError
 from git.index import IndexFile
-from git.objects import Submodule, RootModule, Commit
+from git.objects import Submodule, RootModule, Commit, CommitGraph, TreePathCache, GENERATION_NUMBER_INFINITY
 from git.refs import HEAD, Head, Reference, TagReference
 from git.remote import Remote, add_progress, to_progress_instance
 from git.util import Actor, finalize_process, decygpath, hex_to_bin, expand_path
 import os.path as osp
 
-from .fun import rev_parse, is_git_dir, find_submodule_git_dir, touch, find_worktree_git_dir
+from .blame import blame_data_from_porcelain, derive_blame_data, porcelain_from_blame_data
+from .fun import (
+    rev_parse,
+    is_git_dir,
+    find_submodule_git_dir,
+    touch,
+    find_worktree_git_dir,
+    CommitDAG,
+    is_ancestor_many,
+    merge_bases
+)
 import gc
 import gitdb
 
@@ -72,6 +84,9 @@ class Repo(object):
     _working_tree_dir = None
     git_dir = None
     _common_dir = None
+    _commit_graph = False   # False if it wasn't read yet
+    _tree_path_cache = None
+    _blame_cache = None
 
     # precompiled regex
     re_whitespace = re.compile(r'\s+')
@@ -224,6 +239,9 @@ class Repo(object):
             pass
 
     def close(self):
+        if self._commit_graph not in (None, False):
+            self._commit_graph.close()
+        self._commit_graph = False
         if self.git:
             self.git.clear_cache()
             # Tempfiles objects on Windows are holding references to
@@ -249,6 +267,15 @@ class Repo(object):
     def __hash__(self):
         return hash(self.git_dir)
 
+    def __getstate__(self):
+        # the memory map of the commit-graph cannot be pickled, it is read again once needed
+        d = self.__dict__.copy()
+        d.pop('_commit_graph', None)
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+
     # Description property
     def _get_description(self):
         filename = osp.join(self.git_dir, 'description')
@@ -278,6 +305,42 @@ class Repo(object):
         """
         return self._common_dir or self.git_dir
 
+    @property
+    def commit_graph(self):
+        """:return: CommitGraph of this repository, or None if git didn't write one or it cannot be read.
+            It is read on first access, call ``close()`` to pick up a commit-graph written later on."""
+        if self._commit_graph is False:
+            try:
+                self._commit_graph = CommitGraph.from_objects_dir(osp.join(self.common_dir, 'objects'))
+            except (ValueError, EnvironmentError) as err:
+                log.debug("Ignoring commit-graph as it cannot be read: %r", err)
+                self._commit_graph = None
+            # END handle invalid commit-graph
+        return self._commit_graph
+
+    @property
+    def tree_path_cache(self):
+        """:return: TreePathCache used by ``Tree.join`` to memoize the entries found at paths of trees
+            of this repository. Assign a TreePathCache of a different size, or call its ``clear()``
+            method to release memory"""
+        if self._tree_path_cache is None:
+            self._tree_path_cache = TreePathCache()
+        return self._tree_path_cache
+
+    @tree_path_cache.setter
+    def tree_path_cache(self, cache):
+        self._tree_path_cache = cache
+
+    @property
+    def blame_cache(self):
+        """:return: BlameCache used by ``blame()`` to store and derive blame results, or None if they are
+            not cached, which is the default. Assign a BlameCache to enable it"""
+        return self._blame_cache
+
+    @blame_cache.setter
+    def blame_cache(self, cache):
+        self._blame_cache = cache
+
     @property
     def bare(self):
         """:return: True if the repository is bare"""
@@ -515,7 +578,8 @@ class Repo(object):
 
         :param kwargs:
             Arguments to be passed to git-rev-list - common ones are
-            max_count and skip
+            max_count and skip. Pass ``preload=True`` to read all commits from a single
+            git-log process instead, see ``Commit.iter_items``.
 
         :note: to receive only commits between two named revisions, use the
             "revA...revB" revision specifier
@@ -531,6 +595,7 @@ class Repo(object):
 
         :param rev: At least two revs to find the common ancestor for.
         :param kwargs: Additional arguments to be passed to the repo.git.merge_base() command which does all the work.
+            If no arguments but ``all`` are given, the merge base is computed in-process instead.
         :return: A list of Commit objects. If --all was not specified as kwarg, the list will have at max one Commit,
             or is empty if no common merge base exists.
         :raises ValueError: If not at least two revs are provided
@@ -539,6 +604,14 @@ class Repo(object):
             raise ValueError("Please specify at least two revs, got only %i" % len(rev))
         # end handle input
 
+        if set(kwargs) <= set(('a', 'all')):
+            commits = self._commits_or_none(rev)
+            if commits is not None:
+                binshas = merge_bases(CommitDAG(self), [c.binsha for c in commits], any(kwargs.values()))
+                return [Commit(self, binsha) for binsha in binshas]
+            # end handle in-process computation
+        # end handle supported options
+
         res = []
         try:
             lines = self.git.merge_base(*rev, **kwargs).splitlines()
@@ -563,7 +636,16 @@ class Repo(object):
         :param ancestor_rev: Rev which should be an ancestor
         :param rev: Rev to test against ancestor_rev
         :return: ``True``, ancestor_rev is an ancestor to rev.
+        :note: if the ancestor is part of the commit-graph, its generation number bounds the history to walk,
+            and the answer is computed in-process. Otherwise, git walks the history from both commits.
         """
+        commits = self._commits_or_none((ancestor_rev, rev)) if self.commit_graph is not None else None
+        if commits is not None:
+            dag = CommitDAG(self)
+            if dag.info(commits[0].binsha)[0] != GENERATION_NUMBER_INFINITY:
+                return is_ancestor_many(dag, [(commits[0].binsha, commits[1].binsha)])[0]
+        # end handle in-process computation
+
         try:
             self.git.merge_base(ancestor_rev, rev, is_ancestor=True)
         except GitCommandError as err:
@@ -572,6 +654,91 @@ class Repo(object):
             raise
         return True
 
+    def is_ancestor_many(self, pairs):
+        """Check for many pairs of revisions whether the first one is an ancestor of the second one.
+        The history of all revisions is walked at once, which is much faster than calling ``is_ancestor``
+        for each pair.
+
+        :param pairs: iterable of tuple(ancestor_rev, rev) pairs
+        :return: list of bools, one for each pair
+        :raise BadName: if one of the revisions cannot be resolved
+        :raise ValueError: if one of the revisions is no commit
+        :note: if git wrote a commit-graph for this repository, its generation numbers allow to stop
+            walking the history early."""
+        resolved = {}
+
+        def binsha(rev):
+            if rev not in resolved:
+                resolved[rev] = self.commit(rev).binsha
+            return resolved[rev]
+        # end utility
+
+        return is_ancestor_many(CommitDAG(self), [(binsha(a), binsha(b)) for a, b in pairs])
+
+    def diff_many(self, pairs, workers=None, create_patch=False, ordered=True, **kwargs):
+        """Compute the diffs of many pairs using a pool of worker threads. Each diff runs a git process
+        of its own, and objects are read through this repository's process pool, which allows all cores
+        to be used.
+
+        :param pairs: iterable of tuple(item, other) pairs. item is a Commit, Tree or revision string,
+            other is anything accepted by ``Diffable.diff``. Pairs are consumed lazily.
+        :param workers: amount of worker threads, defaults to the amount of CPUs
+        :param create_patch: if True, the diffs contain patches, see ``Diffable.diff``
+        :param ordered: if True, results are yielded in the order of the pairs, otherwise
+            in the order in which they complete
+        :param kwargs: additional arguments for ``Diffable.diff``, like paths, numstat=True or in_process=True
+        :return: iterator yielding tuple(pair, DiffIndex) for each pair
+        :raise GitCommandError: when the result of a failed diff is reached"""
+        workers = workers or os.cpu_count() or 1
+        pairs = iter(pairs)
+        max_pending = workers * 2
+
+        def diff(item, other):
+            if not isinstance(item, Diffable):
+                item = self.rev_parse(item)
+            return item.diff(other, create_patch=create_patch, **kwargs)
+        # end utility
+
+        executor = ThreadPoolExecutor(workers)
+        pending = deque() if ordered else {}
+        try:
+            while True:
+                for pair in pairs:
+                    future = executor.submit(diff, *pair)
+                    if ordered:
+                        pending.append((future, pair))
+                    else:
+                        pending[future] = pair
+                    if len(pending) >= max_pending:
+                        break
+                # end for each pair to submit
+
+                if not pending:
+                    break
+                if ordered:
+                    future, pair = pending.popleft()
+                    yield pair, future.result()
+                else:
+                    for future in wait(pending, return_when=FIRST_COMPLETED).done:
+                        yield pending.pop(future), future.result()
+                # end handle order
+            # end while there are results
+        finally:
+            for future in pending:
+                if ordered:
+                    future = future[0]
+                future.cancel()
+            executor.shutdown(wait=True)
+        # end assure workers are stopped
+
+    def _commits_or_none(self, revs):
+        """:return: list of Commits for the given revs, or None if one of them cannot be resolved in-process"""
+        try:
+            return [self.commit(rev) for rev in revs]
+        except (ODBError, ValueError):
+            return None
+        # end handle invalid revs
+
     def _get_daemon_export(self):
         filename = osp.join(self.git_dir, self.DAEMON_EXPORT_FILE)
         return osp.exists(filename)
@@ -721,11 +888,22 @@ class Repo(object):
 
         If you combine all line number ranges outputted by this command, you
         should get a continuous range spanning all line numbers in the file.
+
+        Entries are yielded as soon as git wrote them, while git is still running.
+        :raise GitCommandError: once the output was read, if git failed
         """
-        data = self.git.blame(rev, '--', file, p=True, incremental=True, stdout_as_string=False, **kwargs)
+        proc = self.git.blame(rev, '--', file, p=True, incremental=True, as_process=True, **kwargs)
+        for entry in self._iter_blame_incremental(proc.stdout):
+            yield entry
+        # END for each entry
+        finalize_process(proc)
+
+    def _iter_blame_incremental(self, lines):
+        """:return: iterator yielding BlameEntry tuples parsed from the given lines of
+            git-blame --incremental output"""
         commits = {}
 
-        stream = (line for line in data.split(b'\n') if line)
+        stream = (line for line in (line.rstrip(b'\n') for line in lines) if line)
         while True:
             try:
                 line = next(stream)  # when exhausted, causes a StopIteration, terminating this function
@@ -793,8 +971,104 @@ class Repo(object):
             of appearance."""
         if incremental:
             return self.blame_incremental(rev, file, **kwargs)
+        if self._blame_cache is not None and not kwargs:
+            blames = self._blame_cached(rev, file)
+            if blames is not None:
+                return blames
+        # END use blame cache
 
         data = self.git.blame(rev, '--', file, p=True, stdout_as_string=False, **kwargs)
+        return self._blame_from_porcelain(data)
+
+    def _blame_cached(self, rev, file):
+        """:return: result of ``blame()`` obtained using the blame cache, or None if it can't be used
+            for the given revision and file"""
+        cache = self._blame_cache
+        try:
+            commit = self.commit(rev)
+            path = str(file).replace(os.sep, '/')
+            while path.startswith('./'):
+                path = path[2:]
+            blob = commit.tree[path]
+        except (ODBError, ValueError, KeyError):
+            return None
+        if blob.type != 'blob':
+            return None
+        # END handle unsupported revisions and paths
+
+        data = cache.get(commit.hexsha, path)
+        if data is not None and data['blob'] == blob.hexsha:
+            cache.hits += 1
+        else:
+            data = self._derive_blame_data(cache, commit, path)
+            if data is None:
+                cache.misses += 1
+                output = self.git.blame(commit.hexsha, '--', path, p=True, stdout_as_string=False)
+                data = blame_data_from_porcelain(output)
+                data['blob'] = blob.hexsha
+                cache.set(commit.hexsha, path, data)
+                return self._blame_from_porcelain(output)
+            # END handle miss
+            cache.derived += 1
+            cache.set(commit.hexsha, path, data)
+        # END handle cached data
+
+        try:
+            return self._blame_from_porcelain(porcelain_from_blame_data(data, blob.data_stream.read()))
+        except (ValueError, KeyError, IndexError):
+            return None
+        # END handle inconsistent data
+
+    def _derive_blame_data(self, cache, commit, path):
+        """:return: blame data of the blob at path in the given commit, derived from the cached blame data
+            of its nearest ancestor along first parents, or None if there is none, or if one of the commits
+            in between has more than one parent or doesn't contain the path"""
+        chain = [(commit, commit.tree[path].hexsha)]
+        data = None
+        while data is None:
+            child = chain[-1][0]
+            if len(chain) > cache.max_depth or len(child.parents) != 1:
+                return None
+            parent = child.parents[0]
+            try:
+                blob = parent.tree[path]
+            except KeyError:
+                return None
+            if blob.type != 'blob':
+                return None
+            chain.append((parent, blob.hexsha))
+            data = cache.get(parent.hexsha, path)
+        # END for each ancestor
+        if data['blob'] != chain[-1][1]:
+            return None
+
+        changes = [(child, parent_blob, blob) for (child, blob), (_, parent_blob) in zip(chain, chain[1:])
+                   if blob != parent_blob]
+        details = {}
+        if changes:
+            output = self.git.show('-s', '--format=%H%x00%aN%x00%aE%x00%at%x00%cN%x00%cE%x00%ct',
+                                   *[child.hexsha for child, _, _ in changes], stdout_as_string=False)
+            for line in output.decode(defenc, 'surrogateescape').splitlines():
+                hexsha, author, author_mail, author_time, committer, committer_mail, committer_time = \
+                    line.split('\0')
+                details[hexsha] = {'author': author, 'author-mail': '<%s>' % author_mail,
+                                   'author-time': author_time, 'committer': committer,
+                                   'committer-mail': '<%s>' % committer_mail, 'committer-time': committer_time}
+            # END for each commit
+        # END read commit details
+
+        for child, parent_blob, blob in reversed(changes):
+            diff = self.git.diff('-U0', '--no-color', '--no-ext-diff', '--text', parent_blob, blob,
+                                 stdout_as_string=False)
+            hunks = [tuple(int(count) if count is not None else 1 for count in match.groups()[:4])
+                     for match in Hunk.re_header.finditer(diff)]
+            data = derive_blame_data(data, hunks, child.hexsha, path, details[child.hexsha])
+        # END for each change
+        data['blob'] = chain[0][1]
+        return data
+
+    def _blame_from_porcelain(self, data):
+        """:return: result of ``blame()`` parsed from the given git-blame --porcelain output"""
         commits = {}
         blames = []
         info = None
@@ -999,7 +1273,8 @@ class Repo(object):
             * All remaining keyword arguments are given to the git-clone command
 
         :return: ``git.Repo`` (the newly cloned repo)"""
-        return self._clone(self.git, self.common_dir, path, type(self.odb), progress, multi_options, **kwargs)
+        odb = self.odb.odb if isinstance(self.odb, CachedObjectDB) else self.odb
+        return self._clone(self.git, self.common_dir, path, type(odb), progress, multi_options, **kwargs)
 
     @classmethod
     def clone_from(cls, url, to_path, progress=None, env=None, multi_options=None, **kwargs):
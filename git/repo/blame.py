@@ -0,0 +1,262 @@
+"""Persistent cache for the results of ``Repo.blame``"""
+import hashlib
+import json
+import os
+import os.path as osp
+import re
+import threading
+import zlib
+
+from git.compat import defenc
+from git.diff import decode_path
+from git.util import rmtree
+
+__all__ = ('BlameCache', )
+
+# first line of a group of lines in git-blame --porcelain output, or of a single line within the group
+_porcelain_header_regex = re.compile(br'^([0-9a-f]{40}) (\d+) (\d+)(?: (\d+))?$')
+
+# details of commits in git-blame --porcelain output which are stored, in the order git writes them
+_detail_tags = ('author', 'author-mail', 'author-time', 'committer', 'committer-mail', 'committer-time')
+
+
+def blame_data_from_porcelain(output):
+    """
+    :return: dict with the 'entries' and commit 'details' of the given git-blame --porcelain output.
+        Entries are [hexsha, orig_lineno, lineno, num_lines, orig_path] lists of groups of lines blamed
+        on the same commit, details map the hexsha of each commit to a dict of its author and committer
+        information. Line numbers start at 1."""
+    entries = []
+    details = {}
+    paths = {}
+    entry = None
+    for line in output.split(b'\n'):
+        if line.startswith(b'\t'):
+            continue
+        match = _porcelain_header_regex.match(line)
+        if match:
+            if match.group(4) is not None:
+                hexsha = match.group(1).decode('ascii')
+                entry = [hexsha, int(match.group(2)), int(match.group(3)), int(match.group(4)), paths.get(hexsha)]
+                entries.append(entry)
+            continue
+        # END handle header
+
+        tag, _, value = line.partition(b' ')
+        tag = tag.decode('ascii', 'replace')
+        if tag in _detail_tags:
+            details.setdefault(entry[0], {})[tag] = value.decode(defenc, 'surrogateescape')
+        elif tag == 'filename':
+            entry[4] = paths[entry[0]] = decode_path(value, has_ab_prefix=False).decode(defenc, 'surrogateescape')
+        # END handle tag
+    # END for each line
+    return {'entries': entries, 'details': details}
+
+
+def porcelain_from_blame_data(data, blob_data):
+    """
+    :return: git-blame --porcelain output of the given blame data, see ``blame_data_from_porcelain``.
+        Paths are written without quoting them
+    :param blob_data: content of the blamed file
+    :raise ValueError: if the blame data doesn't cover all lines of the file"""
+    lines = blob_data.split(b'\n')
+    if not lines[-1]:
+        lines.pop()
+    entries = sorted(data['entries'], key=lambda e: e[2])
+    if sum(e[3] for e in entries) != len(lines):
+        raise ValueError("Blame data of %i lines doesn't match a file of %i lines"
+                         % (sum(e[3] for e in entries), len(lines)))
+    # END check line count
+
+    paths = {}
+    for hexsha, _, _, _, orig_path in entries:
+        paths.setdefault(hexsha, set()).add(orig_path)
+    # END for each entry
+
+    out = []
+    shown = set()
+    for hexsha, orig_lineno, lineno, num_lines, orig_path in entries:
+        out.append(('%s %i %i %i' % (hexsha, orig_lineno, lineno, num_lines)).encode('ascii'))
+        if hexsha not in shown:
+            shown.add(hexsha)
+            details = data['details'][hexsha]
+            out.extend(('%s %s' % (tag, details[tag])).encode(defenc, 'surrogateescape') for tag in _detail_tags)
+            out.append(('filename %s' % orig_path).encode(defenc, 'surrogateescape'))
+        elif len(paths[hexsha]) > 1:
+            out.append(('filename %s' % orig_path).encode(defenc, 'surrogateescape'))
+        # END handle commit details
+        out.append(b'\t' + lines[lineno - 1])
+        for i in range(1, num_lines):
+            out.append(('%s %i %i' % (hexsha, orig_lineno + i, lineno + i)).encode('ascii'))
+            out.append(b'\t' + lines[lineno - 1 + i])
+        # END for each further line
+    # END for each entry
+    out.append(b'')
+    return b'\n'.join(out)
+
+
+def derive_blame_data(data, hunks, hexsha, path, details):
+    """
+    :return: blame data of a file in a commit, derived from the blame data of the file in its only parent
+    :param data: blame data of the file in the parent, see ``blame_data_from_porcelain``
+    :param hunks: list of (old_start, old_lines, new_start, new_lines) tuples of the hunks of the diff
+        of the file in the parent and the file in the commit, without context lines
+    :param hexsha: hexsha of the commit, which all changed lines are blamed on
+    :param path: path of the file in the commit
+    :param details: author and committer details of the commit, as stored in the blame data"""
+    lines = []
+    for line_hexsha, orig_lineno, _, num_lines, orig_path in sorted(data['entries'], key=lambda e: e[2]):
+        lines.extend((line_hexsha, orig_lineno + i, orig_path) for i in range(num_lines))
+    # END for each entry of the parent
+
+    new_lines = []
+    pos = 0
+    for old_start, old_count, new_start, new_count in hunks:
+        # the start of empty ranges is the line before them
+        old_start -= bool(old_count)
+        new_start -= bool(new_count)
+        new_lines.extend(lines[pos:old_start])
+        new_lines.extend((hexsha, new_start + i + 1, path) for i in range(new_count))
+        pos = old_start + old_count
+    # END for each hunk
+    new_lines.extend(lines[pos:])
+
+    entries = []
+    for lineno, (line_hexsha, orig_lineno, orig_path) in enumerate(new_lines, 1):
+        entry = entries and entries[-1] or None
+        if (entry is not None and entry[0] == line_hexsha and entry[4] == orig_path and
+                entry[1] + entry[3] == orig_lineno):
+            entry[3] += 1
+        else:
+            entries.append([line_hexsha, orig_lineno, lineno, 1, orig_path])
+    # END for each line
+
+    all_details = dict(data['details'])
+    all_details[hexsha] = details
+    return {'entries': entries, 'details': dict((e[0], all_details[e[0]]) for e in entries)}
+
+
+class BlameCache(object):
+
+    """Size-bounded on-disk cache of the results of ``Repo.blame`` for files at commits, stored as one
+    compressed file per commit and path below the given directory. It's not used unless it is assigned
+    to a repository::
+
+        repo.blame_cache = BlameCache(osp.join(repo.git_dir, 'blame-cache'))
+
+    If a commit isn't cached, its blame is derived from the cached blame of an ancestor and the diffs
+    of the file in between, as long as the commits in between have a single parent and don't rename the
+    file. The files which were used least recently are removed once the total size exceeds max_bytes.
+
+    The attributes hits, derived and misses count the blames read from the cache, derived from an
+    ancestor and obtained from git. evictions counts the removed files."""
+
+    __slots__ = ('path', 'max_bytes', 'max_depth', 'hits', 'derived', 'misses', 'evictions', '_size', '_lock')
+
+    # version of the stored data, files of other versions are ignored
+    version = 1
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, max_depth=100):
+        """
+        :param path: directory to store the cache in, usually below the git directory
+        :param max_bytes: maximum total size of all cached files
+        :param max_depth: maximum amount of first parents to search for a cached ancestor"""
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_depth = max_depth
+        self.hits = 0
+        self.derived = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = None       # total size of all files, computed once needed
+        self._lock = threading.Lock()
+
+    def _file_path(self, hexsha, path):
+        name = hashlib.sha1(('%s\0%s' % (hexsha, path)).encode(defenc, 'surrogateescape')).hexdigest()
+        return osp.join(self.path, name[:2], name[2:])
+
+    def _iter_files(self):
+        """:return: iterator yielding (mtime, size, path) of all cached files"""
+        if not osp.isdir(self.path):
+            return
+        for dirpath, _, filenames in os.walk(self.path):
+            for name in filenames:
+                path = osp.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+            # END for each file
+        # END for each directory
+
+    @property
+    def size(self):
+        """:return: total size of all cached files in bytes"""
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._iter_files())
+            return self._size
+
+    def get(self, hexsha, path):
+        """:return: blame data of the file at path in the commit with the given hexsha, see
+            ``blame_data_from_porcelain``, or None if it isn't cached"""
+        file_path = self._file_path(hexsha, path)
+        try:
+            with open(file_path, 'rb') as fp:
+                data = json.loads(zlib.decompress(fp.read()).decode('ascii'))
+            # mark the file as recently used
+            os.utime(file_path, None)
+        except (OSError, IOError, ValueError, zlib.error):
+            return None
+        # END handle missing or broken files
+        if data.get('version') != self.version or data.get('commit') != hexsha or data.get('path') != path:
+            return None
+        return data
+
+    def set(self, hexsha, path, data):
+        """Store the blame data of the file at path in the commit with the given hexsha, and remove the
+        least recently used files if the cache grows too large"""
+        data = dict(data, version=self.version, commit=hexsha, path=path)
+        raw = zlib.compress(json.dumps(data, separators=(',', ':')).encode('ascii'))
+        file_path = self._file_path(hexsha, path)
+        size = self.size
+        try:
+            size -= os.stat(file_path).st_size
+        except OSError:
+            if not osp.isdir(osp.dirname(file_path)):
+                os.makedirs(osp.dirname(file_path))
+        # END handle existing file
+
+        tmp_path = '%s.%i.%i.tmp' % (file_path, os.getpid(), threading.current_thread().ident)
+        with open(tmp_path, 'wb') as fp:
+            fp.write(raw)
+        os.replace(tmp_path, file_path)
+
+        with self._lock:
+            self._size = size + len(raw)
+            if self._size > self.max_bytes:
+                self._evict()
+        # END handle size
+
+    def _evict(self):
+        """Remove the least recently used files until the total size is below max_bytes"""
+        files = sorted(self._iter_files())
+        self._size = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+            self.evictions += 1
+        # END for each file, oldest first
+
+    def clear(self):
+        """Remove all cached files"""
+        with self._lock:
+            if osp.isdir(self.path):
+                rmtree(self.path)
+            self._size = 0
@@ -1,11 +1,12 @@
 """Package with general repository related functions"""
+import heapq
 import os
 import stat
 from string import digits
 
 from git.compat import xrange
 from git.exc import WorkTreeRepositoryUnsupported
-from git.objects import Object
+from git.objects import Object, GENERATION_NUMBER_INFINITY
 from git.refs import SymbolicReference
 from git.util import hex_to_bin, bin_to_hex, decygpath
 from gitdb.exc import (
@@ -18,7 +19,7 @@ from git.cmd import Git
 
 
 __all__ = ('rev_parse', 'is_git_dir', 'touch', 'find_submodule_git_dir', 'name_to_object', 'short_to_long', 'deref_tag',
-           'to_commit', 'find_worktree_git_dir')
+           'to_commit', 'find_worktree_git_dir', 'CommitDAG', 'is_ancestor_many', 'merge_bases')
 
 
 def touch(filename):
@@ -342,3 +343,217 @@ def rev_parse(repo, rev):
         raise ValueError("Didn't consume complete rev spec %s, consumed part: %s" % (rev, rev[:parsed_to]))
 
     return obj
+
+
+#{ Ancestry
+
+# flags used when painting the commit graph while searching merge bases
+_PARENT1 = 1
+_PARENT2 = 2
+_STALE = 4
+
+
+class CommitDAG(object):
+
+    """Provides the generation number, commit date and parents of commits, preferring the
+    commit-graph of the repository and reading the commit objects otherwise. All information
+    is cached, which allows to answer many ancestry queries while reading each commit once.
+
+    Commits are identified by their binary sha"""
+
+    __slots__ = ('odb', 'graph', '_cache')
+
+    def __init__(self, repo):
+        self.odb = repo.odb
+        self.graph = repo.commit_graph
+        self._cache = {}
+
+    def info(self, binsha):
+        """:return: tuple(generation, committed_date, parent_binshas) of the given commit.
+            Commits which are not part of the commit-graph, or whose generation number is unknown,
+            have GENERATION_NUMBER_INFINITY"""
+        info = self._cache.get(binsha)
+        if info is not None:
+            return info
+
+        graph = self.graph
+        pos = graph.position(binsha) if graph is not None else None
+        if pos is not None:
+            # graphs written by early versions of git have no generation numbers, which are 0 then
+            info = (graph.generation(pos) or GENERATION_NUMBER_INFINITY, graph.committed_date(pos),
+                    tuple(graph.binsha(p) for p in graph.parent_positions(pos)))
+        else:
+            header = self.odb.stream(binsha).read().split(b'\n\n', 1)[0]
+            parents = []
+            date = 0
+            for line in header.split(b'\n'):
+                if line.startswith(b'parent '):
+                    parents.append(hex_to_bin(line[7:]))
+                elif line.startswith(b'committer '):
+                    date = int(line.rsplit(b' ', 2)[1])
+                # END handle header line
+            # END for each header line
+            info = (GENERATION_NUMBER_INFINITY, date, tuple(parents))
+        # END handle commit-graph
+        self._cache[binsha] = info
+        return info
+
+
+def _push(heap, dag, binsha):
+    generation, date = dag.info(binsha)[:2]
+    heapq.heappush(heap, (-generation, -date, binsha))
+
+
+def is_ancestor_many(dag, pairs):
+    """Answer whether the first commit of each pair is an ancestor of the second one, walking the
+    history of all second commits at once and reading each commit at most once.
+
+    :param dag: CommitDAG to use
+    :param pairs: iterable of tuple(ancestor_binsha, binsha) pairs
+    :return: list of bools, one for each pair. Each commit is considered its own ancestor.
+    :note: if the commit-graph is available, commits whose generation is smaller than the ones of all
+        remaining ancestor candidates are not followed"""
+    pairs = list(pairs)
+    answers = [False] * len(pairs)
+
+    # each descendant gets its own bit, which is painted onto all of its ancestors
+    bits = {}
+    targets = {}    # ancestor_binsha -> list of (pair index, bit)
+    for i, (ancestor, binsha) in enumerate(pairs):
+        bit = bits.setdefault(binsha, 1 << len(bits))
+        targets.setdefault(ancestor, []).append((i, bit))
+    # END for each pair
+
+    def min_generation():
+        return min(dag.info(binsha)[0] for binsha in targets) if targets else 0
+
+    def paint(binsha, flags):
+        # answer all queries for the given commit, and forget about targets which are fully answered
+        queries = targets.get(binsha)
+        if queries is None:
+            return False
+        remaining = [(i, bit) for i, bit in queries if not flags & bit]
+        for i, bit in queries:
+            if flags & bit:
+                answers[i] = True
+        # END for each query
+        if remaining:
+            targets[binsha] = remaining
+            return False
+        del targets[binsha]
+        return True
+
+    flags = {}
+    expanded = {}
+    heap = []
+    for binsha, bit in bits.items():
+        flags[binsha] = bit
+        _push(heap, dag, binsha)
+    # END for each descendant
+    cutoff = min_generation()
+    for binsha, bit in bits.items():
+        if paint(binsha, bit):
+            cutoff = min_generation()
+    # END answer trivial queries
+
+    while heap and targets:
+        generation, _date, binsha = heapq.heappop(heap)
+        generation = -generation
+        commit_flags = flags[binsha]
+        if expanded.get(binsha) == commit_flags:
+            continue
+        expanded[binsha] = commit_flags
+
+        # ancestors have smaller generation numbers, and commits in the commit-graph cannot reach commits
+        # which are not in it
+        if generation < cutoff or (generation == cutoff and cutoff != GENERATION_NUMBER_INFINITY):
+            continue
+
+        for parent in dag.info(binsha)[2]:
+            parent_flags = flags.get(parent, 0)
+            if parent_flags | commit_flags == parent_flags:
+                continue
+            parent_flags |= commit_flags
+            flags[parent] = parent_flags
+            if paint(parent, parent_flags):
+                cutoff = min_generation()
+            _push(heap, dag, parent)
+        # END for each parent
+    # END while there are commits to paint
+    return answers
+
+
+def merge_bases(dag, binshas, all=False):
+    """Find the best common ancestors of the first commit and all other commits, like git-merge-base
+
+    :param dag: CommitDAG to use
+    :param binshas: list of at least two binary shas of commits
+    :param all: if True, return all merge bases, otherwise at most one
+    :return: list of binary shas of the merge bases, the most recent ones first"""
+    flags = {binshas[0]: _PARENT1}
+    for binsha in binshas[1:]:
+        flags[binsha] = flags.get(binsha, 0) | _PARENT2
+    # END for each other commit
+
+    # the heap holds tuple(-generation, -date, binsha) items, a commit may be queued more than once.
+    # nonstale counts the queued items of commits which are not reachable from a merge base, we are done
+    # once there are none of them
+    expanded = {}
+    queued = {}
+    heap = []
+    nonstale = 0
+
+    def push(binsha):
+        generation, date = dag.info(binsha)[:2]
+        heapq.heappush(heap, (-generation, -date, binsha))
+        queued[binsha] = queued.get(binsha, 0) + 1
+        return not flags[binsha] & _STALE
+    # END utility
+
+    for binsha in flags:
+        nonstale += push(binsha)
+    # END for each commit
+    candidates = []
+
+    while nonstale:
+        binsha = heapq.heappop(heap)[2]
+        queued[binsha] -= 1
+        commit_flags = flags[binsha]
+        nonstale -= not commit_flags & _STALE
+        if expanded.get(binsha) == commit_flags:
+            continue
+        expanded[binsha] = commit_flags
+
+        if commit_flags == _PARENT1 | _PARENT2:
+            if binsha not in candidates:
+                candidates.append(binsha)
+            # all ancestors of a merge base are no best common ancestors
+            commit_flags |= _STALE
+        # END handle merge base
+
+        for parent in dag.info(binsha)[2]:
+            parent_flags = flags.get(parent, 0)
+            if parent_flags | commit_flags == parent_flags:
+                continue
+            if commit_flags & _STALE and not parent_flags & _STALE:
+                # the items already queued for the parent became stale
+                nonstale -= queued.get(parent, 0)
+            # END handle parent turning stale
+            flags[parent] = parent_flags | commit_flags
+            nonstale += push(parent)
+        # END for each parent
+    # END while there are commits which are not reachable from a merge base
+
+    # candidates found to be reachable from another merge base later on are no best common ancestors either
+    candidates = [binsha for binsha in candidates if not flags[binsha] & _STALE]
+    if len(candidates) > 1:
+        pairs = [(a, b) for a in candidates for b in candidates if a != b]
+        redundant = set(a for (a, _b), answer in zip(pairs, is_ancestor_many(dag, pairs)) if answer)
+        candidates = [binsha for binsha in candidates if binsha not in redundant]
+    # END remove redundant candidates
+
+    if not all:
+        candidates = candidates[:1]
+    return candidates
+
+#} END ancestry
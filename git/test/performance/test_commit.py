@@ -79,6 +79,18 @@ class TestPerformance(TestBigRepoRW):
         print("Iterated %i Commits in %s [s] ( %f commits/s )"
               % (nc, elapsed_time, nc / elapsed_time), file=sys.stderr)
 
+    def test_commit_iteration_preload(self):
+        # bound to git-log output parsing performance
+        nc = 0
+        st = time()
+        for c in Commit.iter_items(self.gitrorepo, self.gitrorepo.head, preload=True):
+            nc += 1
+            self._query_commit_info(c)
+        # END for each iterated commit
+        elapsed_time = time() - st
+        print("Iterated %i preloaded Commits in %s [s] ( %f commits/s )"
+              % (nc, elapsed_time, nc / elapsed_time), file=sys.stderr)
+
     def test_commit_serialization(self):
         assert_commit_serialization(self.gitrwrepo, '58c78e6', True)
 
@@ -0,0 +1,178 @@
+"""Performance tests for reading index files"""
+from __future__ import print_function
+
+from contextlib import closing
+from io import BytesIO
+import mmap
+import os
+from shutil import rmtree
+import sys
+import tempfile
+from time import time
+
+from git import IndexFile, Repo
+from git.compat import defenc
+from git.index.fun import (
+    entry_key,
+    read_cache,
+    read_header,
+    write_cache
+)
+from git.index.typ import (
+    BaseIndexEntry,
+    IndexEntry,
+    IndexEntries,
+    CE_NAMEMASK
+)
+from git.index.util import (
+    pack,
+    unpack
+)
+from git.test.lib import with_rw_directory
+
+from .lib import (
+    TestBigRepoR
+)
+
+
+def _read_cache_unpacking(stream):
+    """The previous implementation of read_cache, which reads and unpacks each field of an entry separately"""
+    version, num_entries = read_header(stream)
+    count = 0
+    entries = {}
+
+    read = stream.read
+    tell = stream.tell
+    while count < num_entries:
+        beginoffset = tell()
+        ctime = unpack(">8s", read(8))[0]
+        mtime = unpack(">8s", read(8))[0]
+        (dev, ino, mode, uid, gid, size, sha, flags) = \
+            unpack(">LLLLLL20sH", read(20 + 4 * 6 + 2))
+        path_size = flags & CE_NAMEMASK
+        path = read(path_size).decode(defenc)
+
+        real_size = ((tell() - beginoffset + 8) & ~7)
+        read((beginoffset + real_size) - tell())
+        entry = IndexEntry((mode, sha, flags, path, ctime, mtime, dev, ino, uid, gid, size))
+        entries[(path, entry.stage)] = entry
+        count += 1
+    # END for each entry
+
+    extension_data = stream.read(~0)
+    return (version, entries, extension_data[:-20], extension_data[-20:])
+
+
+class TestIndexPerformance(TestBigRepoR):
+
+    def _read(self, index_path, rounds):
+        results = []
+        for read in (_read_cache_unpacking, read_cache):
+            st = time()
+            for _ in range(rounds):
+                with open(index_path, 'rb') as fp:
+                    with closing(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)) as data:
+                        result = read(data)
+                    # END map index
+                # END open index
+            # END for each round
+            results.append(time() - st)
+        # END for each implementation
+        return results, result
+
+    def test_read_cache(self):
+        # the index of the repository
+        index_path = self.gitrorepo.index.path
+        with open(index_path, 'rb') as fp:
+            data = fp.read()
+        # END read index
+        assert read_cache(BytesIO(data)) == _read_cache_unpacking(BytesIO(data))
+        (old, new), result = self._read(index_path, 20)
+        ne = len(result[1]) * 20
+        print("Read an index with %i entries 20 times: unpacking in %f s ( %i entries / s ), "
+              "in place in %f s ( %i entries / s ), %.1fx faster"
+              % (ne // 20, old, ne / old, new, ne / new, old / new), file=sys.stderr)
+
+        # a big index, with some non-ascii paths
+        time_data = pack(">LL", 1500000000, 0)
+        entries = sorted((IndexEntry((0o100644, b'\1' * 20, 0, u'dir_%03i/file_%06i_\xe4.py' % (i % 500, i)
+                                      if i % 3 else 'dir_%03i/file_%06i.py' % (i % 500, i),
+                                      time_data, time_data, 1, i, 1000, 1000, i))
+                          for i in range(200000)), key=lambda e: e.path)
+        fd, index_path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                write_cache(entries, fp)
+            # END write index
+            (old, new), result = self._read(index_path, 3)
+            assert len(result[1]) == len(entries)
+            with open(index_path, 'rb') as fp:
+                assert result == _read_cache_unpacking(fp)
+            # END compare results
+        finally:
+            os.remove(index_path)
+        # END remove index
+        ne = len(entries) * 3
+        print("Read an index with %i entries 3 times: unpacking in %f s ( %i entries / s ), "
+              "in place in %f s ( %i entries / s ), %.1fx faster"
+              % (len(entries), old, ne / old, new, ne / new, old / new), file=sys.stderr)
+
+    @with_rw_directory
+    def test_write_tree(self, rw_dir):
+        # a big index in directories three levels deep, without cached trees
+        repo = Repo.init(rw_dir)
+        index = IndexFile(repo)
+        entries = [IndexEntry.from_base(BaseIndexEntry((0o100644, b'\1' * 20, 0, 'dir_%02i/sub_%02i/file_%06i'
+                                                        % (i % 50, i % 40, i)))) for i in range(200000)]
+        index.entries = IndexEntries((entry_key(entry), entry) for entry in entries)
+
+        st = time()
+        tree = index.write_tree()
+        full = time() - st
+        ntrees = len(index.entries.cache_tree)
+
+        # change a single entry, only the trees containing it are written again
+        entry = entries[1234]
+        index.entries[entry_key(entry)] = IndexEntry.from_base(BaseIndexEntry((0o100644, b'\2' * 20, 0, entry.path)))
+        st = time()
+        new_tree = index.write_tree()
+        incremental = time() - st
+        assert new_tree != tree
+
+        # the same tree is written without cached trees
+        index.entries = IndexEntries(index.entries)
+        st = time()
+        assert index.write_tree() == new_tree
+        uncached = time() - st
+        print("Wrote a tree of %i entries in %i trees in %f s, after changing one entry in %f s using cached trees, "
+              "and in %f s without them, %.1fx faster" % (len(entries), ntrees, full, incremental, uncached,
+                                                          uncached / incremental), file=sys.stderr)
+
+    @with_rw_directory
+    def test_add(self, rw_dir):
+        # many files of a few kilobytes each, added to a fresh repository
+        nfiles = 20000
+        paths = ['dir_%02i/file_%06i' % (i % 50, i) for i in range(nfiles)]
+        for i, path in enumerate(paths):
+            fp = os.path.join(rw_dir, 'work', path)
+            if not os.path.isdir(os.path.dirname(fp)):
+                os.makedirs(os.path.dirname(fp))
+            with open(fp, 'wb') as fd:
+                fd.write(os.urandom(1024) * (i % 8 + 1))
+        # END for each file
+
+        results = []
+        for workers in (1, None):
+            repo = Repo.init(os.path.join(rw_dir, 'work'))
+            index = IndexFile(repo, os.path.join(rw_dir, 'index_%s' % workers))
+            st = time()
+            index.add(paths, write=False, workers=workers)
+            results.append((time() - st, index.write_tree()))
+            assert index.hashed == nfiles
+            rmtree(repo.odb.root_path())
+        # END for each amount of workers
+        (sequential, tree), (parallel, parallel_tree) = results
+        assert parallel_tree == tree
+        print("Added %i files one after another in %f s ( %i files / s ), and by %i worker threads in %f s "
+              "( %i files / s ), %.1fx faster" % (nfiles, sequential, nfiles / sequential, os.cpu_count(), parallel,
+                                                  nfiles / parallel, sequential / parallel), file=sys.stderr)
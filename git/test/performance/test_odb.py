@@ -4,6 +4,9 @@ from __future__ import print_function
 import sys
 from time import time
 
+from git import Repo
+from git.db import GitHybridObjectDB
+
 from .lib import (
     TestBigRepoR
 )
@@ -72,3 +75,48 @@ class TestObjDBPerformance(TestBigRepoR):
         for test_name, a, b in results:
             print("%s: %f s vs %f s, pure is %f times slower" % (test_name, a, b, b / a), file=sys.stderr)
         # END for each result
+
+    def test_pipelined_info(self):
+        odb = self.gitrorepo.odb
+        shas = [item.binsha for item in self.gitrorepo.commit(self.gitrorepo.head).tree.traverse()]
+        ns = len(shas)
+
+        st = time()
+        for sha in shas:
+            odb.info(sha)
+        elapsed_single = time() - st
+
+        st = time()
+        for _info in odb.info_many(shas):
+            pass
+        elapsed_many = time() - st
+
+        print("Queried %i object headers one by one in %g s ( %f infos / s ), pipelined in %g s ( %f infos / s )"
+              % (ns, elapsed_single, ns / elapsed_single, elapsed_many, ns / elapsed_many), file=sys.stderr)
+
+        st = time()
+        nb = 0
+        for ostream in odb.stream_many(shas):
+            nb += len(ostream.read())
+        elapsed = time() - st
+        print("Streamed %i objects (%i KiB) pipelined in %g s ( %f objects / s )"
+              % (ns, nb / 1000, elapsed, ns / elapsed), file=sys.stderr)
+
+    def test_hybrid_random_access(self):
+        hybridrepo = Repo(self.gitrorepo.working_tree_dir or self.gitrorepo.git_dir, odbt=GitHybridObjectDB)
+        shas = [item.binsha for item in self.gitrorepo.commit(self.gitrorepo.head).tree.traverse()]
+        ns = len(shas)
+
+        elapsed = []
+        for repo in (self.gitrorepo, hybridrepo):
+            st = time()
+            nb = 0
+            for sha in shas:
+                repo.odb.info(sha)
+                nb += len(repo.odb.stream(sha).read())
+            # END for each sha
+            elapsed.append(time() - st)
+            print("%s: Retrieved %i objects (%i KiB) in %g s ( %f objects / s )"
+                  % (type(repo.odb), ns, nb / 1000, elapsed[-1], ns / elapsed[-1]), file=sys.stderr)
+        # END for each repo type
+        print("Hybrid is %f times faster" % (elapsed[0] / elapsed[1]), file=sys.stderr)
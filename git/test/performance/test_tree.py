@@ -0,0 +1,85 @@
+"""Performance tests for parsing trees"""
+from __future__ import print_function
+
+import sys
+from io import BytesIO
+from time import time
+
+from git.compat import safe_decode
+from git.objects.fun import (
+    tree_entries_from_data,
+    tree_to_stream
+)
+
+from .lib import (
+    TestBigRepoR
+)
+
+
+def _tree_entries_from_data_bytewise(data):
+    """The previous implementation of tree_entries_from_data, which walks the data byte by byte"""
+    ord_zero = ord('0')
+    space_ord = ord(' ')
+    len_data = len(data)
+    i = 0
+    out = []
+    while i < len_data:
+        mode = 0
+        while data[i] != space_ord:
+            mode = (mode << 3) + (data[i] - ord_zero)
+            i += 1
+        # END while reading mode
+        i += 1
+        ns = i
+        while data[i] != 0:
+            i += 1
+        # END while not reached NULL
+        name = safe_decode(data[ns:i])
+        i += 1
+        out.append((data[i:i + 20], mode, name))
+        i += 20
+    # END for each byte in data stream
+    return out
+
+
+class TestTreePerformance(TestBigRepoR):
+
+    def _parse(self, datas, rounds):
+        results = []
+        for parse in (_tree_entries_from_data_bytewise, tree_entries_from_data):
+            st = time()
+            for _ in range(rounds):
+                for data in datas:
+                    parse(data)
+            # END for each round
+            results.append(time() - st)
+        # END for each implementation
+        return results
+
+    def test_tree_entries_from_data(self):
+        # all trees of the head commit
+        odb = self.gitrorepo.odb
+        trees = [self.gitrorepo.head.commit.tree]
+        trees.extend(self.gitrorepo.head.commit.tree.traverse(predicate=lambda i, d: i.type == 'tree'))
+        datas = [odb.stream(tree.binsha).read() for tree in trees]
+        for data in datas:
+            assert tree_entries_from_data(data) == _tree_entries_from_data_bytewise(data)
+        # END for each tree
+        ne = sum(len(tree) for tree in trees) * 20
+        old, new = self._parse(datas, 20)
+        print("Parsed %i tree entries of %i trees 20 times: bytewise in %f s ( %i entries / s ), "
+              "vectorized in %f s ( %i entries / s ), %.1fx faster"
+              % (ne // 20, len(trees), old, ne / old, new, ne / new, old / new), file=sys.stderr)
+
+        # a single big tree, with some non-ascii names
+        entries = sorted((b'\1' * 20, 0o100644 if i % 10 else 0o40000, u'file_%06i_\xe4.py' % i if i % 3 else
+                          'file_%06i.py' % i) for i in range(50000))
+        stream = BytesIO()
+        tree_to_stream(sorted(entries, key=lambda e: e[2]), stream.write)
+        data = stream.getvalue()
+        assert tree_entries_from_data(data) == _tree_entries_from_data_bytewise(data)
+        old, new = self._parse([data], 5)
+        ne = len(entries) * 5
+        print("Parsed a tree with %i entries 5 times: bytewise in %f s ( %i entries / s ), "
+              "vectorized in %f s ( %i entries / s ), %.1fx faster"
+              % (len(entries), old, ne / old, new, ne / new, old / new), file=sys.stderr)
@@ -8,6 +8,7 @@ from __future__ import print_function
 
 from datetime import datetime
 from io import BytesIO
+import os
 import re
 import sys
 import time
@@ -32,6 +33,7 @@ from git.test.lib import (
     StringProcessAdapter
 )
 from git.test.lib import with_rw_directory
+from git.util import bin_to_hex, pprint_rename, quote_path
 from gitdb import IStream
 
 import os.path as osp
@@ -212,6 +214,114 @@ class TestCommit(TestBase):
         # pretty not allowed
         self.failUnlessRaises(ValueError, Commit.iter_items, self.rorepo, 'master', pretty="raw")
 
+    def _has_attr(self, commit, attr):
+        """:return: True if the given attribute is set, without reading it on demand"""
+        try:
+            getattr(Commit, attr).__get__(commit)
+            return True
+        except AttributeError:
+            return False
+
+    @with_rw_directory
+    def test_iter_items_preload(self, rw_dir):
+        repo = Repo.init(rw_dir)
+        tree = repo.index.write_tree()
+        self.failUnlessRaises(ValueError, Commit.iter_items, repo, 'master', preload=True, format='%H')
+
+        def make_commit(message, **attrs):
+            parents = [repo.head.commit] if repo.head.is_valid() else []
+            commit = Commit.create_from_tree(repo, tree, message, parents)
+            for attr, value in attrs.items():
+                setattr(commit, attr, value)
+            # END for each attribute to override
+            stream = BytesIO()
+            commit._serialize(stream)
+            stream.seek(0)
+            binsha = repo.odb.store(IStream(Commit.type, len(stream.getvalue()), stream)).binsha
+            repo.git.update_ref('HEAD', bin_to_hex(binsha).decode('ascii'))
+        # END utility
+
+        make_commit('initial')
+        make_commit('subject\n\nbody with\n   \n\twhitespace only lines \n')
+        make_commit('\nleading empty line and no trailing newline')
+        make_commit('signed', gpgsig='-----BEGIN PGP SIGNATURE-----\n\nabc\n-----END PGP SIGNATURE-----')
+        make_commit(u'caf\xe9\n', encoding='ISO-8859-1', author=Actor(u'J\xfcrgen', 'j@example.com'))
+        make_commit('')
+
+        preloaded = list(repo.iter_commits(preload=True))
+        lazy = list(repo.iter_commits())
+        self.assertEqual(preloaded, lazy)
+        attrs = ('tree', 'parents', 'author', 'authored_date', 'author_tz_offset', 'committer', 'committed_date',
+                 'committer_tz_offset', 'message', 'encoding', 'gpgsig')
+        for commit, lazy_commit in zip(preloaded, lazy):
+            for attr in attrs:
+                self.assertEqual(getattr(commit, attr), getattr(lazy_commit, attr))
+            # END for each attribute
+            self.assertEqual(commit.size, lazy_commit.size)
+        # END for each commit
+
+        # commits are fully initialized unless git-log didn't reproduce them exactly.
+        # leading empty lines and whitespace in empty lines are lost in git-log output
+        self.assertEqual([self._has_attr(c, 'message') for c in repo.iter_commits(preload=True)],
+                         [True, True, True, False, False, True])
+        self.assertEqual(list(repo.iter_commits(preload=True, max_count=2, skip=1)), lazy[1:3])
+        self.assertEqual(list(repo.iter_commits('master~1', preload=True, paths='nothing')), [])
+
+    @with_rw_directory
+    def test_iter_items_with_stats(self, rw_dir):
+        repo = Repo.init(rw_dir)
+
+        def write(path, data):
+            path = osp.join(rw_dir, path)
+            if not osp.isdir(osp.dirname(path)):
+                os.makedirs(osp.dirname(path))
+            with open(path, 'wb') as fp:
+                fp.write(data)
+            return path
+        # END utility
+
+        lines = ''.join('line %i\n' % i for i in range(20)).encode('ascii')
+        repo.index.add([write('a/b/file', lines), write('other', b'x\n'), write(u'\xfcml\xe4ut', b'1\n')])
+        root = repo.index.commit('root')
+        repo.index.add([write('bin', b'\0binary'), write('other', b'y\nz\n')])
+        side = repo.index.commit('side')
+        os.rename(osp.join(rw_dir, 'a', 'b', 'file'), write('a/c/file', lines + b'more\n'))
+        repo.index.remove(['a/b/file'])
+        repo.index.add(['a/c/file'])
+        renamed = repo.index.commit('rename', parent_commits=[root])
+        repo.index.commit('merge', parent_commits=[renamed, side])
+
+        commits = list(repo.iter_commits(with_stats=True))
+        self.assertEqual(len(commits), 4)
+        # stats of merge commits are computed on demand, like without with_stats
+        self.assertEqual([self._has_attr(c, '_stats') for c in commits], [False, True, True, True])
+        for commit in commits:
+            expected = Commit(repo, commit.binsha).stats
+            self.assertEqual(commit.stats.total, expected.total)
+            self.assertEqual(commit.stats.files, expected.files)
+        # END for each commit
+        assert 'a/{b => c}/file' in commits[1].stats.files
+        assert '"\\303\\274ml\\303\\244ut"' in commits[-1].stats.files
+
+        # stats are not limited to the given paths
+        commits = list(repo.iter_commits(paths='other', with_stats=True))
+        self.assertEqual([c.message for c in commits], ['rename', 'root'])
+        self.assertEqual(commits[1].stats.total['files'], 3)
+
+    def test_pprint_rename(self):
+        for a, b, name in ((b'a/b/c', b'a/d/c', 'a/{b => d}/c'),
+                           (b'old', b'new', 'old => new'),
+                           (b'dir/old', b'dir/new', 'dir/{old => new}'),
+                           (b'a/file', b'b/file', '{a => b}/file'),
+                           (b'a/b/file', b'a/file', 'a/{b => }/file'),
+                           (b'file', b'dir/file', 'file => dir/file'),
+                           (b'dir/a"b', b'dir/c', '"dir/a\\"b" => dir/c')):
+            self.assertEqual(pprint_rename(a, b), name)
+        # END for each rename
+        self.assertEqual(quote_path(b'plain/path'), 'plain/path')
+        self.assertEqual(quote_path(u'\xfc\tx\\'.encode('utf-8')), '"\\303\\274\\tx\\\\"')
+        self.assertEqual(quote_path(u'\xfc'.encode('utf-8'), quote_non_ascii=False), u'\xfc')
+
     def test_rev_list_bisect_all(self):
         """
         'git rev-list --bisect-all' returns additional information
@@ -385,6 +495,9 @@ JzJMZDRLQLFvnzqZuCjE
 
         repo_mock = RepoMock(cstream.getvalue())
         for field in Commit.__slots__:
+            if field.startswith('_'):
+                # private fields are not serialized
+                continue
             c = Commit(repo_mock, b'x' * 20)
             assert getattr(c, field) is not None
 
@@ -0,0 +1,108 @@
+# test_commitgraph.py
+# Copyright (C) 2008, 2009 Michael Trier (mtrier@gmail.com) and contributors
+#
+# This module is part of GitPython and is released under
+# the BSD License: http://www.opensource.org/licenses/bsd-license.php
+from git import (
+    Repo,
+    Commit,
+    CommitGraph,
+    CachedObjectDB
+)
+from git.test.lib import (
+    TestBase,
+    with_rw_directory
+)
+
+import os.path as osp
+
+
+class TestCommitGraph(TestBase):
+
+    def _make_history(self, rw_dir):
+        """Create a repository with a linear history, a merge and an octopus merge"""
+        repo = Repo.init(rw_dir)
+        path = osp.join(rw_dir, 'file')
+
+        def commit(message, parents=None):
+            with open(path, 'w') as fp:
+                fp.write(message)
+            repo.index.add([path])
+            return repo.index.commit(message, parent_commits=parents, commit_date='%i +0200' % (1000000 + len(message)))
+        # END utility
+
+        root = commit('root')
+        a = commit('a', [root])
+        b = commit('b', [root])
+        c = commit('c', [root])
+        commit('octopus', [a, b, c])
+        commit('merge', [repo.head.commit, a])
+        return repo
+
+    def _assert_matches_objects(self, repo, graph):
+        commits = list(repo.iter_commits())
+        self.assertEqual(len(graph), len(commits))
+        for commit in commits:
+            entry = graph.entry(commit.binsha)
+            self.assertEqual(entry.tree_binsha, commit.tree.binsha)
+            self.assertEqual(entry.parent_binshas, tuple(p.binsha for p in commit.parents))
+            self.assertEqual(entry.committed_date, commit.committed_date)
+            parent_generations = [graph.entry(p.binsha).generation for p in commit.parents]
+            self.assertEqual(entry.generation, max(parent_generations or [0]) + 1)
+        # END for each commit
+        self.assertIsNone(graph.entry(b'\xff' * 20))
+        self.assertIsNone(graph.position(b'\0' * 20))
+
+    @with_rw_directory
+    def test_commit_graph(self, rw_dir):
+        repo = self._make_history(rw_dir)
+        objects_dir = osp.join(repo.git_dir, 'objects')
+        self.assertIsNone(CommitGraph.from_objects_dir(objects_dir))
+        self.assertIsNone(repo.commit_graph)
+
+        repo.git.commit_graph('write', '--reachable')
+        graph = CommitGraph.from_objects_dir(objects_dir)
+        self._assert_matches_objects(repo, graph)
+
+        # positions allow to follow parents without looking up shas
+        head = repo.head.commit
+        pos = graph.position(head.binsha)
+        self.assertEqual(graph.binsha(pos), head.binsha)
+        self.assertEqual(graph.tree_binsha(pos), head.tree.binsha)
+        self.assertEqual([graph.binsha(p) for p in graph.parent_positions(pos)], [p.binsha for p in head.parents])
+        octopus = head.parents[0]
+        octopus_pos = graph.position(octopus.binsha)
+        self.assertEqual(len(graph.parent_positions(octopus_pos)), 3)
+        self.assertEqual(graph.generation(octopus_pos), 3)
+        self.assertEqual(graph.committed_date(octopus_pos), octopus.committed_date)
+        graph.close()
+
+        # commits are filled from the commit-graph of the repository, without reading the object
+        repo.close()
+        repo.odb = odb = CachedObjectDB(repo.odb)
+        commit = Commit(repo, head.binsha)
+        self.assertEqual(commit.parents, head.parents)
+        self.assertEqual(commit.tree, head.tree)
+        self.assertEqual(commit.committed_date, head.committed_date)
+        self.assertEqual(odb.misses, 0)
+        self.assertEqual(commit.message, 'merge')
+        self.assertEqual(odb.misses, 1)
+        self.assertEqual(len(list(head.traverse())), 5)
+
+        # commits created after writing the commit-graph are read from the object
+        new_commit = repo.index.commit('new', commit_date='1000100 +0000')
+        self.assertEqual(Commit(repo, new_commit.binsha).parents, (head,))
+
+    @with_rw_directory
+    def test_split_commit_graph(self, rw_dir):
+        repo = self._make_history(rw_dir)
+        objects_dir = osp.join(repo.git_dir, 'objects')
+        repo.git.commit_graph('write', '--reachable', '--split')
+        repo.index.commit('top', commit_date='1000100 +0000')
+        repo.git.commit_graph('write', '--reachable', '--split=no-merge')
+
+        with open(osp.join(objects_dir, 'info', 'commit-graphs', 'commit-graph-chain')) as fp:
+            self.assertEqual(len(fp.read().split()), 2)
+        graph = CommitGraph.from_objects_dir(objects_dir)
+        self._assert_matches_objects(repo, graph)
+        graph.close()
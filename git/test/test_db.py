@@ -3,10 +3,21 @@
 #
 # This module is part of GitPython and is released under
 # the BSD License: http://www.opensource.org/licenses/bsd-license.php
-from git.db import GitCmdObjectDB
+from git import Repo
+from git.db import (
+    CachedObjectDB,
+    GitCmdObjectDB,
+    GitHybridObjectDB,
+    REF_DELTA,
+    apply_delta
+)
 from git.exc import BadObject
-from git.test.lib import TestBase
-from git.util import bin_to_hex
+from git.test.lib import (
+    TestBase,
+    patch,
+    with_rw_directory
+)
+from git.util import bin_to_hex, hex_to_bin
 
 import os.path as osp
 
@@ -25,3 +36,180 @@ class TestDB(TestBase):
         # fails with BadObject
         for invalid_rev in ("0000", "bad/ref", "super bad"):
             self.failUnlessRaises(BadObject, gdb.partial_to_complete_sha_hex, invalid_rev)
+
+    def test_info_and_stream_many(self):
+        gdb = GitCmdObjectDB(osp.join(self.rorepo.git_dir, 'objects'), self.rorepo.git)
+        shas = [item.binsha for item in self.rorepo.head.commit.tree.traverse()]
+        shas.append(self.rorepo.head.commit.binsha)
+
+        # responses are in order, no matter how many requests are in flight
+        for window in (1, 4, 256):
+            infos = list(gdb.info_many(shas, window))
+            self.assertEqual([i.binsha for i in infos], shas)
+            for info in infos:
+                self.assertEqual(tuple(info), tuple(gdb.info(info.binsha)))
+            # END for each info
+        # END for each window size
+
+        # unread data is skipped
+        for i, ostream in enumerate(gdb.stream_many(shas, 4)):
+            if i % 2:
+                self.assertEqual(ostream.read(), gdb.stream(ostream.binsha).read())
+        # END for each stream
+        self.assertEqual(list(gdb.stream_many([])), [])
+
+        # invalid shas raise, and leave no stale responses behind
+        missing = b'\1' * 20
+        self.failUnlessRaises(ValueError, list, gdb.info_many(shas[:3] + [missing] + shas[3:], 4))
+        self.failUnlessRaises(ValueError, list, gdb.stream_many([missing] + shas, 4))
+        self.assertEqual(gdb.info(shas[0]).binsha, shas[0])
+        self.assertEqual(gdb.stream(shas[-1]).type, b'commit')
+
+        # abandoned iterations don't leave stale responses behind either
+        it = gdb.stream_many(shas, 4)
+        next(it)
+        del(it)
+        self.assertEqual(gdb.stream(shas[-1]).binsha, shas[-1])
+
+        # the command is handed back once the last response was read, iterations
+        # which are not run to their end don't discard it
+        git = self.rorepo.git
+        procs = set(git.cat_file_header._idle)
+        for sha, info in zip(shas, gdb.info_many(shas, 4)):
+            self.assertEqual(info.binsha, sha)
+        self.assertEqual(set(git.cat_file_header._idle), procs)
+
+        # with streams, once the last stream was read
+        procs = set(git.cat_file_all._idle)
+        for sha, ostream in zip(shas, gdb.stream_many(shas, 4)):
+            self.assertEqual(ostream.binsha, sha)
+        assert not git.cat_file_all._idle
+        ostream.read()
+        self.assertEqual(set(git.cat_file_all._idle), procs)
+
+    def _assert_same_objects(self, repo):
+        cdb = GitCmdObjectDB(osp.join(repo.git_dir, 'objects'), repo.git)
+        hdb = GitHybridObjectDB(osp.join(repo.git_dir, 'objects'), repo.git)
+        shas = [hex_to_bin(line.split()[0]) for line in
+                repo.git.cat_file(batch_all_objects=True, batch_check=True).splitlines()]
+        assert shas
+        for sha in shas:
+            self.assertEqual(tuple(hdb.info(sha)), tuple(cdb.info(sha)))
+            hstream, cstream = hdb.stream(sha), cdb.stream(sha)
+            self.assertEqual((hstream.type, hstream.size), (cstream.type, cstream.size))
+            self.assertEqual(hstream.read(), cstream.read())
+        # END for each object
+        return hdb
+
+    @with_rw_directory
+    def test_hybrid_db(self, rw_dir):
+        repo = Repo.init(rw_dir)
+        path = osp.join(rw_dir, 'file')
+        lines = ['line %i\n' % i for i in range(500)]
+        for i in range(6):
+            lines[i * 50] = 'changed in revision %i\n' % i
+            with open(path, 'w') as fp:
+                fp.writelines(lines)
+            repo.index.add([path])
+            repo.index.commit('revision %i' % i)
+        # END for each revision
+
+        # loose objects only
+        self._assert_same_objects(repo)
+
+        # offset deltas, then ref deltas, with an additional loose object
+        repo.git.repack(a=True, d=True, f=True)
+        hdb = self._assert_same_objects(repo)
+        repo.git(c='repack.useDeltaBaseOffset=false').repack(a=True, d=True, f=True)
+        repo.index.commit('loose commit')
+        ref_hdb = self._assert_same_objects(repo)
+
+        # ref deltas whose base cannot be found in-process, i.e. in thin packs, are read by git
+        cdb = GitCmdObjectDB(osp.join(repo.git_dir, 'objects'), repo.git)
+        shas = [commit.tree['file'].binsha for commit in repo.iter_commits()]
+        locations = dict((sha, ref_hdb._find(sha)) for sha in shas)
+        deltas = [sha for sha, (pack, offset) in locations.items() if pack.entry_header(offset)[0] == REF_DELTA]
+        assert deltas
+        for sha in deltas:
+            pack, offset = locations[sha]
+            with patch.object(ref_hdb, '_find', {sha: (pack, offset)}.get):
+                with patch.object(ref_hdb, '_read_loose', lambda *args: None):
+                    self.failUnlessRaises(ValueError, ref_hdb._read_base, pack.entry_header(offset)[3])
+                    self.assertEqual(tuple(ref_hdb.info(sha)), tuple(cdb.info(sha)))
+                    self.assertEqual(ref_hdb.stream(sha).read(), cdb.stream(sha).read())
+                # END without loose objects
+            # END without other packed objects
+        # END for each delta
+
+        # packs written after the first lookup are found, as well as missing objects by falling back to git
+        repo.git.repack(a=True, d=True)
+        self.assertEqual(hdb.info(repo.head.commit.binsha).type, b'commit')
+        self.failUnlessRaises(ValueError, hdb.info, b'\1' * 20)
+        self.failUnlessRaises(ValueError, hdb.stream, b'\1' * 20)
+
+        # objects of alternates are found as well
+        clone = repo.clone(osp.join(rw_dir, 'clone'), shared=True)
+        self.assertEqual(clone.git.count_objects(v=True).count('packs: 0'), 1)
+        hdb = GitHybridObjectDB(osp.join(clone.git_dir, 'objects'), clone.git)
+        self.assertEqual(hdb.stream(repo.head.commit.binsha).read(),
+                         repo.odb.stream(repo.head.commit.binsha).read())
+
+    def test_apply_delta(self):
+        base = b'0123456789'
+        # copy 4 bytes at offset 2, insert 'ab', copy 2 bytes at offset 0
+        delta = b'\x0a\x08' + b'\x91\x02\x04' + b'\x02ab' + b'\x90\x02'
+        self.assertEqual(apply_delta(base, delta), b'2345ab01')
+        self.failUnlessRaises(ValueError, apply_delta, base[:5], delta)
+        self.failUnlessRaises(ValueError, apply_delta, base, delta[:-2])
+
+    def test_cached_db(self):
+        commit = self.rorepo.head.commit
+        shas = [commit.binsha, commit.tree.binsha] + [item.binsha for item in commit.tree]
+        odb = CachedObjectDB(self.rorepo.odb, max_bytes=1024 * 1024)
+
+        # infos are cached, but don't count as data
+        self.assertEqual(tuple(odb.info(commit.binsha)), tuple(self.rorepo.odb.info(commit.binsha)))
+        self.assertEqual(odb.info(commit.binsha).type, b'commit')
+        self.assertEqual((odb.hits, odb.misses, len(odb)), (1, 1, 1))
+        self.assertEqual(odb.stream(commit.binsha).read(), self.rorepo.odb.stream(commit.binsha).read())
+        self.assertEqual((odb.hits, odb.misses, len(odb)), (1, 2, 1))
+
+        for sha in shas * 2:
+            ostream = odb.stream(sha)
+            self.assertEqual(ostream.binsha, sha)
+            self.assertEqual(ostream.read(), self.rorepo.odb.stream(sha).read())
+            self.assertEqual(odb.info(sha).size, ostream.size)
+        # END for each sha
+        self.assertEqual(odb.misses, 1 + len(shas))
+        assert odb.size <= odb.max_bytes
+
+        # the least recently used objects are evicted first, large objects are not cached at all
+        sizes = dict((sha, odb.info(sha).size) for sha in shas)
+        overhead = CachedObjectDB.entry_overhead
+        odb = CachedObjectDB(self.rorepo.odb, max_bytes=sizes[shas[0]] + sizes[shas[1]] + overhead * 5 // 2,
+                             max_object_size=max(sizes[shas[0]], sizes[shas[1]]))
+        odb.stream(shas[0])
+        odb.stream(shas[1])
+        odb.stream(shas[0])
+        self.assertEqual((odb.hits, odb.misses), (1, 2))
+        large = max(shas[2:], key=sizes.get)
+        assert sizes[large] > odb.max_object_size
+        self.assertEqual(odb.stream(large).read(), self.rorepo.odb.stream(large).read())
+        self.assertEqual(list(odb._cache), [shas[1], shas[0]])
+        odb.info(shas[2])
+        self.assertEqual(list(odb._cache), [shas[0], shas[2]])
+        assert odb.size <= odb.max_bytes
+
+        odb.clear_cache()
+        self.assertEqual((odb.hits, odb.misses, odb.size, len(odb)), (0, 0, 0, 0))
+
+        # other methods are forwarded, objects read through the repository are cached
+        assert odb.has_object(commit.binsha)
+        self.rorepo.odb = odb = CachedObjectDB(self.rorepo.odb)
+        try:
+            list(self.rorepo.commit(commit.hexsha).tree.traverse())
+            self.assertEqual(self.rorepo.commit(commit.hexsha).message, commit.message)
+            assert odb.hits
+        finally:
+            self.rorepo.odb = odb.odb
+        # END restore database
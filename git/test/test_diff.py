@@ -4,15 +4,22 @@
 #
 # This module is part of GitPython and is released under
 # the BSD License: http://www.opensource.org/licenses/bsd-license.php
+import copy
+from io import BytesIO
+
 import ddt
 from git import (
     Repo,
     GitCommandError,
     Diff,
     DiffIndex,
+    Diffable,
+    PatchBuffer,
     NULL_TREE,
 )
 from git.cmd import Git
+from git.db import CachedObjectDB
+from git.objects.fun import similarity_signature
 from git.test.lib import (
     TestBase,
     StringProcessAdapter,
@@ -23,7 +30,9 @@ from git.test.lib import (
 )
 from git.test.lib import with_rw_directory
 
+import os
 import os.path as osp
+import pickle
 
 
 @ddt.ddt
@@ -295,3 +304,302 @@ class TestDiff(TestBase):
         cp = c.parents[0]
         diff_index = c.diff(cp, ["does/not/exist"])
         self.assertEqual(len(diff_index), 0)
+
+    @with_rw_directory
+    def test_iter_diff(self, rw_dir):
+        r = Repo.init(rw_dir)
+        for name in ('moved', 'changed', 'removed', 'binary'):
+            with open(osp.join(rw_dir, name), 'wb') as fp:
+                fp.write(''.join('%s line %i\n' % (name, i) for i in range(20)).encode('ascii'))
+        # END for each file
+        r.index.add(['moved', 'changed', 'removed', 'binary'])
+        c1 = r.index.commit('first')
+        r.index.move(['moved', 'renamed'])
+        r.index.remove(['removed'], working_tree=True)
+        with open(osp.join(rw_dir, 'changed'), 'ab') as fp:
+            fp.write(b'diff --git a/changed b/changed\n--- a/changed\nno newline')
+        with open(osp.join(rw_dir, 'binary'), 'wb') as fp:
+            fp.write(b'\0binary')
+        r.index.add(['changed', 'binary'])
+        c2 = r.index.commit('second')
+
+        def as_tuples(diffs):
+            return [(d.a_rawpath, d.b_rawpath, d.a_mode, d.b_mode, d.a_blob, d.b_blob, d.new_file, d.deleted_file,
+                     d.raw_rename_from, d.raw_rename_to, d.diff, d.change_type) for d in diffs]
+
+        for create_patch in (False, True):
+            for other in (c2, NULL_TREE, r.index.Index):
+                diffs = c1.iter_diff(other, create_patch=create_patch)
+                assert not isinstance(diffs, DiffIndex)
+                expected = c1.diff(other, create_patch=create_patch)
+                assert expected
+                self.assertEqual(as_tuples(diffs), as_tuples(expected))
+            # END for each other side
+        # END for each format
+
+        # patches are parsed line by line, yielding each diff once the header of the next one was read
+        data = r.git.diff(c1, c2, p=True, full_index=True, stdout_as_string=False)
+        stream = BytesIO(data)
+        diffs = Diff._iter_from_patch_format(r, stream)
+        first = next(diffs)
+        assert stream.tell() < data.index(first.diff) + len(first.diff) + 200
+        self.assertEqual(len(list(diffs)), 3)
+        assert stream.tell() == len(data)
+
+        diffs = c1.diff(c2, create_patch=True)
+        changed = [d for d in diffs if d.a_path == 'changed'][0]
+        assert changed.diff.endswith(b'+no newline\n\\ No newline at end of file\n')
+        assert b'+diff --git a/changed b/changed\n+--- a/changed\n' in changed.diff
+
+    def test_patch_buffer(self):
+        for max_memory in (1024 * 1024, 10):
+            buf = PatchBuffer(max_memory)
+            buf.write(b'0123456789')
+            buf.write(b'abc')
+            self.assertEqual(buf.size, 13)
+            self.assertEqual(buf.read(8, 4), b'89ab')
+            self.assertEqual(buf.view(8, 4).tobytes(), b'89ab')
+            self.assertEqual(buf.read(13, 1), b'')
+        # END for each buffer type
+
+        # the patches of a diff index share one buffer, and are equal to the ones parsed on their own
+        data = fixture('diff_2')
+        diffs = Diff._index_from_patch_format(self.rorepo, StringProcessAdapter(data))
+        assert len(diffs) > 1
+        buffers = set(id(d._diff[0]) for d in diffs)
+        self.assertEqual(len(buffers), 1)
+        expected = list(Diff._iter_from_patch_format(self.rorepo, StringProcessAdapter(data)))
+        self.assertEqual(diffs, expected)
+        for diff, expected_diff in zip(diffs, expected):
+            assert isinstance(expected_diff._diff, bytes)
+            self.assertEqual(diff.diff, expected_diff.diff)
+            self.assertEqual(diff.diff_view().tobytes(), expected_diff.diff)
+            self.assertEqual(expected_diff.diff_view().tobytes(), expected_diff.diff)
+        # END for each diff
+
+    @with_rw_directory
+    def test_pickle_diffs(self, rw_dir):
+        r = Repo.init(rw_dir)
+        path = osp.join(rw_dir, 'file')
+        for content in ('one\n', 'two\n'):
+            with open(path, 'w') as fp:
+                fp.write(content)
+            r.index.add([path])
+            r.index.commit(content)
+        # END for each revision
+
+        # diffs are pickled and copied with their patch text, not the buffer holding it
+        diffs = r.head.commit.parents[0].diff(r.head.commit, create_patch=True)
+        assert isinstance(diffs[0]._diff, tuple)
+        for other in (pickle.loads(pickle.dumps(diffs)), copy.deepcopy(diffs)):
+            self.assertEqual(other, diffs)
+            self.assertEqual([d._diff for d in other], [d.diff for d in diffs])
+        # END for each copy
+
+    def test_hunks(self):
+        patch = (b'diff --git a/file b/file\n'
+                 b'index 0000000000000000000000000000000000000001..0000000000000000000000000000000000000002 100644\n'
+                 b'--- a/file\n'
+                 b'+++ b/file\n'
+                 b'@@ -1 +1,2 @@\n'
+                 b'-one\n'
+                 b'+one\n'
+                 b'+@@ -1 +1 @@ looks like a header\n'
+                 b'@@ -10,3 +11,0 @@ def function():\n'
+                 b'-ten\n'
+                 b'-eleven\n'
+                 b'-twelve\n'
+                 b'\\ No newline at end of file')
+        diff = Diff._index_from_patch_format(self.rorepo, StringProcessAdapter(patch))[0]
+        hunks = diff.hunks
+        self.assertEqual([(h.old_start, h.old_lines, h.new_start, h.new_lines, h.section) for h in hunks],
+                         [(1, 1, 1, 2, b''), (10, 3, 11, 0, b'def function():')])
+        self.assertEqual(list(hunks[0]), [b'-one', b'+one', b'+@@ -1 +1 @@ looks like a header'])
+        self.assertEqual(list(hunks[1]), [b'-ten', b'-eleven', b'-twelve', b'\\ No newline at end of file'])
+        self.assertEqual(diff.diff[hunks[1].offset:hunks[1].offset + hunks[1].length].count(b'\n'), 3)
+
+        # diffs without patch or with binary patch have no hunks
+        diff = Diff._index_from_patch_format(self.rorepo, StringProcessAdapter(fixture('diff_patch_binary')))[0]
+        self.assertEqual(diff.hunks, [])
+        for diff in Diff._index_from_raw_format(self.rorepo, StringProcessAdapter(fixture('diff_rename_raw'))):
+            self.assertEqual(diff.hunks, [])
+        # END for each raw diff
+
+    @with_rw_directory
+    def test_diff_numstat(self, rw_dir):
+        r = Repo.init(rw_dir)
+        names = ('moved', 'changed', 'removed', 'binary', u'spaced ümlaut')
+        for name in names:
+            with open(osp.join(rw_dir, name), 'wb') as fp:
+                fp.write(''.join('line %i\n' % i for i in range(20)).encode('ascii'))
+        # END for each file
+        r.index.add(names)
+        c1 = r.index.commit('first')
+        r.index.move(['moved', 'renamed'])
+        r.index.remove(['removed'], working_tree=True)
+        with open(osp.join(rw_dir, 'changed'), 'ab') as fp:
+            fp.write(b'one\ntwo\n')
+        with open(osp.join(rw_dir, 'binary'), 'wb') as fp:
+            fp.write(b'\0binary')
+        with open(osp.join(rw_dir, u'spaced ümlaut'), 'wb') as fp:
+            fp.write(b'line 0\n')
+        r.index.add(['changed', 'binary', u'spaced ümlaut'])
+        c2 = r.index.commit('second')
+
+        expected = {u'binary': (0, 0), u'changed': (2, 0), u'renamed': (0, 0), u'removed': (0, 20),
+                    u'spaced ümlaut': (0, 19)}
+        for create_patch in (False, True):
+            diffs = c1.diff(c2, create_patch=create_patch, numstat=True)
+            self.assertEqual(dict(((d.b_path or d.a_path), (d.insertions, d.deletions)) for d in diffs), expected)
+            renamed = [d for d in diffs if d.renamed_file][0]
+            self.assertEqual((renamed.rename_from, renamed.rename_to), ('moved', 'renamed'))
+            diffs = c1.iter_diff(c2, create_patch=create_patch, numstat=True)
+            self.assertEqual(dict(((d.b_path or d.a_path), (d.insertions, d.deletions)) for d in diffs), expected)
+        # END for each format
+
+        # counts are only available if requested
+        self.assertEqual(set((d.insertions, d.deletions) for d in c1.diff(c2)), set([(None, None)]))
+
+    @with_rw_directory
+    def test_diff_in_process(self, rw_dir):
+        r = Repo.init(rw_dir)
+        files = {'same/deep/file': 'same', 'dir/changed': 'a', 'dir/moved': 'moved', 'removed': 'removed',
+                 'dup1': 'dup', 'dup2': 'dup', 'to-symlink': 'link', 'becomes-dir': 'file'}
+
+        def write_files(files):
+            for path, content in files.items():
+                path = osp.join(rw_dir, path)
+                if not osp.isdir(osp.dirname(path)):
+                    os.makedirs(osp.dirname(path))
+                with open(path, 'w') as fp:
+                    fp.write(content)
+            # END for each file
+        write_files(files)
+        r.index.add(list(files))
+        c1 = r.index.commit('first')
+
+        r.index.move(['dir/moved', 'moved-to'])
+        r.index.remove(['removed', 'dup1', 'dup2', 'to-symlink', 'becomes-dir'], working_tree=True)
+        os.symlink('link', osp.join(rw_dir, 'to-symlink'))
+        files = {'dir/changed': 'b', 'new/dup1': 'dup', 'new/other': 'dup', 'becomes-dir/file': 'file'}
+        write_files(files)
+        r.index.add(list(files) + ['to-symlink'])
+        c2 = r.index.commit('second')
+
+        def as_tuples(diffs):
+            return [(d.change_type, d.a_rawpath, d.b_rawpath, d.a_mode, d.b_mode, d.a_blob, d.b_blob, d.score,
+                     d.new_file, d.deleted_file, d.raw_rename_from, d.raw_rename_to) for d in diffs]
+
+        for a, b, kwargs in ((c1, c2, {}), (c2, c1, {}), (c1, c2, {'R': True}), (c1.tree, c2.hexsha, {}),
+                             (c1, NULL_TREE, {}), (c1, c2, {'paths': ['dir/', 'becomes-dir']})):
+            diffs = a.diff(b, in_process=True, **kwargs)
+            assert isinstance(diffs, DiffIndex)
+            self.assertEqual(as_tuples(diffs), as_tuples(a.diff(b, **kwargs)))
+            self.assertEqual(as_tuples(a.iter_diff(b, in_process=True, **kwargs)), as_tuples(diffs))
+        # END for each comparison
+        renames = [(d.rename_from, d.rename_to) for d in c1.diff(c2, in_process=True) if d.renamed_file]
+        self.assertEqual(renames, [('becomes-dir', 'becomes-dir/file'), ('dir/moved', 'moved-to'), ('dup1', 'new/dup1'),
+                                   ('dup2', 'new/other')])
+
+        # identical subtrees are not read
+        odb = r.odb
+        r.odb = CachedObjectDB(odb)
+        c1.diff(c2, in_process=True)
+        self.assertNotIn(c1.tree['same'].binsha, r.odb._cache)
+        r.odb = odb
+
+        for other, kwargs in ((None, {}), (c2, {'create_patch': True}), (c2, {'B': True}),
+                              (c2, {'paths': 'dir/*'})):
+            self.failUnlessRaises(ValueError, c1.diff, other, in_process=True, **kwargs)
+        # END for each unsupported case
+
+    @with_rw_directory
+    def test_diff_in_process_similarity(self, rw_dir):
+        r = Repo.init(rw_dir)
+        lines = ['line %i\n' % i for i in range(40)]
+        files = {'src/moved.py': lines, 'src/changed.py': lines[10:], 'crlf.txt': lines[:20],
+                 'removed.txt': ['removed\n'] * 30, 'other/moved.py': lines[::-1]}
+
+        def write_files(files):
+            for path, content in files.items():
+                path = osp.join(rw_dir, path)
+                if not osp.isdir(osp.dirname(path)):
+                    os.makedirs(osp.dirname(path))
+                with open(path, 'w', newline='') as fp:
+                    fp.write(''.join(content))
+            # END for each file
+        write_files(files)
+        r.index.add(list(files))
+        c1 = r.index.commit('first')
+
+        r.index.remove(['src/moved.py', 'crlf.txt', 'removed.txt', 'other/moved.py'], working_tree=True)
+        files = {'dst/moved.py': lines[:30] + ['new\n'], 'src/changed.py': lines[10:30], 'copy.py': lines[5:],
+                 'crlf.md': [line.replace('\n', '\r\n') for line in lines[:20]], 'added.txt': ['added\n'] * 30,
+                 'moved.py': lines[::-1] + ['end\n']}
+        write_files(files)
+        r.index.add(list(files))
+        c2 = r.index.commit('second')
+
+        def as_tuples(diffs):
+            return [(d.change_type, d.a_rawpath, d.b_rawpath, d.a_blob, d.b_blob, d.score, d.raw_rename_from,
+                     d.raw_rename_to) for d in diffs]
+
+        for kwargs in ({}, {'C': True}, {'find_renames': '90%'}, {'find_copies': 3}, {'M': True, 'R': True}):
+            self.assertEqual(as_tuples(c1.diff(c2, in_process=True, **kwargs)), as_tuples(c1.diff(c2, **kwargs)))
+            self.assertEqual(as_tuples(c1.diff(c2.tree, in_process=True, **kwargs)),
+                             as_tuples(c1.diff(c2.tree, **kwargs)))
+        # END for each set of options
+        types = [(d.change_type, d.score) for d in c1.diff(c2, in_process=True, C=True)]
+        assert ('R', 100) not in types and ('C', 100) not in types
+        assert [t for t in types if t[0] == 'R' and t[1] < 100] and [t for t in types if t[0] == 'C']
+
+        # the persistent cat-file commands reading sizes and contents are kept
+        procs = set(r.git.cat_file_header._idle), set(r.git.cat_file_all._idle)
+        assert all(procs)
+        c1.diff(c2, in_process=True, C=True)
+        self.assertEqual((set(r.git.cat_file_header._idle), set(r.git.cat_file_all._idle)), procs)
+
+        # the index against a tree
+        r.index.remove(['copy.py'])
+        write_files({'copy-of-copy.py': lines[5:] + lines[:2]})
+        r.index.add(['copy-of-copy.py'])
+        for kwargs in ({}, {'R': True}, {'C': True}, {'paths': 'src'}):
+            self.assertEqual(as_tuples(c1.diff(Diffable.Index, in_process=True, **kwargs)),
+                             as_tuples(c1.diff(Diffable.Index, **kwargs)))
+            self.assertEqual(as_tuples(r.index.diff(c2, in_process=True, **kwargs)),
+                             as_tuples(r.index.diff(c2, **kwargs)))
+        # END for each set of options
+
+        # spans of up to 64 bytes are compared, CRLF sequences are ignored in text
+        self.assertEqual(sum(similarity_signature(b'a' * 100 + b'\nb\n').values()), 103)
+        self.assertEqual(len(similarity_signature(b'a' * 100 + b'\nb\n')), 3)
+        self.assertEqual(similarity_signature(b'x\r\ny\r\n'), similarity_signature(b'x\ny\n'))
+        self.assertNotEqual(similarity_signature(b'x\r\n\0'), similarity_signature(b'x\n\0'))
+        self.assertEqual(similarity_signature(b''), {})
+
+    def test_diff_index_lookups(self):
+        diffs = Diff._index_from_patch_format(self.rorepo, StringProcessAdapter(fixture('diff_2')))
+        diffs += Diff._index_from_raw_format(self.rorepo, StringProcessAdapter(fixture('diff_rename_raw')))
+        assert len(diffs) > 2
+        for change_type in DiffIndex.change_type:
+            self.assertEqual(list(diffs.changes(change_type)), list(diffs.iter_change_type(change_type)))
+        # END for each change type
+        self.failUnlessRaises(ValueError, diffs.changes, 'X')
+
+        for diff in diffs:
+            for path in (diff.a_path, diff.b_path):
+                assert path is None or diff in diffs.by_path(path)
+        # END for each diff
+        self.assertEqual(diffs.by_path('this'), diffs.by_path('that'))
+        self.assertEqual(len(diffs.by_path('this')), 1)
+        self.assertEqual(diffs.by_path('does/not/exist'), ())
+
+        # lookups reflect changes to the list
+        renamed = diffs.changes('R')[0]
+        del(diffs[diffs.index(renamed)])
+        self.assertEqual(diffs.by_path('this'), ())
+        self.assertEqual(diffs.changes('R'), ())
+        diffs.append(renamed)
+        self.assertEqual(diffs.changes('R'), (renamed,))
+        diffs[-1] = diffs[0]
+        self.assertEqual(diffs.changes('R'), ())
@@ -291,3 +291,23 @@ class TestFun(TestBase):
     def test_tree_entries_from_data_with_failing_name_decode_py3(self):
         r = tree_entries_from_data(b'100644 \x9f\0aaa')
         assert r == [(b'aaa', 33188, '\udc9f')], r
+
+    def test_tree_entries_from_data(self):
+        self.assertEqual(tree_entries_from_data(b''), [])
+
+        # the result matches the tree written from it, for all trees of the repository
+        odb = self.rorepo.odb
+        for item in self.rorepo.head.commit.tree.traverse(predicate=lambda i, d: i.type == 'tree'):
+            data = odb.stream(item.binsha).read()
+            entries = tree_entries_from_data(data)
+            self.assertEqual(len(entries), len(item))
+            stream = BytesIO()
+            tree_to_stream(entries, stream.write)
+            self.assertEqual(stream.getvalue(), data)
+        # END for each tree
+
+        # names are decoded individually, even if bytes of neighbouring names could form a valid sequence
+        sha = b'\0' * 20
+        data = b'40000 d\xc3\0' + sha + b'100755 \xa4\xc3\xa4\0' + sha + b'160000 sub module\0' + sha
+        expected = [(sha, 0o40000, 'd\udcc3'), (sha, 0o100755, '\udca4\xe4'), (sha, 0o160000, 'sub module')]
+        self.assertEqual(tree_entries_from_data(data), expected)
@@ -4,10 +4,12 @@
 #
 # This module is part of GitPython and is released under
 # the BSD License: http://www.opensource.org/licenses/bsd-license.php
+from multiprocessing.pool import ThreadPool
 import os
 import subprocess
 import sys
 from tempfile import TemporaryFile
+import time
 
 from git import (
     Git,
@@ -167,6 +169,44 @@ class TestGit(TestBase):
         self.assertEqual(typename, typename_two)
         self.assertEqual(size, size_two)
 
+    def test_cat_file_pool(self):
+        git = Git(self.rorepo.working_dir)
+        shas = [b.hexsha for b in self.rorepo.head.commit.tree.traverse() if b.type == 'blob'][:40]
+        expected = {sha: git.get_object_data(sha)[3] for sha in shas}
+        pool = git.cat_file_all
+        self.assertEqual(len(pool), 1)
+
+        # an unread stream keeps its process, the next request is served by another one
+        stream = git.stream_object_data(shas[0])[3]
+        self.assertEqual(git.get_object_data(shas[1])[3], expected[shas[1]])
+        self.assertEqual(len(pool), 2)
+        self.assertEqual(stream.read(), expected[shas[0]])
+
+        # concurrent readers get their own processes, but never more than configured
+        tp = ThreadPool(8)
+        try:
+            results = tp.map(lambda sha: git.get_object_data(sha)[3], shas * 4)
+        finally:
+            tp.close()
+            tp.join()
+        self.assertEqual(results, [expected[sha] for sha in shas * 4])
+        self.assertLessEqual(len(pool), git.CAT_FILE_POOL_SIZE)
+
+        # invalid refs don't spoil the process
+        self.failUnlessRaises(ValueError, git.get_object_header, '0' * 40)
+        self.assertEqual(git.get_object_header(shas[0])[0], shas[0].encode('ascii'))
+        self.assertEqual(len(git.cat_file_header), 1)
+
+        # idle processes are reaped
+        pool.max_idle_time = 0
+        time.sleep(0.01)
+        git.get_object_data(shas[0])
+        self.assertEqual(len(pool), 1)
+
+        git.clear_cache()
+        self.assertEqual(len(pool), 0)
+        self.assertIsNone(git.cat_file_all)
+
     def test_version(self):
         v = self.git.version_info
         self.assertIsInstance(v, tuple)
@@ -5,13 +5,16 @@
 # This module is part of GitPython and is released under
 # the BSD License: http://www.opensource.org/licenses/bsd-license.php
 
+from contextlib import closing
 from io import BytesIO
+import mmap
 import os
 from stat import (
     S_ISLNK,
     ST_MODE
 )
 import tempfile
+import time
 from unittest import skipIf
 
 from git import (
@@ -24,19 +27,25 @@ from git import (
     Diff,
     GitCommandError,
     CheckoutError,
+    CachedObjectDB,
 )
 from git.compat import string_types, is_win, PY3
 from git.exc import (
     HookExecutionError,
     InvalidGitRepositoryError
 )
-from git.index.fun import hook_path
+from git.index.fun import hook_path, read_cache, read_cache_tree, write_cache_tree, stat_to_index_data
 from git.index.typ import (
     BaseIndexEntry,
-    IndexEntry
+    IndexEntry,
+    CE_NAMEMASK,
+    CE_EXTENDED_FLAGS,
+    CE_INTENT_TO_ADD,
+    CE_SKIP_WORKTREE
 )
 from git.objects import Blob
 from git.test.lib import (
+    patch,
     TestBase,
     fixture_path,
     fixture,
@@ -46,6 +55,7 @@ from git.test.lib import with_rw_directory
 from git.util import Actor, rmtree
 from git.util import HIDE_WINDOWS_KNOWN_ERRORS, hex_to_bin
 from gitdb.base import IStream
+from gitdb.db import MemoryDB
 
 import os.path as osp
 from git.cmd import Git
@@ -136,6 +146,86 @@ class TestIndex(TestBase):
             self.assertEqual(fp.read(), fixture("index_merge"))
         os.remove(tmpfile)
 
+    @with_rw_directory
+    def test_read_cache(self, rw_dir):
+        # memory maps and other streams are read alike
+        for name in ("index", "index_merge"):
+            with open(fixture_path(name), 'rb') as fp:
+                with closing(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)) as data:
+                    result = read_cache(data)
+                    self.assertEqual(data.tell(), len(data))
+            # END read mapped fixture
+            self.assertEqual(result, read_cache(BytesIO(fixture(name))))
+        # END for each fixture
+
+        # paths which don't fit into the flags end at a NULL byte, non-ascii paths are decoded
+        r = Repo.init(rw_dir)
+        sha = r.odb.store(IStream(Blob.type, 4, BytesIO(b'data'))).hexsha.decode('ascii')
+        paths = ['/'.join(['directory_%03i' % i for i in range(500)]) + '/file', u'\xe4\xf6\xfc', 'a']
+        for path in paths:
+            r.git.update_index('--add', '--cacheinfo', '100644,%s,%s' % (sha, path))
+        # END for each path
+        index = IndexFile(r)
+        self.assertEqual(sorted(index.entries), sorted((path, 0) for path in paths))
+        self.assertEqual(index.entries[(paths[0], 0)].flags & CE_NAMEMASK, CE_NAMEMASK)
+        assert all(e.hexsha == sha for e in index.entries.values())
+
+    @with_rw_directory
+    def test_index_versions(self, rw_dir):
+        r = Repo.init(rw_dir)
+        paths = ['a', 'dir/file', 'dir/file2', 'dir/sub/file', u'dir/\xe4\xf6\xfc', 'dirfile', 'z' * 5000]
+        for path in paths:
+            r.git.update_index('--add', '--cacheinfo', '100644,%s,%s' % (r.git.hash_object('-w', __file__), path))
+        # END for each path
+        r.git.update_index('--skip-worktree', 'dir/file2')
+        with open(osp.join(rw_dir, 'b'), 'w') as fp:
+            fp.write('added later')
+        r.git.add('b', intent_to_add=True)
+        listing = r.git.ls_files('-s', '-v', '--debug')
+
+        # git writes version 3 if entries have extended flags, it is used instead of version 2
+        for version in (4, 3, 4, 2, 4):
+            r.git.update_index('--index-version', str(version))
+            with open(r.index.path, 'rb') as fp:
+                data = fp.read()
+            # END read index written by git
+            index = IndexFile(r)
+            self.assertEqual(sorted(path for path, _ in index.entries), sorted(paths + ['b']))
+            self.assertEqual(index.version, version == 2 and 3 or version)
+            self.assertEqual(index.entries[('dir/file2', 0)].flags & CE_SKIP_WORKTREE, CE_SKIP_WORKTREE)
+            self.assertEqual(index.entries[('b', 0)].flags & CE_EXTENDED_FLAGS, CE_INTENT_TO_ADD)
+
+            # the same version is written just like git writes it
+            index.write()
+            with open(index.path, 'rb') as fp:
+                self.assertEqual(fp.read(), data)
+            # END compare index
+
+            # and other versions are read by git, entries with extended flags still need version 3
+            index.write(version=version == 4 and 2 or 4)
+            self.assertEqual(index.version, version == 4 and 3 or 4)
+            with open(index.path, 'rb') as fp:
+                self.assertEqual(read_cache(fp)[0], index.version)
+            self.assertEqual(r.git.ls_files('-s', '-v', '--debug'), listing)
+            self.assertEqual(IndexFile(r).entries, index.entries)
+        # END for each version
+
+        # version 4 shrinks the index, without extended flags version 2 is written
+        del index.entries[('b', 0)]
+        del index.entries[('dir/file2', 0)]
+        index.write(version=3)
+        self.assertEqual(index.version, 2)
+        with open(index.path, 'rb') as fp:
+            self.assertEqual(read_cache(fp)[0], 2)
+        index.write()
+        self.assertEqual(index.version, 2)
+        with open(index.path, 'rb') as fp:
+            self.assertEqual(read_cache(fp)[0], 2)
+        size = osp.getsize(index.path)
+        index.write(version=4)
+        assert osp.getsize(index.path) < size
+        self.failUnlessRaises(ValueError, index.write, version=5)
+
     def _cmp_tree_index(self, tree, index):
         # fail unless both objects contain the same paths and blobs
         if isinstance(tree, str):
@@ -773,6 +863,78 @@ class TestIndex(TestBase):
             self.assertEqual(index.write_tree(), orig_tree)
         # END for each commit
     
+    @with_rw_directory
+    def test_write_tree_cache_tree(self, rw_dir):
+        r = Repo.init(rw_dir)
+        paths = ['a-b', 'a.txt', 'a/b/c/file', 'a/b/file', 'a/file', 'd/file', 'd/file2', 'e.f/file', 'e/file']
+        for path in paths:
+            fp = osp.join(rw_dir, path)
+            if not osp.isdir(osp.dirname(fp)):
+                os.makedirs(osp.dirname(fp))
+            with open(fp, 'w') as fd:
+                fd.write(path)
+        # END for each path
+        r.git.add('.')
+        tree_sha = r.git.write_tree()
+
+        # git wrote the TREE extension, which is read and written just like git writes it
+        index = IndexFile(r)
+        with open(index.path, 'rb') as fp:
+            data = fp.read()
+        _version, _entries, extension_data, _sha = read_cache(BytesIO(data))
+        cache_tree, other_extension_data = read_cache_tree(extension_data)
+        self.assertEqual(cache_tree, index.entries.cache_tree)
+        self.assertEqual(sorted(cache_tree), ['', 'a', 'a/b', 'a/b/c', 'd', 'e', 'e.f'])
+        self.assertEqual(cache_tree[''], (hex_to_bin(tree_sha), len(paths)))
+        self.assertEqual(write_cache_tree(cache_tree) + other_extension_data, extension_data)
+        self.assertEqual(write_cache_tree({}), b'')
+        index.write()
+        with open(index.path, 'rb') as fp:
+            self.assertEqual(fp.read(), data)
+        # END compare index
+
+        stored = []
+        store = MemoryDB.store
+
+        def counting_store(self, istream):
+            stored.append(istream)
+            return store(self, istream)
+        # END utility
+
+        with patch.object(MemoryDB, 'store', counting_store):
+            self.assertEqual(index.write_tree().hexsha, tree_sha)
+            self.assertEqual(stored, [])
+
+            # only directories containing changed entries are written again
+            with open(osp.join(rw_dir, 'a/b/file'), 'w') as fp:
+                fp.write('changed')
+            index.add(['a/b/file', 'd/file'])
+            self.assertEqual(index.entries.cache_tree['a/b'], (None, -1))
+            self.assertEqual(index.entries.cache_tree['d'], cache_tree['d'])
+            tree = index.write_tree()
+            self.assertEqual(len(stored), 3)
+            self.assertEqual(tree, r.tree(r.git.write_tree()))
+            self.assertEqual(index.write_tree(), tree)
+            self.assertEqual(len(stored), 3)
+
+            # entries changed directly, and written indices, invalidate and keep cached trees alike
+            del index.entries[('e/file', 0)]
+            entry = index.entries[('a/file', 0)]
+            entry = IndexEntry.from_base(BaseIndexEntry((entry.mode, entry.binsha, 0, 'e.f/file')))
+            index.entries[('e.f/file', 0)] = entry
+            index.write()
+            self.assertEqual(IndexFile(r).entries.cache_tree, index.entries.cache_tree)
+            tree = index.write_tree()
+            self.assertEqual(tree, r.tree(r.git.write_tree()))
+            self.assertEqual(len(stored), 5)
+        # END count stored trees
+
+        # missing trees are written again
+        index.entries.invalidate('a/b/c/file')
+        index.entries.cache_tree['a/b/c'] = (b'\1' * 20, 1)
+        self.assertEqual(index.write_tree(), tree)
+        self.assertEqual(index.entries.cache_tree['a/b/c'], cache_tree['a/b/c'])
+
     @with_rw_repo('HEAD', bare=False)
     def test_index_single_addremove(self, rw_repo):
         fp = osp.join(rw_repo.working_dir, 'testfile.txt')
@@ -836,6 +998,112 @@ class TestIndex(TestBase):
         r.index.add([fp])
         r.index.commit('Added orig and prestable')
 
+    @with_rw_directory
+    def test_add_skips_unchanged_files(self, rw_dir):
+        r = Repo.init(rw_dir)
+        paths = ['a', 'dir/b', 'dir/c']
+        past = time.time() - 100
+        for path in paths:
+            fp = osp.join(rw_dir, path)
+            if not osp.isdir(osp.dirname(fp)):
+                os.makedirs(osp.dirname(fp))
+            with open(fp, 'w') as fd:
+                fd.write(path)
+            os.utime(fp, (past, past))
+        # END for each path
+
+        index = r.index
+        index.add(paths)
+        self.assertEqual((index.hashed, index.skipped), (3, 0))
+        # the stat data of the files is kept, git considers them unchanged
+        assert all(e.mtime[0] == int(past) and e.size == len(e.path) for e in index.entries.values())
+        self.assertEqual(r.git.diff_files(name_only=True), '')
+
+        # files whose stat data didn't change since the index was written aren't hashed again
+        index = IndexFile(r)
+        progress = []
+        added = index.add(paths, fprogress=lambda *args: progress.append(args[:2]))
+        self.assertEqual((index.hashed, index.skipped), (0, 3))
+        self.assertEqual(added, [index.entries[(path, 0)] for path in paths])
+        self.assertEqual(progress, [(path, done) for path in paths for done in (False, True)])
+
+        # changes are noticed by the changed stat data, files changed after the index was written are racy
+        with open(osp.join(rw_dir, 'a'), 'w') as fd:
+            fd.write('b')
+        os.utime(osp.join(rw_dir, 'a'), (past, past))
+        os.utime(osp.join(rw_dir, 'dir/b'), (past + 200, past + 200))
+        index = IndexFile(r)
+        index.add(paths, write=False)
+        self.assertEqual((index.hashed, index.skipped), (2, 1))
+        self.assertEqual(index.entries[('a', 0)].binsha, r.odb.store(IStream(Blob.type, 1, BytesIO(b'b'))).binsha)
+
+        # racy entries whose files changed without changing their stat data are written with a size of 0
+        fp = osp.join(rw_dir, 'dir/c')
+        entry = index.entries[('dir/c', 0)]
+        index = IndexFile(r)
+        os.utime(fp, (past + 200, past + 200))
+        index.entries[('dir/c', 0)] = IndexEntry(entry[:4] + stat_to_index_data(os.lstat(fp)))
+        index.write()
+        self.assertEqual(index.entries[('dir/c', 0)].size, len('dir/c'))
+        index.entries[('dir/c', 0)] = IndexEntry((entry.mode, entry.binsha[::-1]) + entry[2:4] +
+                                                 stat_to_index_data(os.lstat(fp)))
+        index.write()
+        self.assertEqual(index.entries[('dir/c', 0)].size, 0)
+        self.assertEqual(r.git.status(porcelain=True, untracked_files='no'), 'A  a\nA  dir/b\nAM dir/c')
+
+    @with_rw_directory
+    def test_add_with_workers(self, rw_dir):
+        r = Repo.init(rw_dir)
+        paths = ['dir_%i/file_%i' % (i % 7, i) for i in range(100)]
+        past = time.time() - 100
+        for i, path in enumerate(paths):
+            fp = osp.join(rw_dir, path)
+            if not osp.isdir(osp.dirname(fp)):
+                os.makedirs(osp.dirname(fp))
+            with open(fp, 'w') as fd:
+                fd.write('content %i\n' % (i % 50) * i)
+            os.utime(fp, (past, past))
+        # END for each path
+
+        # the first workers store objects through a wrapping database
+        odb = r.odb
+        r.odb = CachedObjectDB(odb)
+        results = []
+        for workers in (4, 2, None):
+            index = IndexFile(r, osp.join(rw_dir, 'index_%s' % workers))
+            progress = []
+            with patch.object(IndexFile, '_store_loose', autospec=True,
+                              side_effect=IndexFile._store_loose) as store_loose:
+                added = index.add(paths, fprogress=lambda *args: progress.append(args[:2]), workers=workers)
+            # loose objects are stored by the workers themselves, if files are stored concurrently
+            concurrent = (workers or os.cpu_count() or 1) > 1
+            self.assertEqual(store_loose.call_count, len(paths) if concurrent else 0)
+            r.odb = odb
+            self.assertEqual([e.path for e in added], paths)
+            self.assertEqual((index.hashed, index.skipped), (len(paths), 0))
+            # every file is announced before it is done, and is done in the order of the paths
+            self.assertEqual([path for path, done in progress if done], paths)
+            assert all(progress.index((path, False)) < progress.index((path, True)) for path in paths)
+            results.append((added, index.write_tree()))
+        # END for each amount of workers
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0], results[2])
+        objects_dir = osp.join(r.git_dir, 'objects')
+        assert all(os.listdir(osp.join(objects_dir, name)) for name in os.listdir(objects_dir) if len(name) == 2)
+        # objects stored by the workers are read by git like any other
+        self.assertEqual(r.git.fsck(no_dangling=True), '')
+        for entry in results[0][0][::10]:
+            with open(osp.join(rw_dir, entry.path), 'rb') as fd:
+                self.assertEqual(r.odb.stream(entry.binsha).read(), fd.read())
+        # END for each entry
+        r.index.add(paths)
+        self.assertEqual(r.index.write_tree(), results[0][1])
+
+        # unchanged files are skipped by the workers as well
+        index = IndexFile(r, osp.join(rw_dir, 'index_4'))
+        self.assertEqual([e.binsha for e in index.add(paths, workers=4)], [e.binsha for e in results[0][0]])
+        self.assertEqual((index.hashed, index.skipped), (0, len(paths)))
+
     @with_rw_directory
     def test_add_a_file_with_wildcard_chars(self, rw_dir):
         # see issue #407
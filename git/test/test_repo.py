@@ -10,6 +10,7 @@ from io import BytesIO
 import itertools
 import os
 import pickle
+import random
 import tempfile
 from unittest import skipIf, SkipTest
 
@@ -34,7 +35,9 @@ from git import (
     GitCmdObjectDB,
     Remote,
     BadName,
-    GitCommandError
+    GitCommandError,
+    NULL_TREE,
+    BlameCache
 )
 from git.compat import (
     PY3,
@@ -45,12 +48,13 @@ from git.compat import (
 from git.exc import (
     BadObject,
 )
-from git.repo.fun import touch
+from git.repo.fun import touch, is_ancestor_many
 from git.test.lib import (
     patch,
     TestBase,
     with_rw_repo,
     fixture,
+    StringProcessAdapter,
     assert_false,
     assert_equal,
     assert_true,
@@ -145,8 +149,29 @@ class TestRepo(TestBase):
         # try from invalid revision that does not exist
         self.failUnlessRaises(BadName, self.rorepo.tree, 'hello world')
 
-    def test_pickleable(self):
+    @with_rw_directory
+    def test_pickleable(self, rw_dir):
         pickle.loads(pickle.dumps(self.rorepo))
+        self.rorepo.tree_path_cache[(b'\0' * 20, 'path')] = None
+        repo = pickle.loads(pickle.dumps(self.rorepo))
+        self.assertEqual(len(repo.tree_path_cache), 0)
+        self.assertEqual(repo.tree_path_cache.max_entries, self.rorepo.tree_path_cache.max_entries)
+
+        # a commit-graph which was read already is read again once needed
+        repo = Repo.init(rw_dir)
+        for i in range(3):
+            repo.index.commit('commit %i' % i)
+        repo.git.commit_graph('write', '--reachable')
+        repo = Repo(rw_dir)
+        self.assertEqual(len(repo.head.commit.parents), 1)
+        assert repo.commit_graph is not None
+
+        other = pickle.loads(pickle.dumps(repo))
+        assert other._commit_graph is False
+        self.assertEqual(other.head.commit.parents, repo.head.commit.parents)
+        assert other.commit_graph is not None
+        repo.close()
+        other.close()
 
     def test_commit_from_revision(self):
         commit = self.rorepo.commit('0.1.4')
@@ -447,7 +472,7 @@ class TestRepo(TestBase):
     def test_blame_incremental(self, git):
         # loop over two fixtures, create a test fixture for 2.11.1+ syntax
         for git_fixture in ('blame_incremental', 'blame_incremental_2.11.1_plus'):
-            git.return_value = fixture(git_fixture)
+            git.return_value = StringProcessAdapter(fixture(git_fixture))
             blame_output = self.rorepo.blame_incremental('9debf6b0aafb6f7781ea9d1383c86939a1aacde3', 'AUTHORS')
             blame_output = list(blame_output)
             self.assertEqual(len(blame_output), 5)
@@ -466,6 +491,87 @@ class TestRepo(TestBase):
             orig_ranges = flatten([entry.orig_linenos for entry in blame_output])
             self.assertEqual(orig_ranges, flatten([range(2, 3), range(14, 15), range(1, 2), range(2, 13), range(13, 15)]))   # noqa E501
 
+    def test_blame_incremental_streaming(self):
+        entries = self.rorepo.blame_incremental('HEAD', 'git/diff.py')
+        first = next(entries)
+        entries = [first] + list(entries)
+        lines = sorted(lineno for entry in entries for lineno in entry.linenos)
+        self.assertEqual(lines, list(range(1, len(lines) + 1)))
+        self.assertEqual(len(lines), len(self.rorepo.head.commit.tree['git/diff.py'].data_stream.read().splitlines()))
+
+        output = self.rorepo.git.blame('HEAD', '--', 'git/diff.py', p=True, incremental=True, stdout_as_string=False)
+        expected = list(self.rorepo._iter_blame_incremental(BytesIO(output)))
+        self.assertEqual([(e.commit, e.linenos, e.orig_path, e.orig_linenos) for e in entries],
+                         [(e.commit, e.linenos, e.orig_path, e.orig_linenos) for e in expected])
+
+        # errors are raised once the output was read
+        self.failUnlessRaises(GitCommandError, list, self.rorepo.blame_incremental('HEAD', 'does-not-exist'))
+
+    @with_rw_directory
+    def test_blame_cache(self, rw_dir):
+        r = Repo.init(rw_dir)
+        r.git.config('user.name', 'First Author')
+        r.git.config('user.email', 'first@example.com')
+        path = osp.join(rw_dir, 'file.txt')
+        lines = ['line %i\n' % i for i in range(20)]
+        for i, (start, end, new) in enumerate(((0, 0, []), (3, 5, ['changed\n']), (0, 0, ['top\n', '\n']),
+                                               (10, 10, ['\n', 'inserted\n']), (21, 24, []), (0, 0, []),
+                                               (5, 6, ['last\n']))):
+            lines[start:end] = new
+            with open(path, 'w') as fp:
+                fp.write(''.join(lines))
+            r.git.add('file.txt')
+            r.git.commit('--allow-empty', m='commit %i' % i, author='Author %i <author%i@example.com>' % (i, i))
+        # END for each commit
+        commits = list(r.iter_commits())[::-1]
+
+        def as_tuples(blames):
+            return [(c.hexsha, c.author.name, c.author.email, c.authored_date, c.committer.name, c.committed_date,
+                     lines) for c, lines in blames]
+        # END utility
+
+        expected = [as_tuples(r.blame(c, 'file.txt')) for c in commits]
+        cache_dir = osp.join(r.git_dir, 'blame-cache')
+        r.blame_cache = cache = BlameCache(cache_dir)
+        self.assertEqual(as_tuples(r.blame(commits[1], 'file.txt')), expected[1])
+        self.assertEqual((cache.hits, cache.derived, cache.misses), (0, 0, 1))
+        # derived from the cached blame of an ancestor, reading the cache once done
+        for c, blames in list(zip(commits, expected))[3:]:
+            self.assertEqual(as_tuples(r.blame(c.hexsha, 'file.txt')), blames)
+            self.assertEqual(as_tuples(r.blame(c, './file.txt')), blames)
+        # END for each commit
+        self.assertEqual((cache.hits, cache.derived, cache.misses), (4, 4, 1))
+        assert cache.size > 0
+
+        # a new instance uses the same files, older commits and other arguments are passed to git
+        r.blame_cache = cache = BlameCache(cache_dir)
+        self.assertEqual(as_tuples(r.blame(commits[-1], 'file.txt')), expected[-1])
+        self.assertEqual(as_tuples(r.blame(commits[0], 'file.txt')), expected[0])
+        self.assertEqual(as_tuples(r.blame(commits[-1], 'file.txt', w=True)), expected[-1])
+        self.assertEqual((cache.hits, cache.derived, cache.misses), (1, 0, 1))
+
+        # merges and renames aren't derived
+        r.git.checkout('-b', 'side', commits[-2].hexsha)
+        r.git.mv('file.txt', 'renamed.txt')
+        r.git.commit(m='rename')
+        r.git.checkout('master')
+        r.git.merge('side', '--no-edit')
+        r.git.commit('--allow-empty', m='after merge')
+        self.assertEqual(as_tuples(r.blame('HEAD', 'renamed.txt')), as_tuples(r.blame('HEAD', 'renamed.txt', w=True)))
+        self.assertEqual(as_tuples(r.blame('side', 'renamed.txt')), as_tuples(r.blame('side', 'renamed.txt', w=True)))
+        self.assertEqual((cache.hits, cache.derived, cache.misses), (1, 0, 3))
+
+        # the least recently used files are removed
+        cache.max_bytes = cache.size // 2
+        r.blame('HEAD~', 'renamed.txt')
+        assert cache.evictions > 0 and 0 < cache.size <= cache.max_bytes
+        hits = cache.hits
+        self.assertEqual(as_tuples(r.blame('HEAD~', 'renamed.txt')), as_tuples(r.blame('HEAD~', 'renamed.txt', w=True)))
+        self.assertEqual(cache.hits, hits + 1)
+        cache.clear()
+        self.assertEqual(cache.size, 0)
+        assert not osp.exists(cache_dir)
+
     @patch.object(Git, '_call_process')
     def test_blame_complex_revision(self, git):
         git.return_value = fixture('blame_complex_revision')
@@ -965,6 +1071,102 @@ class TestRepo(TestBase):
         for i, j in itertools.permutations([c1, 'ffffff', ''], r=2):
             self.assertRaises(GitCommandError, repo.is_ancestor, i, j)
 
+    @with_rw_directory
+    def test_in_process_ancestry(self, rw_dir):
+        # a random history with merges, skewed commit dates and two root commits
+        rng = random.Random(42)
+        repo = Repo.init(rw_dir)
+        tree = repo.index.write_tree()
+        commits = []
+        for i in range(40):
+            num_parents = rng.choice((0, 1, 1, 1, 2, 2, 3)) if i not in (0, 20) else 0
+            parents = rng.sample(commits, min(num_parents, len(commits)))
+            commits.append(Commit.create_from_tree(repo, tree, str(i), parents,
+                                                   commit_date='%i +0000' % rng.randint(1000000, 2000000)))
+            repo.create_head('c%i' % i, commits[-1])
+        # END for each commit
+
+        def git_merge_bases(*revs):
+            try:
+                return set(repo.git.merge_base(*revs, all=True).split())
+            except GitCommandError:
+                return set()
+        # END utility
+
+        def git_is_ancestor(a, b):
+            try:
+                repo.git.merge_base(a, b, is_ancestor=True)
+                return True
+            except GitCommandError:
+                return False
+        # END utility
+
+        pairs = [tuple(rng.sample(commits, 2)) for _ in range(60)] + [(commits[5], commits[5])]
+        triples = [rng.sample(commits, 3) for _ in range(10)]
+        expected_ancestors = [git_is_ancestor(a, b) for a, b in pairs]
+        expected_bases = [git_merge_bases(a, b) for a, b in pairs] + [git_merge_bases(*t) for t in triples]
+        assert any(expected_ancestors) and not all(expected_ancestors)
+        assert any(len(bases) > 1 for bases in expected_bases) and not all(expected_bases)
+
+        for write_commit_graph in (False, True):
+            if write_commit_graph:
+                repo.git.commit_graph('write', '--reachable')
+                repo.close()
+                assert repo.commit_graph is not None
+            # END write commit-graph
+
+            self.assertEqual(repo.is_ancestor_many(pairs), expected_ancestors)
+            # single queries are answered in-process only if the generation numbers bound the walk
+            with patch('git.repo.base.is_ancestor_many', wraps=is_ancestor_many) as walk:
+                self.assertEqual([repo.is_ancestor(a, b) for a, b in pairs], expected_ancestors)
+            self.assertEqual(walk.call_count, len(pairs) if write_commit_graph else 0)
+            self.assertEqual(repo.is_ancestor_many([]), [])
+
+            for revs, bases in zip(pairs + [tuple(t) for t in triples], expected_bases):
+                self.assertEqual(set(c.hexsha for c in repo.merge_base(*revs, all=True)), bases)
+                res = repo.merge_base(*revs)
+                self.assertEqual(len(res), min(len(bases), 1))
+                assert not res or res[0].hexsha in bases
+            # END for each merge base query
+        # END for each commit-graph state
+
+        # invalid revisions are reported by git
+        self.failUnlessRaises(GitCommandError, repo.merge_base, commits[0], 'ffffff')
+        self.failUnlessRaises(GitCommandError, repo.is_ancestor, commits[0], '')
+        self.failUnlessRaises(BadName, repo.is_ancestor_many, [(commits[0], 'ffffff')])
+
+    def test_diff_many(self):
+        commits = list(self.rorepo.iter_commits('HEAD', max_count=40))
+        pairs = [(c, c.parents[0]) for c in commits if c.parents]
+        pairs.append((commits[0].hexsha, NULL_TREE))
+        pairs.append((commits[0].tree, commits[-1].tree.hexsha))
+
+        def summary(index):
+            return sorted((d.a_path or '', d.b_path or '', d.change_type, d.diff) for d in index)
+        # end utility
+
+        expected = [summary(self.rorepo.rev_parse(str(a)).diff(b, create_patch=True)) for a, b in pairs]
+        for workers in (1, 3):
+            results = list(self.rorepo.diff_many(pairs, workers=workers, create_patch=True))
+            self.assertEqual([pair for pair, _ in results], pairs)
+            self.assertEqual([summary(index) for _, index in results], expected)
+
+            results = list(self.rorepo.diff_many(iter(pairs), workers=workers, create_patch=True, ordered=False))
+            self.assertEqual(sorted(pairs.index(pair) for pair, _ in results), list(range(len(pairs))))
+            for pair, index in results:
+                self.assertEqual(summary(index), expected[pairs.index(pair)])
+            # END for each unordered result
+        # END for each amount of workers
+
+        results = self.rorepo.diff_many(pairs[:4], numstat=True, paths='git')
+        for (a, b), index in results:
+            self.assertEqual([(d.b_path, d.insertions, d.deletions) for d in index],
+                             [(d.b_path, d.insertions, d.deletions) for d in a.diff(b, numstat=True, paths='git')])
+        # END for each numstat result
+
+        self.assertEqual(list(self.rorepo.diff_many([])), [])
+        self.failUnlessRaises(GitCommandError, list, self.rorepo.diff_many([(commits[0], 'ffffff')]))
+
     @with_rw_directory
     def test_git_work_tree_dotgit(self, rw_dir):
         """Check that we find .git as a worktree file and find the worktree
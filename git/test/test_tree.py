@@ -10,7 +10,8 @@ from unittest import skipIf
 
 from git import (
     Tree,
-    Blob
+    Blob,
+    TreePathCache
 )
 from git.test.lib import TestBase
 from git.util import HIDE_WINDOWS_KNOWN_ERRORS
@@ -106,3 +107,54 @@ class TestTree(TestBase):
             assert root[item.path] == item == root / item.path
         # END for each item
         assert found_slash
+
+    def test_join(self):
+        commit = self.rorepo.head.commit
+        root = commit.tree
+        self.rorepo.tree_path_cache = cache = TreePathCache()
+        try:
+            items = list(root.traverse())
+            paths = [item.path for item in items]
+            for expected in items:
+                item = root / expected.path
+                self.assertEqual((item.path, item.binsha, item.mode), (expected.path, expected.binsha, expected.mode))
+            # END for each item
+            assert len(cache) >= len(paths)
+
+            # missing paths, paths through blobs and empty path components raise
+            blob = root.blobs[0]
+            for path in ('does-not-exist', blob.path + '/file', '/' + blob.path, root.trees[0].path + '/', ''):
+                self.failUnlessRaises(KeyError, root.join, path)
+            # END for each invalid path
+
+            # results of subtrees are cached by their binsha, which allows other trees containing them to reuse them
+            tree = root.trees[0]
+            path = [p for p in paths if p.startswith(tree.path + '/')][-1]
+            item = root / path
+            self.assertEqual(cache[(tree.binsha, path[len(tree.path) + 1:])], (item.binsha, item.mode))
+            self.assertIsNone(cache[(root.binsha, 'does-not-exist')])
+
+            # the least recently used entries are dropped
+            self.rorepo.tree_path_cache = cache = TreePathCache(max_entries=2)
+            root.join(paths[-1])
+            root.join(blob.path)
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(list(cache._cache)[-1], (root.binsha, blob.path))
+        finally:
+            self.rorepo.tree_path_cache = None
+        # END restore cache
+
+    def test_join_altered_tree(self):
+        root = self.rorepo.head.commit.tree
+        blob = root.blobs[0]
+        self.assertEqual(root.join(blob.name), blob)
+
+        # lookups see the altered entries, and are not cached by binsha anymore
+        root = self.rorepo.commit(self.rorepo.head.commit.hexsha).tree
+        mod = root.cache
+        del(mod[blob.name])
+        mod.add(blob.binsha, blob.mode, 'new-name')
+        mod.set_done()
+        self.failUnlessRaises(KeyError, root.join, blob.name)
+        self.assertEqual(root.join('new-name').binsha, blob.binsha)
+        self.assertEqual(self.rorepo.head.commit.tree.join(blob.name), blob)
@@ -28,7 +28,7 @@ from gitdb.util import (# NOQA @IgnorePep8
     hex_to_bin,             # @UnusedImport
 )
 
-from git.compat import is_win
+from git.compat import is_win, safe_decode
 import os.path as osp
 
 from .compat import (
@@ -660,10 +660,17 @@ class Stats(object):
     def _list_from_string(cls, repo, text):
         """Create a Stat object from output retrieved by git-diff.
 
+        :return: git.Stat"""
+        return cls._from_numstat(line.split("\t") for line in text.splitlines())
+
+    @classmethod
+    def _from_numstat(cls, entries):
+        """Create a Stat object from tuple(raw_insertions, raw_deletions, filename) entries as
+        printed by git-diff --numstat, with '-' being used for binary files.
+
         :return: git.Stat"""
         hsh = {'total': {'insertions': 0, 'deletions': 0, 'lines': 0, 'files': 0}, 'files': {}}
-        for line in text.splitlines():
-            (raw_insertions, raw_deletions, filename) = line.split("\t")
+        for (raw_insertions, raw_deletions, filename) in entries:
             insertions = raw_insertions != '-' and int(raw_insertions) or 0
             deletions = raw_deletions != '-' and int(raw_deletions) or 0
             hsh['total']['insertions'] += insertions
@@ -676,6 +683,75 @@ class Stats(object):
         return Stats(hsh['total'], hsh['files'])
 
 
+_c_style_escapes = {7: b'\\a', 8: b'\\b', 9: b'\\t', 10: b'\\n', 11: b'\\v', 12: b'\\f', 13: b'\\r',
+                    34: b'\\"', 92: b'\\\\'}
+
+
+def quote_path(path, quote_non_ascii=True):
+    """:return: the given path as shown by git commands not using -z, which put paths with special
+        characters in double quotes and escape these characters like C does.
+    :param path: bytes of the path
+    :param quote_non_ascii: if True, bytes which are not ascii are escaped as well, see core.quotePath"""
+    quoted = []
+    needs_quotes = False
+    for c in bytearray(path):
+        if c in _c_style_escapes:
+            quoted.append(_c_style_escapes[c])
+        elif c < 0x20 or c == 0x7f or (c >= 0x80 and quote_non_ascii):
+            quoted.append(('\\%03o' % c).encode('ascii'))
+        else:
+            quoted.append(bytes(bytearray((c,))))
+            continue
+        needs_quotes = True
+    # END for each byte
+    if not needs_quotes:
+        return safe_decode(path)
+    return safe_decode(b'"' + b''.join(quoted) + b'"')
+
+
+def pprint_rename(a, b, quote_non_ascii=True):
+    """:return: the name git-diff --numstat shows for a file renamed from a to b, like
+        'dir/{old => new}/file' if both names share leading or trailing directories, or 'old => new'
+    :param a: bytes of the source path
+    :param b: bytes of the destination path
+    :param quote_non_ascii: see quote_path"""
+    quoted_a, quoted_b = quote_path(a, quote_non_ascii), quote_path(b, quote_non_ascii)
+    if quoted_a.startswith('"') or quoted_b.startswith('"'):
+        return '%s => %s' % (quoted_a, quoted_b)
+
+    a, b = bytearray(a), bytearray(b)
+    len_a, len_b = len(a), len(b)
+    slash = ord('/')
+
+    # common prefix, up to and including its last slash
+    pfx_length = 0
+    for i, (ca, cb) in enumerate(zip(a, b)):
+        if ca != cb:
+            break
+        if ca == slash:
+            pfx_length = i + 1
+    # END for each common character
+
+    # common suffix, starting with a slash, which may be the last one of the prefix
+    sfx_length = 0
+    ia, ib = len_a - 1, len_b - 1
+    min_index = pfx_length - (pfx_length and 1)
+    while ia >= min_index and ib >= min_index and a[ia] == b[ib]:
+        if a[ia] == slash:
+            sfx_length = len_a - ia
+        ia -= 1
+        ib -= 1
+    # END while there is a common suffix
+
+    a_mid = a[pfx_length:max(pfx_length, len_a - sfx_length)]
+    b_mid = b[pfx_length:max(pfx_length, len_b - sfx_length)]
+    if pfx_length + sfx_length:
+        name = a[:pfx_length] + b'{' + a_mid + b' => ' + b_mid + b'}' + a[len_a - sfx_length:]
+    else:
+        name = a_mid + b' => ' + b_mid
+    return safe_decode(bytes(name))
+
+
 class IndexFileSHA1Writer(object):
 
     """Wrapper around a file-like object that remembers the SHA1 of